@@ -45,6 +45,52 @@ options:
         description:
             - dict which maps filesystem names to additional mkfs options that should be used
               when creating a disk volume (that is, a whole disk filesystem)
+    scoped_populate:
+        description:
+            - boolean indicating that blivet should only probe the disks referenced by the
+              pools and volumes (and the devices stacked on or under them) instead of every
+              block device in the system
+    populate_include:
+        description:
+            - list of shell-style patterns matching names of additional disks to probe when
+              scoped_populate is enabled
+    populate_exclude:
+        description:
+            - list of shell-style patterns matching names of disks never to probe when
+              scoped_populate is enabled
+    result_file:
+        description:
+            - path of a file in which to keep the result of the last successful run for
+              check_unchanged
+    emit_plan:
+        description:
+            - boolean indicating that the actions, mounts and crypttab entries of the run should
+              be returned as a versioned plan, along with a fingerprint of the storage it was
+              made for; meant to be used in check mode
+    apply_plan:
+        description:
+            - plan returned by an earlier run with emit_plan; the run fails without changing
+              anything unless the specification, the storage and the scheduled actions all
+              match the plan
+    trace_commands:
+        description:
+            - boolean indicating that the programs blivet and libblockdev run should be
+              recorded and returned in command_trace, with passphrases masked
+    profile:
+        description:
+            - path of a directory on the managed host; when set, the module runs under cProfile
+              and tracemalloc, writes the profile and the memory report there and returns the
+              hottest functions in profile. Defaults to the STORAGE_LSR_PROFILE environment variable
+    check_unchanged:
+        description:
+            - boolean indicating that the module should only check, without probing any devices,
+              whether the host's storage is still as the last successful run with the same
+              parameters left it; the result of that run is returned with unchanged set if so
+    record_result:
+        description:
+            - result of a successful run with the same parameters, to be saved for check_unchanged
+              along with a fingerprint of the host's storage; passed once the mounts and
+              crypttab entries of the run are in place
 
 author:
     - David Lehman (@dwlehman)
@@ -103,10 +149,38 @@ volumes:
     returned: success
     type: list
     elements: dict
+profile:
+    description: paths of the profile and memory report, the peak memory use and the hottest
+                 functions, when profile is set
+    returned: always
+    type: dict
+command_trace:
+    description: the programs run for the module with their arguments, start time, duration, exit
+                 status and action, plus the number of runs and time spent per tool, when
+                 trace_commands is set
+    returned: always
+    type: dict
+timings:
+    description: wall-clock and CPU seconds spent in each phase, seconds spent on each pool and
+                 volume and the number of devices found
+    returned: always
+    type: dict
+unchanged:
+    description: whether check_unchanged found the storage as the last run left it
+    returned: success
+    type: bool
+plan:
+    description: the versioned plan of the run, when emit_plan is set
+    returned: success
+    type: dict
 '''
 
+import functools
+import hashlib
+import json
 import logging
 import os
+import sys
 import traceback
 import inspect
 
@@ -120,10 +194,11 @@ try:
     from blivet3 import devices
     from blivet3.flags import flags as blivet_flags
     from blivet3.formats import get_format
+    from blivet3.formats import luks as luks_formats
     from blivet3.partitioning import do_partitioning
     from blivet3.size import Size
-    from blivet3.udev import trigger
-    from blivet3.util import set_up_logging
+    from blivet3.udev import settle
+    from blivet3.util import run_program, run_program_and_capture_output, set_up_logging
     BLIVET_PACKAGE = 'blivet3'
 except ImportError:
     LIB_IMP_ERR3 = traceback.format_exc()
@@ -133,49 +208,495 @@ except ImportError:
         from blivet import devices
         from blivet.flags import flags as blivet_flags
         from blivet.formats import get_format
+        from blivet.formats import luks as luks_formats
         from blivet.partitioning import do_partitioning
         from blivet.size import Size
-        from blivet.udev import trigger
-        from blivet.util import set_up_logging
+        from blivet.udev import settle
+        from blivet.util import run_program, run_program_and_capture_output, set_up_logging
         BLIVET_PACKAGE = 'blivet'
     except ImportError:
         LIB_IMP_ERR = traceback.format_exc()
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.storage_lsr.luks import parse_luks_dump
+from ansible.module_utils.storage_lsr.mkfs import merge_options, raid_data_disks, stripe_options
+from ansible.module_utils.storage_lsr.profile import PROFILE_ARGUMENT_SPEC, start_profiler
+from ansible.module_utils.storage_lsr.sysfs import DEV_DISK_BY, DEV_MAPPER, DEV_MD, SYS_CLASS_BLOCK, Sysfs, \
+    get_device_state, get_populate_scope
+from ansible.module_utils.storage_lsr.plan import check_plan, compare_actions, digest, make_plan
+from ansible.module_utils.storage_lsr.timing import Timings
+from ansible.module_utils.storage_lsr.trace import CommandTrace
+from ansible.module_utils.storage_lsr.udev import UdevSync
+from ansible.module_utils.storage_lsr.validate import validate_spec
 
 if BLIVET_PACKAGE:
+    from gi.repository import BlockDev as blockdev
     blivet_flags.debug = True
     set_up_logging()
-    log = logging.getLogger(BLIVET_PACKAGE + ".ansible")
+
+log = logging.getLogger("%s.ansible" % (BLIVET_PACKAGE or "blivet"))
+sysfs = Sysfs()
 
 
 MAX_TRIM_PERCENT = 2
 
+FSTAB_NON_BLOCK_FS_TYPES = set(["autofs", "bpf", "ceph", "cgroup", "cgroup2", "cifs", "configfs",
+                                "debugfs", "devpts", "devtmpfs", "efivarfs", "fuse.glusterfs",
+                                "fuse.sshfs", "glusterfs", "hugetlbfs", "mqueue", "nfs", "nfs4",
+                                "none", "overlay", "proc", "pstore", "ramfs", "securityfs", "smb3",
+                                "smbfs", "sysfs", "tmpfs", "tracefs"])
+ETC_FSTAB = "/etc/fstab"
+CACHE_MODES = ("writethrough", "writeback", "writecache")
+ONLINE_GROW_FS_TYPES = ("xfs", "ext3", "ext4")  # can be grown while mounted
+# LUKS format attributes (and attributes of its pbkdf_args) behind the encryption settings
+LUKS_FORMAT_ATTRS = {"encryption_pbkdf": ("pbkdf_args", "type"),
+                     "encryption_pbkdf_memory": ("pbkdf_args", "max_memory_kb"),
+                     "encryption_pbkdf_iterations": ("pbkdf_args", "iterations"),
+                     "encryption_pbkdf_time": ("pbkdf_args", "time_ms"),
+                     "encryption_sector_size": ("luks_sector_size", None)}
+# mkfs options that skip discarding the device and initializing metadata up front
+FAST_CREATE_MKFS_OPTIONS = {"xfs": [("-K", [])],
+                            "ext2": [("-E", ["nodiscard", "lazy_itable_init=1"])],
+                            "ext3": [("-E", ["nodiscard", "lazy_itable_init=1"])],
+                            "ext4": [("-E", ["nodiscard", "lazy_itable_init=1"])]}
+DEFAULT_RAID_CHUNK_SIZE = 512 * 1024  # mdadm's default
+DEFAULT_STRIPE_SIZE = 64 * 1024  # lvm's default
+LV_INFO_FIELDS = ["lv_name", "segtype", "pool_lv", "cache_mode", "lv_size", "stripes", "stripe_size"]
+HOST_STATE_FILES = [ETC_FSTAB, "/etc/crypttab"]
+SAVED_RESULT_KEYS = ["pools", "volumes", "mounts", "crypts", "leaves", "packages"]
+SECRET_SPEC_KEYS = ["encryption_password"]  # never written to the result file
+
 use_partitions = None  # create partitions on pool backing device disks?
 disklabel_type = None  # user-specified disklabel type
 safe_mode = None       # do not remove any existing devices or formatting
 pool_defaults = dict()
 volume_defaults = dict()
+device_resolver = None
+pending_partitions = list()  # (partition, error message) pairs awaiting allocation
+lv_info = dict()  # VG name -> {LV name: lvs fields}, see get_lv_info()
+md_create_args = dict()  # new MD array path -> (extra mdadm arguments, whether they set the bitmap)
+lvcreate_args = dict()  # new LV's VG/LV name -> (segment type, extra lvcreate arguments)
+luks_settings = dict()  # LUKS device path -> settings in its header, see get_luks_settings()
 
 
-def find_duplicate_names(dicts):
-    """ Return a list of names that appear more than once in a list of dicts.
+class BlivetAnsibleError(Exception):
+    pass
 
-        Items can be a list of any dicts with a 'name' key; that's all we're
-        looking at. """
-    names = list()
-    duplicates = list()
-    for item in dicts:
-        if item['name'] in names and item['name'] not in duplicates:
-            duplicates.append(item['name'])
-        else:
-            names.append(item['name'])
 
-    return duplicates
+class DeviceResolver(object):
+    """ Resolve device specs using hash indexes of a blivet device tree.
 
+        The indexes map names and paths, and then kernel names, UUIDs, labels, partition
+        UUIDs and /dev/disk symlinks, to devices. They are built on first use and kept up
+        to date incrementally: devices get indexed or dropped as blivet adds them to or
+        removes them from the tree, and re-indexed when an action on them is scheduled,
+        canceled or executed or when allocate_partitions() renames them. A device found
+        under a key it no longer has is re-indexed too. Names and the identifiers above
+        are covered completely, so misses on them are final; paths, which may be any
+        symlink, are resolved by blivet when they miss. Misses are never cached.
+    """
+    _kinds = ("UUID", "LABEL", "PARTUUID")  # identifiers of the form KIND=value the indexes cover
 
-class BlivetAnsibleError(Exception):
-    pass
+    def __init__(self, blivet_obj):
+        self._blivet = blivet_obj
+        self._tree = None       # the device tree indexed, which a reset replaces
+        self._primary = None    # names and paths -> devices, which take precedence
+        self._secondary = None  # any other kind of identifier -> devices
+        self._keys = dict()     # device id -> (primary keys, secondary keys)
+        callbacks.device_added.add(self._device_added)
+        callbacks.device_removed.add(self._device_removed)
+        for signal in ('action_added', 'action_removed', 'action_executed'):
+            getattr(callbacks, signal).add(self._action_changed)
+
+    def close(self):
+        callbacks.device_added.remove(self._device_added)
+        callbacks.device_removed.remove(self._device_removed)
+        for signal in ('action_added', 'action_removed', 'action_executed'):
+            getattr(callbacks, signal).remove(self._action_changed)
+
+    def _device_added(self, device=None, **kwargs):  # pylint: disable=unused-argument
+        if self._primary is not None and device is not None:
+            self._add(device)
+
+    def _device_removed(self, device=None, **kwargs):  # pylint: disable=unused-argument
+        if self._primary is not None and device is not None:
+            self._remove(device)
+
+    def _action_changed(self, action=None, **kwargs):  # pylint: disable=unused-argument
+        # format actions change a device's UUID and label, so re-index the device
+        if action is not None and action.device.id in self._keys:
+            self.update(action.device)
+
+    @staticmethod
+    def _normalize(spec):
+        if "=" in spec and not spec.startswith("/"):
+            key, _eq, value = spec.partition("=")
+            return "%s=%s" % (key.upper(), value.strip('"\''))
+
+        return spec
+
+    @staticmethod
+    def _primary_keys(device):
+        return [device.name, device.path]
+
+    @classmethod
+    def _secondary_keys(cls, device):
+        """ Return the keys other than name and path under which to index a device. """
+        keys = list()
+        sysfs_path = getattr(device, 'sysfs_path', None)
+        if sysfs_path:
+            kernel_name = os.path.basename(sysfs_path)
+            keys.extend([kernel_name, "/dev/%s" % kernel_name])
+
+        keys.extend(getattr(device, 'device_links', None) or [])
+
+        if getattr(device.format, 'uuid', None):
+            keys.append("UUID=%s" % device.format.uuid)
+        if getattr(device.format, 'label', None):
+            keys.append("LABEL=%s" % device.format.label)
+        if getattr(device, 'uuid', None):
+            keys.append("UUID=%s" % device.uuid)
+            if device.type == 'partition':
+                keys.append("PARTUUID=%s" % device.uuid)
+
+        return [cls._normalize(key) for key in keys]
+
+    def _add(self, device):
+        if not getattr(device, 'complete', True):
+            return
+
+        keys = (self._primary_keys(device), self._secondary_keys(device))
+        self._keys[device.id] = keys
+        for (index, index_keys) in zip((self._primary, self._secondary), keys):
+            for key in index_keys:
+                index.setdefault(key, list()).append(device)
+
+    def _remove(self, device):
+        keys = self._keys.pop(device.id, (list(), list()))
+        for (index, index_keys) in zip((self._primary, self._secondary), keys):
+            for key in set(index_keys):
+                index[key] = [d for d in index[key] if d is not device]
+                if not index[key]:
+                    del index[key]
+
+    def update(self, device):
+        """ Re-index a device whose name or format may have changed. """
+        if self._primary is not None:
+            self._remove(device)
+            self._add(device)
+
+    def _build_index(self):
+        self._tree = self._blivet.devicetree
+        self._primary = dict()
+        self._secondary = dict()
+        self._keys = dict()
+        for device in self._blivet.devicetree.devices:
+            self._add(device)
+
+    def _lookup(self, key):
+        for (index, get_keys) in ((self._primary, self._primary_keys), (self._secondary, self._secondary_keys)):
+            for device in list(index.get(key, list())):
+                if key in get_keys(device):
+                    return device
+
+                self.update(device)
+
+        return None
+
+    def resolve(self, spec):
+        """ Return the device matching spec, or None if there is no such device. """
+        if self._primary is None or self._tree is not self._blivet.devicetree:
+            self._build_index()
+
+        key = self._normalize(spec)
+        device = self._lookup(key)
+        if device is not None or ("/" not in key and ("=" not in key or key.partition("=")[0] in self._kinds)):
+            return device
+
+        device = self._blivet.devicetree.resolve_device(spec)
+        if device is not None:
+            self.update(device)
+
+        return device
+
+
+def resolve_device(blivet_obj, spec):
+    """ Look up a device in blivet_obj's device tree by any of its identifiers. """
+    global device_resolver
+    if device_resolver is None or device_resolver._blivet is not blivet_obj:
+        if device_resolver is not None:
+            device_resolver.close()
+        device_resolver = DeviceResolver(blivet_obj)
+
+    return device_resolver.resolve(spec)
+
+
+def update_resolved_device(blivet_obj, device):
+    """ Let the device lookups know that device has been renamed. """
+    if device_resolver is not None and device_resolver._blivet is blivet_obj:
+        device_resolver.update(device)
+
+
+def request_allocation(partition, error):
+    """ Register a newly scheduled partition for the next batch allocation. """
+    global pending_partitions
+    pending_partitions.append((partition, error))
+
+
+def _find_allocation_failure(requests):
+    """ Return the error message of the request that does not fit on its disk, if there is just one. """
+    culprits = list()
+    for disk in set(p.parents[0] for (p, _error) in requests if len(p.parents) == 1):
+        try:
+            free = disk.format.free
+        except AttributeError:
+            continue
+
+        used = Size(0)
+        for (partition, error) in requests:
+            if partition.parents != [disk]:
+                continue
+
+            used += partition.req_base_size
+            if used > free:
+                culprits.append(error)
+                break
+
+    return culprits[0] if len(culprits) == 1 else None
+
+
+def allocate_partitions(blivet_obj):
+    """ Allocate all pending partition requests in a single pass.
+
+        Partitioning used to run once for every pool and volume that adds partitions,
+        each time reconsidering every request made so far. The requests are now
+        collected and placed on the disks together.
+    """
+    global pending_partitions
+    if not pending_partitions:
+        return
+
+    requests = pending_partitions
+    pending_partitions = list()
+    try:
+        do_partitioning(blivet_obj)
+    except Exception as e:
+        error = _find_allocation_failure(requests)
+        if error is None:
+            error = "; ".join(sorted(set(error for (_partition, error) in requests)))
+        raise BlivetAnsibleError("%s: %s" % (error, str(e)))
+
+    # encryption is set up before the partitions get their final names
+    for (partition, _error) in requests:
+        update_resolved_device(blivet_obj, partition)
+        for child in partition.children:
+            if isinstance(child, devices.LUKSDevice) and not child.exists:
+                child.name = "luks-%s" % partition.name
+                partition.format.map_name = child.name
+                update_resolved_device(blivet_obj, child)
+
+
+def _get_raid_geometry(spec, members):
+    """ Return the chunk size and the number of data disks of the RAID array described by spec. """
+    actives = spec.get('raid_device_count')
+    if actives is None:
+        actives = members - int(spec.get('raid_spare_count') or 0)
+
+    chunk_size = spec.get('raid_chunk_size')
+    chunk_size = int(Size(chunk_size)) if chunk_size else DEFAULT_RAID_CHUNK_SIZE
+    return (chunk_size, raid_data_disks(spec['raid_level'], int(actives)))
+
+
+def _get_io_geometry(device):
+    """ Return the stripe unit and width the kernel reports for an existing device. """
+    name = os.path.basename(os.path.realpath(device.path))
+    limits = list()
+    for limit in ("minimum_io_size", "optimal_io_size"):
+        try:
+            with open(os.path.join(SYS_CLASS_BLOCK, name, "queue", limit)) as f:
+                limits.append(int(f.read().strip()))
+        except (IOError, OSError, ValueError):
+            return (None, None)
+
+    (minimum, optimal) = limits
+    if minimum > 512 and optimal > minimum and optimal % minimum == 0:
+        return (minimum, optimal // minimum)
+
+    return (None, None)
+
+
+def get_lv_info(vg_name, lv_name):
+    """ Return what lvs reports for the (first segment of the) LV as a dict of LV_INFO_FIELDS.
+
+        Each VG is queried once per run, since every lvs call scans all the devices.
+    """
+    if vg_name not in lv_info:
+        (rc, out) = run_program_and_capture_output(["lvs", "-a", "--noheadings", "--nosuffix", "--units", "b",
+                                                    "--separator", "|", "-o", ",".join(LV_INFO_FIELDS), vg_name])
+        lv_info[vg_name] = dict()
+        for line in out.strip().splitlines() if rc == 0 else list():
+            values = [value.strip() for value in line.split("|")]
+            if len(values) == len(LV_INFO_FIELDS):
+                # hidden LVs are reported in brackets
+                lv_info[vg_name].setdefault(values[0].strip("[]"), dict(zip(LV_INFO_FIELDS, values)))
+
+    return lv_info[vg_name].get(lv_name, dict())
+
+
+def _lvcreate_with_args(lvcreate):
+    """ Wrap libblockdev's lvm.lvcreate() so that it passes the lvcreate arguments in lvcreate_args. """
+    def wrapper(vg_name, lv_name, size, type=None, pv_list=None, extra=None):  # pylint: disable=redefined-builtin
+        key = "%s/%s" % (vg_name, lv_name)
+        if key not in lvcreate_args:
+            return lvcreate(vg_name, lv_name, size, type, pv_list, extra)
+
+        (seg_type, args) = lvcreate_args[key]
+        return lvcreate(vg_name, lv_name, size, seg_type, pv_list, list(extra or list()) + args)
+
+    return wrapper
+
+
+def request_lv_stripes(device, stripes, stripe_size=None):
+    """ Have blivet create the new LV striped across the VG's PVs, which it has no way to ask lvcreate for. """
+    args = [blockdev.ExtraArg.new("--stripes", str(stripes))]
+    if stripe_size:
+        args.append(blockdev.ExtraArg.new("--stripesize", "%dk" % int(stripe_size.convert_to("KiB"))))
+
+    if not lvcreate_args:
+        blockdev.lvm.lvcreate = _lvcreate_with_args(blockdev.lvm.lvcreate)
+
+    lvcreate_args["%s/%s" % (device.vg.name, device.lvname)] = ("striped", args)
+
+
+def trim_to_free_space(size, free_space, name, error):
+    """ Return size, reduced to free_space if it exceeds it by no more than MAX_TRIM_PERCENT. """
+    if size <= free_space:
+        return size
+
+    trim_percent = (1.0 - float(free_space / size)) * 100
+    log.debug("size: %s ; %s", size, trim_percent)
+    if trim_percent > MAX_TRIM_PERCENT:
+        raise BlivetAnsibleError(error)
+
+    log.info("adjusting %s size from %s to %s to fit in free space", name, size, free_space)
+    return free_space
+
+
+def _create_thin_pool(device, create, discard=None, zero=None):
+    """ Create a thin pool, then set the policies blivet has no way to pass to lvcreate. """
+    create()
+
+    lv_name = "%s/%s" % (device.vg.name, device.lvname)
+    args = list()
+    if zero is not None:
+        args.extend(["--zero", "y" if zero else "n"])
+    if discard is not None:
+        args.extend(["--discards", discard])
+
+    commands = [["lvchange"] + args + [lv_name]]
+    if discard == "ignore":
+        # discards can only be switched to ignore while the pool is inactive
+        commands = [["lvchange", "--activate", "n", lv_name]] + commands + [["lvchange", "--activate", "y", lv_name]]
+
+    for command in commands:
+        if run_program(command) != 0:
+            raise BlivetAnsibleError("failed to set up thin pool '%s': '%s' failed" % (device.name, " ".join(command)))
+
+
+def _md_create_with_args(md_create):
+    """ Wrap libblockdev's md.create() so that it passes the mdadm arguments in md_create_args. """
+    def wrapper(device, *args, **kwargs):
+        if device not in md_create_args:
+            return md_create(device, *args, **kwargs)
+
+        (extra, sets_bitmap) = md_create_args[device]
+        kwargs['extra'] = list(kwargs.get('extra') or list()) + extra
+        if sets_bitmap and kwargs.get('bitmap'):
+            # mdadm refuses a second --bitmap; libblockdev 2 takes a bool here, libblockdev 3 a string
+            kwargs['bitmap'] = False if isinstance(kwargs['bitmap'], bool) else None
+
+        return md_create(device, *args, **kwargs)
+
+    return wrapper
+
+
+def request_md_create_args(device, assume_clean=False, bitmap=None):
+    """ Have blivet create the new MD array with the role's extra mdadm options. """
+    extra = list()
+    if assume_clean:
+        extra.append(blockdev.ExtraArg.new("--assume-clean", ""))
+
+    if bitmap is not None:
+        extra.append(blockdev.ExtraArg.new("--bitmap=%s" % ("none" if bitmap == "none" else "internal"), ""))
+        if bitmap not in ("internal", "none"):
+            extra.append(blockdev.ExtraArg.new("--bitmap-chunk=%dK" % int(Size(bitmap).convert_to("KiB")), ""))
+
+    if not md_create_args:
+        blockdev.md.create = _md_create_with_args(blockdev.md.create)
+
+    md_create_args[device.path] = (extra, bitmap is not None)
+
+
+def get_raid_resync(device):
+    """ Return True if an MD array in the device's stack is being resynced or recovered. """
+    for ancestor in device.ancestors:
+        if not isinstance(ancestor, devices.MDRaidArrayDevice) or not ancestor.exists:
+            continue
+
+        name = os.path.basename(os.path.realpath(ancestor.path))
+        try:
+            with open(os.path.join(SYS_CLASS_BLOCK, name, "md", "sync_action")) as f:
+                if f.read().strip() not in ("idle", "frozen"):
+                    return True
+        except (IOError, OSError):
+            continue
+
+    return False
+
+
+def get_luks_settings(device_path):
+    """ Return the encryption settings stored in the LUKS header on the device, see parse_luks_dump().
+
+        blivet does not read these for existing LUKS formats, so the header is dumped, once per run.
+    """
+    if device_path not in luks_settings:
+        (rc, out) = run_program_and_capture_output(["cryptsetup", "luksDump", device_path])
+        luks_settings[device_path] = parse_luks_dump(out) if rc == 0 else dict()
+
+    return luks_settings[device_path]
+
+
+def _get_luks_attr(luks_fmt, param_name):
+    """ Return the value of a LUKS format setting, or None if it is not known. """
+    if luks_fmt.exists and luks_fmt.device:
+        return get_luks_settings(luks_fmt.device).get(param_name)
+
+    (attr, subattr) = LUKS_FORMAT_ATTRS[param_name]
+    value = getattr(luks_fmt, attr, None)
+    if value is not None and subattr is not None:
+        value = getattr(value, subattr, None)
+
+    return value or None
+
+
+def _get_luks_mismatches(luks_fmt, spec):
+    """ Return the LUKS settings of a specification that an existing LUKS format does not have. """
+    mismatches = list()
+    for param_name in sorted(LUKS_FORMAT_ATTRS):
+        requested = spec.get(param_name)
+        current = _get_luks_attr(luks_fmt, param_name)
+        if requested is None or current is None:
+            continue
+
+        if param_name == 'encryption_pbkdf':
+            differs = str(requested) != str(current)
+        else:
+            differs = int(requested) != int(current)
+
+        if differs:
+            mismatches.append("%s (%s, not %s)" % (param_name, current, requested))
+
+    return mismatches
 
 
 class BlivetBase(object):
@@ -191,6 +712,25 @@ class BlivetBase(object):
         # abstract method
         raise NotImplementedError()
 
+    def _get_pbkdf_args(self):
+        """ Return the key derivation settings for a new LUKS format, if any were specified. """
+        params = dict(type=self._spec_dict.get('encryption_pbkdf'),
+                      max_memory_kb=self._spec_dict.get('encryption_pbkdf_memory'),
+                      iterations=self._spec_dict.get('encryption_pbkdf_iterations'),
+                      time_ms=self._spec_dict.get('encryption_pbkdf_time'))
+        if not any(params.values()):
+            return None
+
+        pbkdf_args_class = getattr(luks_formats, 'LUKS2PBKDFArgs', None)
+        if pbkdf_args_class is None:
+            raise BlivetAnsibleError("encryption_pbkdf settings for %s '%s' are not supported by this version of blivet"
+                                     % (self._type, self._spec_dict['name']))
+
+        return pbkdf_args_class(type=params['type'],
+                                max_memory_kb=params['max_memory_kb'] or 0,
+                                iterations=params['iterations'] or 0,
+                                time_ms=params['time_ms'] or 0)
+
     def _manage_one_encryption(self, device):
         global safe_mode
         ret = device
@@ -214,7 +754,9 @@ class BlivetBase(object):
                                                   key_size=self._spec_dict.get('encryption_key_size'),
                                                   luks_version=self._spec_dict.get('encryption_luks_version'),
                                                   passphrase=self._spec_dict.get('encryption_password') or None,
-                                                  key_file=self._spec_dict.get('encryption_key') or None))
+                                                  key_file=self._spec_dict.get('encryption_key') or None,
+                                                  pbkdf_args=self._get_pbkdf_args(),
+                                                  luks_sector_size=self._spec_dict.get('encryption_sector_size') or 0))
 
             if not device.format.has_key:
                 raise BlivetAnsibleError("encrypted %s '%s' missing key/password" % (self._type, self._spec_dict['name']))
@@ -240,6 +782,13 @@ class BlivetBase(object):
             if fmt.type is not None:
                 self._blivet.format_device(ret, fmt)
 
+        elif device != device.raw_device and device.raw_device.format.exists:
+            # existing luks; its settings are kept, but safe mode must not hide that
+            mismatches = _get_luks_mismatches(device.raw_device.format, self._spec_dict)
+            if safe_mode and mismatches:
+                raise BlivetAnsibleError("cannot change the encryption settings of existing %s '%s' in safe mode: %s"
+                                         % (self._type, self._spec_dict['name'], ", ".join(mismatches)))
+
         # XXX: blivet has to store cipher, key_size, luks_version for existing before we
         #      can support re-encrypting based on changes to those parameters
 
@@ -293,6 +842,18 @@ class BlivetBase(object):
         except ValueError as e:
             raise BlivetAnsibleError("cannot create RAID '%s': %s" % (raid_name, str(e)))
 
+        assume_clean = self._spec_dict.get('raid_assume_clean')
+        bitmap = self._spec_dict.get('raid_bitmap')
+        if assume_clean:
+            # only new members are known to hold nothing that a resync would need to fix
+            for member in members:
+                if member.exists:
+                    raise BlivetAnsibleError("cannot skip the initial resync of RAID '%s': member '%s' "
+                                             "was not created by this run" % (raid_name, member.name))
+
+        if assume_clean or bitmap is not None:
+            request_md_create_args(raid_array, assume_clean=assume_clean, bitmap=bitmap)
+
         return raid_array
 
 
@@ -302,6 +863,7 @@ class BlivetVolume(BlivetBase):
     def __init__(self, blivet_obj, volume, bpool=None):
         super(BlivetVolume, self).__init__(blivet_obj, volume)
         self._blivet_pool = bpool
+        self._fast_create_options = list()
 
     @property
     def _volume(self):
@@ -316,7 +878,7 @@ class BlivetVolume(BlivetBase):
         if self.__class__.blivet_device_class is not None:
             packages.extend(self.__class__.blivet_device_class._packages)
 
-        fmt = get_format(self._volume.get('fs_type'))
+        fmt = get_format(self._volume.get('fs_type', volume_defaults.get('fs_type')))
         packages.extend(fmt.packages)
         if self._volume.get('encryption'):
             packages.extend(get_format('luks').packages)
@@ -332,6 +894,10 @@ class BlivetVolume(BlivetBase):
         """ Is self._device of the correct type? """
         return True
 
+    def _may_exist(self):  # pylint: disable=no-self-use
+        """ Might this volume already exist? This must not require a populated device tree. """
+        return True
+
     def _get_device_id(self):
         """ Return an identifier by which to try looking the volume up. """
         return self._volume['name']
@@ -345,7 +911,7 @@ class BlivetVolume(BlivetBase):
         if device_id is None:
             return
 
-        device = self._blivet.devicetree.resolve_device(device_id)
+        device = resolve_device(self._blivet, device_id)
         if device is None:
             return
 
@@ -357,9 +923,8 @@ class BlivetVolume(BlivetBase):
             # set up the original format as well since it'll get used for processing
             device.original_format._key_file = self._volume.get('encryption_key')
             device.original_format.passphrase = self._volume.get('encryption_password')
-            if device.isleaf:
-                self._blivet.populate()
 
+            # unlock_devices has already opened it if the key is correct
             if not device.isleaf:
                 device = device.children[0]
 
@@ -399,6 +964,8 @@ class BlivetVolume(BlivetBase):
             self._volume['encryption_cipher'] = luks_fmt.cipher
         elif param_name == 'encryption_luks_version' and encrypted:
             self._volume['encryption_luks_version'] = luks_fmt.luks_version
+        elif param_name in LUKS_FORMAT_ATTRS and encrypted and _get_luks_attr(luks_fmt, param_name) is not None:
+            self._volume[param_name] = _get_luks_attr(luks_fmt, param_name)
         else:
             return False
 
@@ -419,12 +986,63 @@ class BlivetVolume(BlivetBase):
             else:
                 self._volume.setdefault(name, default)
 
+    @property
+    def _fast_create(self):
+        if self._volume.get('fast_create'):
+            return True
+
+        return bool(self._blivet_pool and self._blivet_pool._pool.get('fast_create'))
+
+    def _get_fast_create_options(self):
+        """ Return the mkfs options that make creating the file system cheap. """
+        if not self._fast_create:
+            return list()
+
+        return FAST_CREATE_MKFS_OPTIONS.get(self._volume['fs_type'], list())
+
+    def _get_stripe_geometry(self):
+        """ Return the stripe unit (in bytes) and the number of data disks under the volume. """
+        if self._blivet_pool is not None and self._blivet_pool._is_raid:
+            pool = self._blivet_pool._pool
+            return _get_raid_geometry(pool, len(pool.get('disks') or []))
+        elif self._device is not None and self._device.exists:
+            return _get_io_geometry(self._device)
+
+        return (None, None)
+
+    def _get_create_options(self):
+        """ Return the user's mkfs options, extended with fast create and stripe geometry options. """
+        try:
+            size = int(Size(self._volume.get('size') or 0))
+        except Exception:
+            size = None
+
+        fast_options = self._get_fast_create_options()
+        (stripe_unit, data_disks) = self._get_stripe_geometry()
+        (create_options, added) = merge_options(self._volume['fs_create_options'],
+                                                fast_options + stripe_options(self._volume['fs_type'], stripe_unit,
+                                                                              data_disks, size))
+
+        # report the fast create options that made it past the user's options
+        fast_items = dict(fast_options)
+        self._fast_create_options = list()
+        for (flag, items) in added:
+            if flag not in fast_items:
+                continue
+
+            items = [item for item in items if item in fast_items[flag]]
+            if items or not fast_items[flag]:
+                self._fast_create_options.extend([flag] + ([",".join(items)] if items else []))
+
+        return create_options
+
     def _get_format(self):
         """ Return a blivet.formats.DeviceFormat instance for this volume. """
+        create_options = self._get_create_options()
         fmt = get_format(self._volume['fs_type'],
                          mountpoint=self._volume.get('mount_point'),
                          label=self._volume['fs_label'],
-                         create_options=self._volume['fs_create_options'])
+                         create_options=create_options)
         if not fmt.supported or not fmt.formattable:
             raise BlivetAnsibleError("required tools for file system '%s' are missing" % self._volume['fs_type'])
 
@@ -439,10 +1057,7 @@ class BlivetVolume(BlivetBase):
         if self._device is None:
             return
 
-        # save device identifiers for use by the role
-        self._volume['_device'] = self._device.path
-        self._volume['_raw_device'] = self._device.raw_device.path
-        self._volume['_mount_id'] = self._device.fstab_spec
+        self.record_device_ids()
 
         # schedule removal of this device and any descendant devices
         self._blivet.devicetree.recursive_remove(self._device.raw_device)
@@ -536,10 +1151,34 @@ class BlivetVolume(BlivetBase):
         if self._device.raw_device.exists and self._volume['size']:
             self._resize()
 
-        # save device identifiers for use by the role
+        self._manage_cache()
+
+    def _manage_cache(self):
+        """ Plan changes to the volume's cache, to be applied once blivet is done. """
+        pass
+
+    def get_cache_actions(self):
+        """ Return a list of dicts describing the planned cache changes. """
+        return list()
+
+    def apply_cache_changes(self):
+        """ Carry out the planned cache changes. Returns a list of dicts describing them. """
+        return list()
+
+    def record_device_ids(self):
+        """ Save device identifiers for use by the role.
+
+            New partitions only get their names once they have been allocated, so this
+            has to wait until all of the scheduling is done.
+        """
+        if self._device is None:
+            return
+
         self._volume['_device'] = self._device.path
         self._volume['_raw_device'] = self._device.raw_device.path
         self._volume['_mount_id'] = self._device.fstab_spec
+        # only a file system this run creates gets the fast create options
+        self._volume['_fast_create'] = self._fast_create_options if not self._device.format.exists else list()
 
 
 class BlivetDiskVolume(BlivetVolume):
@@ -575,7 +1214,8 @@ class BlivetDiskVolume(BlivetVolume):
             raise BlivetAnsibleError("volume disks must be specified as a list")
 
         if self._device is None:
-            raise BlivetAnsibleError("unable to resolve disk specified for volume '%s' (%s)" % (self._volume['name'], self._volume['disks']))
+            raise BlivetAnsibleError("unable to resolve disk specified for volume '%s' (%s)"
+                                     % (self._volume['name'], self._volume['disks']))
 
 
 class BlivetPartitionVolume(BlivetVolume):
@@ -601,7 +1241,7 @@ class BlivetPartitionVolume(BlivetVolume):
         if self._blivet_pool:
             parent = self._blivet_pool._device
         else:
-            parent = self._blivet.devicetree.resolve_device(self._volume['pool'])
+            parent = resolve_device(self._blivet, self._volume['pool'])
 
         if parent is None:
             raise BlivetAnsibleError("failed to find pool '%s' for volume '%s'" % (self._blivet_pool['name'], self._volume['name']))
@@ -613,22 +1253,30 @@ class BlivetPartitionVolume(BlivetVolume):
             raise BlivetAnsibleError("failed set up volume '%s'" % self._volume['name'])
 
         self._blivet.create_device(device)
-        try:
-            do_partitioning(self._blivet)
-        except Exception:
-            raise BlivetAnsibleError("partition allocation failed for volume '%s'" % self._volume['name'])
-
+        request_allocation(device, "partition allocation failed for volume '%s'" % self._volume['name'])
         self._device = device
 
 
 class BlivetLVMVolume(BlivetVolume):
     blivet_device_class = devices.LVMLogicalVolumeDevice
 
+    def __init__(self, blivet_obj, volume, bpool=None):
+        super(BlivetLVMVolume, self).__init__(blivet_obj, volume, bpool=bpool)
+        self._cache_info = None
+        self._cache_changes = list()
+        self._stripe_info = None
+
     def _get_device_id(self):
         if not self._blivet_pool._device:
             return None
         return "%s-%s" % (self._blivet_pool._device.name, self._volume['name'])
 
+    def _may_exist(self):
+        # only active lvs can be found this way
+        dm_name = "%s-%s" % (self._blivet_pool._pool['name'].replace('-', '--'),
+                             self._volume['name'].replace('-', '--'))
+        return os.path.exists(os.path.join(DEV_MAPPER, dm_name))
+
     def _create(self):
         if self._device:
             return
@@ -643,23 +1291,267 @@ class BlivetLVMVolume(BlivetVolume):
             raise BlivetAnsibleError("invalid size '%s' specified for volume '%s'" % (self._volume['size'], self._volume['name']))
 
         fmt = self._get_format()
-        trim_percent = (1.0 - float(parent.free_space / size)) * 100
-        log.debug("size: %s ; %s", size, trim_percent)
-        if size > parent.free_space:
-            if trim_percent > MAX_TRIM_PERCENT:
-                raise BlivetAnsibleError("specified size for volume '%s' exceeds available space in pool '%s' (%s)"
-                                         % (size, parent.name, parent.free_space))
-            else:
-                log.info("adjusting %s size from %s to %s to fit in %s free space",
-                         self._volume['name'],
-                         size,
-                         parent.free_space,
-                         parent.name)
-                size = parent.free_space
+        # the pool's free space is only known once its new member partitions are allocated
+        allocate_partitions(self._blivet)
+
+        kwargs = dict()
+        pvs = parent.pvs
+        if self._volume.get('cache_size'):
+            # keep the fast PVs for the cache
+            cache_pvs = self._get_cache_pvs()
+            pvs = kwargs['pvs'] = [pv for pv in parent.pvs if pv not in cache_pvs]
+
+        stripes = int(self._volume.get('stripes') or 1)
+        if stripes > 1:
+            size = self._fit_stripes(size, stripes, pvs)
+        else:
+            size = trim_to_free_space(size, parent.free_space, self._volume['name'],
+                                      "specified size for volume '%s' exceeds available space in pool '%s' (%s)"
+                                      % (size, parent.name, parent.free_space))
 
         try:
             device = self._blivet.new_lv(name=self._volume['name'],
-                                         parents=[parent], size=size, fmt=fmt)
+                                         parents=[parent], size=size, fmt=fmt, **kwargs)
+        except Exception as e:
+            raise BlivetAnsibleError("failed to set up volume '%s': %s" % (self._volume['name'], str(e)))
+
+        if stripes > 1:
+            stripe_size = Size(self._volume['stripe_size']) if self._volume.get('stripe_size') else None
+            request_lv_stripes(device, stripes, stripe_size=stripe_size)
+
+        self._blivet.create_device(device)
+        self._device = device
+
+    def _fit_stripes(self, size, stripes, pvs):
+        """ Return the size of a new LV striped across the PVs, rounded to whole stripes. """
+        parent = self._blivet_pool._device
+        if stripes > len(pvs):
+            raise BlivetAnsibleError("cannot stripe volume '%s' across %d physical volumes; pool '%s' has %d"
+                                     % (self._volume['name'], stripes, self._blivet_pool._pool['name'], len(pvs)))
+
+        # every stripe takes the same number of extents from a different PV
+        granularity = parent.pe_size * stripes
+        size = size + (granularity - size % granularity) % granularity
+
+        # blivet only tracks free space per VG, so new PVs are assumed to fill up evenly
+        if all(pv.format.exists for pv in pvs):
+            pv_free = sorted((pv.format.free for pv in pvs), reverse=True)[stripes - 1]
+        else:
+            pv_free = parent.free_space / len(parent.pvs)
+
+        free_space = min(parent.free_space, pv_free * stripes)
+        size = trim_to_free_space(size, free_space, self._volume['name'],
+                                  "specified size for volume '%s' exceeds space available for %d stripes in pool '%s' (%s)"
+                                  % (size, stripes, parent.name, free_space))
+        return size - size % granularity
+
+    def _get_stripe_geometry(self):
+        stripes = int(self._volume.get('stripes') or 1)
+        if stripes > 1:
+            stripe_size = self._volume.get('stripe_size')
+            return (int(Size(stripe_size)) if stripe_size else DEFAULT_STRIPE_SIZE, stripes)
+
+        return super(BlivetLVMVolume, self)._get_stripe_geometry()
+
+    def _manage_stripes(self):
+        """ Make sure an existing LV is not expected to change its stripes. """
+        if self._volume.get('stripes') is None and self._volume.get('stripe_size') is None:
+            return
+
+        current = self._get_stripe_info()
+        requested = dict(stripes=int(self._volume.get('stripes') or 0),
+                         stripe_size=int(Size(self._volume.get('stripe_size') or 0)))
+        for param in ('stripes', 'stripe_size'):
+            if requested[param] and current and current[param] != requested[param]:
+                raise BlivetAnsibleError("cannot change %s of existing volume '%s' from %s to %s"
+                                         % (param, self._volume['name'], current[param], self._volume[param]))
+
+    def manage(self):
+        super(BlivetLVMVolume, self).manage()
+        if self.ultimately_present and self._device.raw_device.exists:
+            self._manage_stripes()
+
+    def _get_cache_info(self):
+        """ Return the size and mode of the LV's cache as lvm reports them. """
+        if self._cache_info is not None:
+            return self._cache_info
+
+        self._cache_info = dict(size=0, mode=None, name=None)
+        vg_name = self._blivet_pool._device.name
+        info = get_lv_info(vg_name, self._device.raw_device.lvname)
+        if info.get('segtype') not in ("cache", "writecache"):
+            return self._cache_info
+
+        cache_name = info['pool_lv'].strip("[]")
+        size = get_lv_info(vg_name, cache_name).get('lv_size')
+        self._cache_info = dict(size=int(float(size)) if size else 0,
+                                mode="writecache" if info['segtype'] == "writecache" else info['cache_mode'],
+                                name=cache_name)
+        return self._cache_info
+
+    def _get_stripe_info(self):
+        """ Return the number of stripes and the stripe size of the LV, if lvm reports them. """
+        if self._stripe_info is not None:
+            return self._stripe_info
+
+        self._stripe_info = dict()
+        info = get_lv_info(self._blivet_pool._device.name, self._device.raw_device.lvname)
+        if info.get('segtype') in ("linear", "striped"):
+            self._stripe_info = dict(stripes=int(info['stripes']), stripe_size=int(float(info['stripe_size'])))
+
+        return self._stripe_info
+
+    def _update_from_device(self, param_name):
+        if param_name == 'cache_size':
+            self._volume['cache_size'] = self._get_cache_info()['size']
+        elif param_name == 'cache_mode' and self._get_cache_info()['mode']:
+            self._volume['cache_mode'] = self._get_cache_info()['mode']
+        elif param_name in ('stripes', 'stripe_size') and self._get_stripe_info().get(param_name):
+            self._volume[param_name] = self._get_stripe_info()[param_name]
+        else:
+            return super(BlivetLVMVolume, self)._update_from_device(param_name)
+
+        return True
+
+    def _get_cache_pvs(self):
+        """ Return the pool's PVs that sit on the volume's cache devices. """
+        pvs = list()
+        for spec in self._volume.get('cache_devices') or list():
+            cache_device = resolve_device(self._blivet, spec)
+            if cache_device is None:
+                raise BlivetAnsibleError("cache device '%s' for volume '%s' not found" % (spec, self._volume['name']))
+
+            found = [pv for pv in self._blivet_pool._device.pvs if cache_device in pv.ancestors]
+            if not found:
+                raise BlivetAnsibleError("cache device '%s' for volume '%s' is not a physical volume of pool '%s'"
+                                         % (spec, self._volume['name'], self._blivet_pool._pool['name']))
+            pvs.extend(pv for pv in found if pv not in pvs)
+
+        return pvs
+
+    def _manage_cache(self):
+        if self._volume.get('cache_size') is None and self._volume.get('cache_mode') is None:
+            # the cache is left as it is, so there is no need to ask lvm about it
+            return
+
+        current = self._get_cache_info() if self._device.raw_device.exists else dict(size=0, mode=None, name=None)
+        try:
+            size = Size(self._volume['cache_size']) if self._volume.get('cache_size') is not None else current['size']
+        except Exception:
+            raise BlivetAnsibleError("invalid cache size '%s' specified for volume '%s'"
+                                     % (self._volume['cache_size'], self._volume['name']))
+
+        if size:
+            # lvm rounds the cache up to whole extents
+            size = self._blivet_pool._device.align(Size(size), roundup=True)
+
+        mode = self._volume.get('cache_mode') or current['mode'] or "writethrough"
+        if mode not in CACHE_MODES:
+            raise BlivetAnsibleError("invalid cache mode '%s' specified for volume '%s'" % (mode, self._volume['name']))
+
+        if current['size'] and (not size or size != current['size'] or mode != current['mode']):
+            self._cache_changes.append(("detach", current['name'], None, None))
+
+        if size and (size != current['size'] or mode != current['mode']):
+            pvs = self._get_cache_pvs()
+            if not pvs:
+                raise BlivetAnsibleError("no cache_devices specified for cached volume '%s'" % self._volume['name'])
+            self._cache_changes.append(("attach", size, mode, pvs))
+
+    def get_cache_actions(self):
+        return [dict(action="%s cache" % change, fs_type=None, device=self._device.path,
+                     size=int(size) if change == "attach" else None)
+                for (change, size, _mode, _pvs) in self._cache_changes]
+
+    def apply_cache_changes(self):
+        vg_name = self._blivet_pool._device.name
+        lv_name = "%s/%s" % (vg_name, self._device.raw_device.lvname)
+        cache_name = "%s_cache" % self._device.raw_device.lvname
+        done = [dict(action=a['action'], fs_type=None, device=a['device']) for a in self.get_cache_actions()]
+        for (change, size, mode, pvs) in self._cache_changes:
+            if change == "detach":
+                commands = [["lvconvert", "--yes", "--uncache", lv_name]]
+            else:
+                commands = [["lvcreate", "--yes", "--name", cache_name, "--size", "%db" % int(size), vg_name] +
+                            [pv.path for pv in pvs]]
+                if mode == "writecache":
+                    commands.append(["lvconvert", "--yes", "--type", "writecache", "--cachevol", cache_name, lv_name])
+                else:
+                    commands.append(["lvconvert", "--yes", "--type", "cache", "--cachevol", cache_name,
+                                     "--cachemode", mode, lv_name])
+
+            for command in commands:
+                if run_program(command) != 0:
+                    raise BlivetAnsibleError("failed to %s cache of volume '%s': '%s' failed"
+                                             % (change, self._volume['name'], " ".join(command)))
+
+        self._cache_changes = list()
+        lv_info.pop(vg_name, None)
+        return done
+
+
+class BlivetThinVolume(BlivetLVMVolume):
+    def _type_check(self):
+        return getattr(self._device.raw_device, 'is_thin_lv', False)
+
+    def _manage_cache(self):
+        if self._volume.get('cache_size'):
+            raise BlivetAnsibleError("thin volume '%s' cannot be cached" % self._volume['name'])
+
+    def _update_from_device(self, param_name):
+        if param_name == 'thin_pool':
+            self._volume['thin_pool'] = self._device.raw_device.pool.lvname
+        else:
+            return super(BlivetThinVolume, self)._update_from_device(param_name)
+
+        return True
+
+    def _create_snapshot(self, origin_name):
+        origin = resolve_device(self._blivet, "%s-%s" % (self._blivet_pool._device.name, origin_name))
+        if origin is None or not origin.exists or not getattr(origin, 'is_thin_lv', False):
+            raise BlivetAnsibleError("thin origin '%s' of volume '%s' is not an existing thin volume in pool '%s'"
+                                     % (origin_name, self._volume['name'], self._blivet_pool._pool['name']))
+
+        # thin snapshots share the thin pool of their origin
+        return self._blivet.new_lv(name=self._volume['name'], parents=[origin.pool], origin=origin,
+                                   size=origin.size, thin_volume=True)
+
+    def _create(self):
+        if self._device:
+            return
+
+        if self._blivet_pool is None or self._blivet_pool._pool['type'] != "lvm":
+            raise BlivetAnsibleError("thin volume '%s' must belong to an lvm pool" % self._volume['name'])
+
+        if self._blivet_pool._device is None:
+            raise BlivetAnsibleError("failed to find pool '%s' for volume '%s'" % (self._blivet_pool._pool['name'], self._volume['name']))
+
+        if self._volume.get('thin_origin'):
+            try:
+                device = self._create_snapshot(self._volume['thin_origin'])
+            except ValueError as e:
+                raise BlivetAnsibleError("failed to set up volume '%s': %s" % (self._volume['name'], str(e)))
+
+            self._blivet.create_device(device)
+            self._device = device
+            return
+
+        parent = self._blivet_pool._get_thin_pool(self._volume.get('thin_pool'), self._volume['name'])
+        try:
+            size = Size(self._volume['size'])
+        except Exception:
+            raise BlivetAnsibleError("invalid size '%s' specified for volume '%s'" % (self._volume['size'], self._volume['name']))
+
+        if not size:
+            raise BlivetAnsibleError("no size specified for thin volume '%s'" % self._volume['name'])
+
+        # thin volumes may overcommit the thin pool, so there is nothing to trim
+        if size > parent.size:
+            log.info("thin volume %s (%s) is larger than thin pool %s (%s)", self._volume['name'], size, parent.name, parent.size)
+
+        try:
+            device = self._blivet.new_lv(name=self._volume['name'], parents=[parent], size=size,
+                                         fmt=self._get_format(), thin_volume=True)
         except Exception as e:
             raise BlivetAnsibleError("failed to set up volume '%s': %s" % (self._volume['name'], str(e)))
 
@@ -668,6 +1560,13 @@ class BlivetLVMVolume(BlivetVolume):
 
 
 class BlivetMDRaidVolume(BlivetVolume):
+    blivet_device_class = devices.MDRaidArrayDevice
+
+    def _get_stripe_geometry(self):
+        return _get_raid_geometry(self._volume, len(self._volume.get('disks') or []))
+
+    def _may_exist(self):
+        return os.path.exists(os.path.join(DEV_MD, self._volume['name']))
 
     def _process_device_numbers(self, members_count, requested_actives, requested_spares):
 
@@ -696,7 +1595,7 @@ class BlivetMDRaidVolume(BlivetVolume):
         members = list()
 
         for member_name in member_names:
-            member_disk = self._blivet.devicetree.resolve_device(member_name)
+            member_disk = resolve_device(self._blivet, member_name)
             if member_disk is not None:
                 if use_partitions:
                     # create partition table
@@ -706,6 +1605,7 @@ class BlivetMDRaidVolume(BlivetVolume):
                     # create new partition
                     member = self._blivet.new_partition(parents=[member_disk], grow=True)
                     self._blivet.create_device(member)
+                    request_allocation(member, "failed to allocate partitions for mdraid '%s'" % self._spec_dict['name'])
                     self._blivet.format_device(member, fmt=get_format("mdmember"))
                     members.append(member)
                 else:
@@ -743,12 +1643,6 @@ class BlivetMDRaidVolume(BlivetVolume):
         # begin creating the devices
         members = self._create_raid_members(self._volume["disks"])
 
-        if use_partitions:
-            try:
-                do_partitioning(self._blivet)
-            except Exception as e:
-                raise BlivetAnsibleError("failed to allocate partitions for mdraid '%s': %s" % (self._volume['name'], str(e)))
-
         raid_array = self._new_mdarray(members)
 
         self._blivet.create_device(raid_array)
@@ -783,7 +1677,8 @@ _BLIVET_VOLUME_TYPES = {
     "disk": BlivetDiskVolume,
     "lvm": BlivetLVMVolume,
     "partition": BlivetPartitionVolume,
-    "raid": BlivetMDRaidVolume
+    "raid": BlivetMDRaidVolume,
+    "thin": BlivetThinVolume
 }
 
 
@@ -805,6 +1700,8 @@ class BlivetPool(BlivetBase):
         super(BlivetPool, self).__init__(blivet_obj, pool)
         self._disks = list()
         self._blivet_volumes = list()
+        self._members = list()
+        self._prepared = False
 
     @property
     def _pool(self):
@@ -816,6 +1713,9 @@ class BlivetPool(BlivetBase):
         if self.ultimately_present and self.__class__.blivet_device_class is not None:
             packages.extend(self.__class__.blivet_device_class._packages)
 
+        if self.ultimately_present and self._is_raid:
+            packages.extend(devices.MDRaidArrayDevice._packages)
+
         if self._pool.get('encryption'):
             packages.extend(get_format('luks').packages)
 
@@ -876,7 +1776,7 @@ class BlivetPool(BlivetBase):
 
         disks = list()
         for spec in self._pool['disks']:
-            device = self._blivet.devicetree.resolve_device(spec)
+            device = resolve_device(self._blivet, spec)
             if device is not None:  # XXX fail if any disk isn't resolved?
                 disks.append(device)
 
@@ -887,7 +1787,7 @@ class BlivetPool(BlivetBase):
 
     def _look_up_device(self):
         """ Look up the pool in blivet's device tree. """
-        device = self._blivet.devicetree.resolve_device(self._pool['name'])
+        device = resolve_device(self._blivet, self._pool['name'])
         if device is None:
             return
 
@@ -898,19 +1798,6 @@ class BlivetPool(BlivetBase):
             self._device = None
             return  # TODO: see if we can create this device w/ the specified name
 
-        # Apply encryption keys as appropriate
-        if any(d.encrypted for d in self._device.parents):
-            passphrase = self._pool.get("encryption_passphrase")
-            key_file = self._pool.get("encryption_key_file")
-            for member in self._device.parents:
-                if member.parents[0].format.type == "luks":
-                    if passphrase:
-                        member.parents[0].format.passphrase = passphrase
-                        member.parents[0].original_format.passphrase = passphrase
-                    if key_file:
-                        member.parents[0].format.key_file = key_file
-                        member.parents[0].original_format.key_file = key_file
-
     def _update_from_device(self, param_name):
         """ Return True if param_name's value was retrieved from a looked-up device. """
         # We wouldn't have the pool device if the member devices weren't unlocked, so we do not
@@ -931,6 +1818,9 @@ class BlivetPool(BlivetBase):
             self._pool['encryption_cipher'] = self._device.parents[0].parents[0].format.cipher
         elif param_name == 'encryption_luks_version' and encrypted:
             self._pool['encryption_luks_version'] = self._device.parents[0].parents[0].format.luks_version
+        elif param_name in LUKS_FORMAT_ATTRS and encrypted and \
+                _get_luks_attr(self._device.parents[0].parents[0].format, param_name) is not None:
+            self._pool[param_name] = _get_luks_attr(self._device.parents[0].parents[0].format, param_name)
         elif param_name == 'raid_level' and raid:
             self._pool['raid_level'] = self._device.parents[0].raw_device.level.name
         elif param_name == 'raid_chunk_size' and raid:
@@ -979,6 +1869,7 @@ class BlivetPool(BlivetBase):
                 self._blivet.format_device(disk, label)
                 member = self._blivet.new_partition(parents=[disk], size=Size("256MiB"), grow=True)
                 self._blivet.create_device(member)
+                request_allocation(member, "failed to allocate partitions for pool '%s'" % self._pool['name'])
             else:
                 member = disk
 
@@ -998,12 +1889,6 @@ class BlivetPool(BlivetBase):
         else:
             result = members
 
-        if use_partitions:
-            try:
-                do_partitioning(self._blivet)
-            except Exception:
-                raise BlivetAnsibleError("failed to allocate partitions for pool '%s'" % self._pool['name'])
-
         return result
 
     def _get_volumes(self):
@@ -1018,9 +1903,14 @@ class BlivetPool(BlivetBase):
         for bvolume in self._blivet_volumes:
             bvolume.manage()
 
-    def manage(self):
-        """ Schedule actions to configure this pool according to the yaml input. """
+    def _prepare_members(self):
+        """ Schedule creation of the member devices of a pool that is going to be created. """
+        pass
+
+    def prepare(self):
+        """ Schedule removals and member partitions ahead of managing the pool itself. """
         global safe_mode
+        self._prepared = True
         # look up the device
         self._look_up_device()
         self._apply_defaults()
@@ -1037,6 +1927,16 @@ class BlivetPool(BlivetBase):
             else:
                 self._destroy()
 
+        self._prepare_members()
+
+    def manage(self):
+        """ Schedule actions to configure this pool according to the yaml input. """
+        if not self._prepared:
+            self.prepare()
+
+        if not self.ultimately_present:
+            return
+
         # schedule create if appropriate
         self._create()
         self._manage_volumes()
@@ -1094,11 +1994,15 @@ class BlivetLVMPool(BlivetPool):
 
         return managed_members
 
+    def _prepare_members(self):
+        if self._device is None:
+            self._members = self._create_members()
+
     def _create(self):
         if self._device:
             return
 
-        members = self._manage_encryption(self._create_members())
+        members = self._manage_encryption(self._members)
         try:
             pool_device = self._blivet.new_vg(name=self._pool['name'], parents=members)
         except Exception as e:
@@ -1107,6 +2011,77 @@ class BlivetLVMPool(BlivetPool):
         self._blivet.create_device(pool_device)
         self._device = pool_device
 
+    @property
+    def required_packages(self):
+        packages = super(BlivetLVMPool, self).required_packages
+        if self.ultimately_present and self._pool.get('thin_pools'):
+            # thin_check and friends
+            packages.append("device-mapper-persistent-data")
+
+        return packages
+
+    def _get_thin_pool(self, name, volume_name):
+        """ Return the thin pool device for a thin volume. """
+        thin_pools = self._device.thinpools
+        if name is None and len(thin_pools) == 1:
+            return thin_pools[0]
+        elif name is None:
+            raise BlivetAnsibleError("no thin_pool specified for thin volume '%s' in pool '%s'"
+                                     % (volume_name, self._pool['name']))
+
+        for thin_pool in thin_pools:
+            if thin_pool.lvname == name:
+                return thin_pool
+
+        raise BlivetAnsibleError("thin pool '%s' for volume '%s' not found in pool '%s'"
+                                 % (name, volume_name, self._pool['name']))
+
+    def _new_thin_pool(self, thin_pool):
+        try:
+            size = Size(thin_pool['size'])
+            metadata_size = Size(thin_pool['metadata_size']) if thin_pool.get('metadata_size') else None
+            chunk_size = Size(thin_pool['chunk_size']) if thin_pool.get('chunk_size') else None
+        except Exception:
+            raise BlivetAnsibleError("invalid size specified for thin pool '%s'" % thin_pool['name'])
+
+        free_space = self._device.free_space - (metadata_size or Size(0))
+        size = trim_to_free_space(size, free_space, thin_pool['name'],
+                                  "specified size for thin pool '%s' exceeds available space in pool '%s' (%s)"
+                                  % (thin_pool['name'], self._pool['name'], free_space))
+
+        kwargs = dict()
+        if metadata_size:
+            kwargs['metadata_size'] = metadata_size
+        if chunk_size:
+            kwargs['chunk_size'] = chunk_size
+
+        try:
+            device = self._blivet.new_lv(name=thin_pool['name'], parents=[self._device], size=size,
+                                         thin_pool=True, **kwargs)
+        except Exception as e:
+            raise BlivetAnsibleError("failed to set up thin pool '%s': %s" % (thin_pool['name'], str(e)))
+
+        if thin_pool.get('discard') is not None or thin_pool.get('zero') is not None:
+            device._create = functools.partial(_create_thin_pool, device, device._create,
+                                               discard=thin_pool.get('discard'), zero=thin_pool.get('zero'))
+
+        self._blivet.create_device(device)
+
+    def _manage_thin_pools(self):
+        """ Schedule creation of the thin pools declared for this pool. """
+        for thin_pool in self._pool.get('thin_pools') or list():
+            device = resolve_device(self._blivet, "%s-%s" % (self._device.name, thin_pool['name']))
+            if device is None:
+                self._new_thin_pool(thin_pool)
+            elif not getattr(device, 'is_thin_pool', False):
+                raise BlivetAnsibleError("volume '%s' in pool '%s' is not a thin pool" % (thin_pool['name'], self._pool['name']))
+
+    def _manage_volumes(self):
+        if self.ultimately_present:
+            self._manage_thin_pools()
+
+        super(BlivetLVMPool, self)._manage_volumes()
+
 
 _BLIVET_POOL_TYPES = {
     "partition": BlivetPartitionPool,
@@ -1130,38 +2105,215 @@ def manage_volume(b, volume):
     """ Schedule actions as needed to manage a single standalone volume. """
     bvolume = _get_blivet_volume(b, volume)
     bvolume.manage()
-    volume['_device'] = bvolume._volume.get('_device', '')
-    volume['_raw_device'] = bvolume._volume.get('_raw_device', '')
-    volume['_mount_id'] = bvolume._volume.get('_mount_id', '')
+    return bvolume
+
+
+def manage_pools(b, pools, timings=None):
+    """ Schedule actions as needed to manage the pools and their volumes.
+
+        All pools schedule their removals and new member partitions before any of
+        them sets up volumes, so the member partitions get allocated in one batch.
+    """
+    timings = timings or Timings()
+    bpools = [_get_blivet_pool(b, pool) for pool in pools]
+    for bpool in bpools:
+        with timings.item("pools", bpool._pool['name']):
+            bpool.prepare()
+
+    for bpool in bpools:
+        with timings.item("pools", bpool._pool['name']):
+            bpool.manage()
+
+    return bpools
 
 
-def manage_pool(b, pool):
-    """ Schedule actions as needed to manage a single pool and its volumes. """
-    bpool = _get_blivet_pool(b, pool)
-    bpool.manage()
-    for (volume, bvolume) in zip(pool['volumes'], bpool._blivet_volumes):
-        volume['_device'] = bvolume._volume.get('_device', '')
-        volume['_raw_device'] = bvolume._volume.get('_raw_device', '')
-        volume['_mount_id'] = bvolume._volume.get('_mount_id', '')
+def schedule_actions(b, pools, volumes, timings=None):
+    """ Schedule the actions for all pools and standalone volumes and record their device ids.
+
+        Returns the BlivetPool instances and the BlivetVolume instances of the standalone volumes.
+    """
+    timings = timings or Timings()
+    bpools = manage_pools(b, pools, timings=timings)
+
+    bvolumes = list()
+    for volume in volumes:
+        with timings.item("volumes", volume['name']):
+            bvolumes.append(manage_volume(b, volume))
+
+    allocate_partitions(b)
+
+    for bvolume in [bv for bpool in bpools for bv in bpool._blivet_volumes] + bvolumes:
+        if bvolume.ultimately_present:
+            bvolume.record_device_ids()
+
+        for key in ('_device', '_raw_device', '_mount_id'):
+            bvolume._volume.setdefault(key, '')
+        bvolume._volume.setdefault('_fast_create', list())
+
+    return (bpools, bvolumes)
+
+
+def _luks_devices(device):
+    """ Return the LUKS-formatted devices in the device stack rooted at device. """
+    found = list()
+    pending = [device]
+    while pending:
+        dev = pending.pop()
+        if dev.format.type == 'luks' and dev not in found:
+            found.append(dev)
+        pending.extend(dev.children)
+
+    return found
+
+
+def _get_encrypted_devices(b, pools, volumes):
+    """ Return (spec, device) pairs for LUKS devices that belong to the pools/volumes. """
+    pairs = list()
+    bvolumes = list()
+    for pool in pools:
+        if pool.get('encryption_password') or pool.get('encryption_key'):
+            # pool members are encrypted below the pool, not in its volumes
+            for spec in pool['disks'] if isinstance(pool.get('disks'), list) else []:
+                disk = resolve_device(b, spec)
+                if disk is not None:
+                    pairs.extend((pool, d) for d in _luks_devices(disk)
+                                 if not isinstance(d, devices.LVMLogicalVolumeDevice))
+
+        bpool = _get_blivet_pool(b, pool)
+        try:
+            bpool._look_up_device()
+            bpool._get_volumes()
+        except (BlivetAnsibleError, IndexError):
+            # the pool will report this when it gets managed
+            continue
+
+        bvolumes.extend(bpool._blivet_volumes)
+
+    for volume in volumes:
+        bvolumes.append(_get_blivet_volume(b, volume))
+
+    for bvolume in bvolumes:
+        if not (bvolume._volume.get('encryption_password') or bvolume._volume.get('encryption_key')):
+            continue
+
+        try:
+            device_id = bvolume._get_device_id()
+        except (BlivetAnsibleError, IndexError, KeyError):
+            continue
+
+        device = resolve_device(b, device_id) if device_id else None
+        if device is not None and device.format.type == 'luks':
+            pairs.append((bvolume._volume, device))
+
+    return pairs
+
+
+def unlock_devices(b, pools, volumes):
+    """ Open the existing LUKS devices of all pools and volumes.
+
+        The keys and passphrases from the specification are attached to every
+        matching LUKS format first. Then all of the locked devices are opened and
+        the device tree is populated once to pick up the devices on top of them.
+        That is only repeated when it reveals another layer of encrypted devices.
+    """
+    attempted = set()
+    while True:
+        locked = list()
+        for spec, device in _get_encrypted_devices(b, pools, volumes):
+            for fmt in (device.format, device.original_format):
+                if spec.get('encryption_password'):
+                    fmt.passphrase = spec['encryption_password']
+                if spec.get('encryption_key'):
+                    fmt._key_file = spec['encryption_key']
+
+            if device.isleaf and device.name not in attempted:
+                attempted.add(device.name)
+                locked.append(device)
+
+        unlocked = 0
+        for device in locked:
+            try:
+                device.format.setup()
+            except Exception as e:  # pylint: disable=broad-except
+                # the device gets re-encrypted or reported as it gets managed
+                log.warning("failed to unlock %s: %s", device.name, str(e))
+            else:
+                unlocked += 1
+
+        if not unlocked:
+            break
+
+        b.devicetree.populate()
 
 
 class FSTab(object):
+    """ Entries of /etc/fstab, indexed by device path, device id and mount point.
+
+        Only entries whose device spec can refer to a local block device get resolved,
+        and not until the first lookup by device path or a call to resolve().
+    """
+    _indexed_keys = ('device_path', 'device_id', 'mount_point')
+
     def __init__(self, blivet_obj):
         self._blivet = blivet_obj
         self._entries = list()
+        self._unresolved = list()
+        self._indexes = dict((key, dict()) for key in self._indexed_keys)
         self.parse()
 
     def lookup(self, key, value):
+        if key == 'device_path':
+            self.resolve()
+
+        if key in self._indexes:
+            return self._indexes[key].get(value)
+
         return next((e for e in self._entries if e.get(key) == value), None)
 
     def reset(self):
         self._entries = list()
+        self._unresolved = list()
+        self._indexes = dict((key, dict()) for key in self._indexed_keys)
+
+    @staticmethod
+    def _is_block_device_entry(device_id, fs_type, mount_options):
+        if fs_type in FSTAB_NON_BLOCK_FS_TYPES or "bind" in mount_options.split(","):
+            return False
+
+        key = device_id.partition("=")[0].upper() if "=" in device_id else None
+        return device_id.startswith("/dev/") or key in DEV_DISK_BY
+
+    def _add_to_indexes(self, entry):
+        for key in self._indexed_keys:
+            if entry[key] is not None:
+                self._indexes[key].setdefault(entry[key], entry)
+
+    def resolve(self):
+        """ Look up the device paths of the entries that have not been resolved yet.
+
+            This has to happen before any actions are scheduled so that the entries
+            refer to the devices as they were before the changes.
+        """
+        if not self._unresolved:
+            return
+
+        for entry in self._unresolved:
+            device = resolve_device(self._blivet, entry['device_id'])
+            entry['device_path'] = getattr(device, 'path', None)
+
+        # the first entry in the file wins, just like for the other indexes
+        self._indexes['device_path'] = dict()
+        for entry in reversed(self._entries):
+            if entry['device_path'] is not None:
+                self._indexes['device_path'][entry['device_path']] = entry
+
+        self._unresolved = list()
 
     def parse(self):
         if self._entries:
             self.reset()
 
-        for line in open('/etc/fstab').readlines():
+        for line in open(ETC_FSTAB).readlines():
             if line.lstrip().startswith("#"):
                 continue
 
@@ -1169,12 +2321,15 @@ class FSTab(object):
             if len(fields) < 6:
                 continue
 
-            device = self._blivet.devicetree.resolve_device(fields[0])
-            self._entries.append(dict(device_id=fields[0],
-                                      device_path=getattr(device, 'path', None),
-                                      fs_type=fields[2],
-                                      mount_point=fields[1],
-                                      mount_options=fields[3]))
+            entry = dict(device_id=fields[0],
+                         device_path=None,
+                         fs_type=fields[2],
+                         mount_point=fields[1],
+                         mount_options=fields[3])
+            self._entries.append(entry)
+            self._add_to_indexes(entry)
+            if self._is_block_device_entry(fields[0], fields[2], fields[3]):
+                self._unresolved.append(entry)
 
 
 def get_mount_info(pools, volumes, actions, fstab):
@@ -1262,17 +2417,80 @@ def get_crypt_info(actions):
     return sorted(info, key=lambda e: e['state'])
 
 
-def get_required_packages(b, pools, volumes):
+def _look_up_fs_types(bvolumes):
+    """ Fill in the file system type of existing volumes using a minimal device tree.
+
+        Only the disks of the given volumes (and their pools) are probed. Encrypted
+        volumes are unlocked the same way as in the main run; the type of one that
+        stays locked is left unknown rather than taken to be LUKS.
+    """
+    pools = list()
+    volumes = list()
+    for bvolume in bvolumes:
+        if bvolume._blivet_pool is None:
+            volumes.append(bvolume._volume)
+        elif bvolume._blivet_pool._pool not in pools:
+            pools.append(bvolume._blivet_pool._pool)
+
+    scope = get_populate_scope(pools, volumes)
+    if not scope:
+        # none of the devices exist
+        return
+
+    b = Blivet()
+    b.exclusive_disks = scope
+    b.reset()
+    try:
+        unlock_devices(b, pools, volumes)
+    except BlivetAnsibleError:
+        # the real run will report it
+        pass
+
+    bpools = dict()
+    for bvolume in bvolumes:
+        bpool = None
+        try:
+            if bvolume._blivet_pool is not None:
+                pool = bvolume._blivet_pool._pool
+                if pool['name'] not in bpools:
+                    bpools[pool['name']] = _get_blivet_pool(b, pool)
+                    bpools[pool['name']]._look_up_device()
+                bpool = bpools[pool['name']]
+
+            probe = _get_blivet_volume(b, bvolume._volume, bpool)
+            probe._look_up_device()
+        except (BlivetAnsibleError, IndexError):
+            # the real run will report any problems with the specification
+            continue
+
+        if probe._device is not None and probe._device.format.type != "luks":
+            probe._update_from_device('fs_type')
+
+
+def get_required_packages(pools, volumes):
+    """ Return a sorted list of the packages needed to manage the pools and volumes.
+
+        The list is computed from the specification and blivet's device and format
+        classes without probing any storage. The only exception is existing volumes
+        that do not specify a file system type, which are looked up to find it.
+    """
     packages = list()
+    bvolumes = list()
     for pool in pools:
-        bpool = _get_blivet_pool(b, pool)
+        bpool = _get_blivet_pool(None, pool)
         packages.extend(bpool.required_packages)
         bpool._get_volumes()
-        for bvolume in bpool._blivet_volumes:
-            packages.extend(bvolume.required_packages)
+        bvolumes.extend(bpool._blivet_volumes)
 
     for volume in volumes:
-        bvolume = _get_blivet_volume(b, volume)
+        bvolumes.append(_get_blivet_volume(None, volume))
+
+    lookups = [bvolume for bvolume in bvolumes
+               if bvolume.ultimately_present and 'fs_type' not in bvolume._volume and bvolume._may_exist()]
+    if lookups:
+        _look_up_fs_types(lookups)
+
+    for bvolume in bvolumes:
         packages.extend(bvolume.required_packages)
 
     return sorted(list(set(packages)))
@@ -1292,15 +2510,16 @@ def update_fstab_identifiers(b, pools, volumes):
 
     for volume in all_volumes:
         if volume['state'] == 'present':
-            device = b.devicetree.resolve_device(volume['_mount_id'])
+            device = resolve_device(b, volume['_mount_id'])
             if device is None and volume['encryption']:
-                device = b.devicetree.resolve_device(volume['_raw_device'])
+                device = resolve_device(b, volume['_raw_device'])
                 if device is not None and not device.isleaf:
                     device = device.children[0]
                     volume['_device'] = device.path
 
             if device is None:
-                raise BlivetAnsibleError("failed to look up device for volume %s (%s/%s)" % (volume['name'], volume['_device'], volume['_mount_id']))
+                raise BlivetAnsibleError("failed to look up device for volume %s (%s/%s)"
+                                         % (volume['name'], volume['_device'], volume['_mount_id']))
             volume['_mount_id'] = device.fstab_spec
             if device.format.type == 'swap':
                 device.format.setup()
@@ -1322,11 +2541,214 @@ def activate_swaps(b, pools, volumes):
 
     for volume in all_volumes:
         if volume['state'] == 'present':
-            device = b.devicetree.resolve_device(volume['_mount_id'])
+            device = resolve_device(b, volume['_mount_id'])
             if device.format.type == 'swap':
                 device.format.setup()
 
 
+def get_online_grows(b):
+    """ Take grow-only resizes of mounted file systems on LVs out of the scheduled actions.
+
+        Blivet tears down the file system to resize it. File systems that can grow while
+        mounted are instead grown by grow_online() after the other actions, so the
+        volume stays in service. Returns a list of (device, size, actions) tuples.
+    """
+    grows = list()
+    for action in b.devicetree.actions.find(action_type="resize", object_type="format"):
+        device = action.device
+        fmt = action.format
+        if not (action.is_grow and isinstance(device, devices.LVMLogicalVolumeDevice) and
+                fmt.type in ONLINE_GROW_FS_TYPES and fmt.status and getattr(fmt, 'system_mountpoint', None)):
+            continue
+
+        device_actions = b.devicetree.actions.find(device=device, action_type="resize", object_type="device")
+        if any(not a.is_grow for a in device_actions):
+            continue
+
+        # removing the actions resets the device's size
+        size = device.size
+        for device_action in device_actions + [action]:
+            b.devicetree.actions.remove(device_action)
+
+        log.info("growing %s to %s while it is mounted on %s", device.name, size, fmt.system_mountpoint)
+        grows.append((device, size, device_actions + [action]))
+
+    return grows
+
+
+def grow_online(grows):
+    """ Extend the LVs and then grow their mounted file systems. """
+    for (device, size, _actions) in grows:
+        commands = [["lvextend", "--size", "%db" % int(size), "%s/%s" % (device.vg.name, device.lvname)]]
+        if device.format.type == "xfs":
+            commands.append(["xfs_growfs", device.format.system_mountpoint])
+        else:
+            commands.append(["resize2fs", device.path])
+
+        for command in commands:
+            if run_program(command) != 0:
+                raise BlivetAnsibleError("failed to grow volume '%s' online: '%s' failed"
+                                         % (device.name, " ".join(command)))
+
+
+def action_dict(action):
+    return dict(action=action.type_desc_str,
+                fs_type=action.format.type if action.is_format else None,
+                device=action.device.path)
+
+
+def plan_action_dict(action):
+    """ Describe an action along with the identity of the device it targets. """
+    device = action.device
+    info = action_dict(action)
+    info.update(size=int(device.size),
+                uuid=getattr(device, 'uuid', None) or getattr(device.format, 'uuid', None),
+                serial=getattr(device, 'serial', None))
+    return info
+
+
+def get_state_fingerprint(b):
+    """ Return a digest of the devices and formats blivet found on the system. """
+    state = list()
+    for device in sorted(b.devicetree.devices, key=lambda d: d.name):
+        state.append([device.name, device.type, int(device.size), device.format.type,
+                      getattr(device.format, 'uuid', None), getattr(device, 'serial', None)])
+
+    return digest(state)
+
+
+def get_secrets(pools, volumes):
+    """ Return the passphrases in the pool and volume specifications. """
+    specs = list(volumes)
+    for pool in pools:
+        specs.append(pool)
+        specs.extend(pool.get('volumes') or list())
+
+    return [spec['encryption_password'] for spec in specs if spec.get('encryption_password')]
+
+
+def trace_commands(trace):
+    """ Record the programs blivet and libblockdev run in the trace.
+
+        Blivet runs everything through util._run_program, while libblockdev only
+        reports the programs it runs to its log function.
+    """
+    util = sys.modules[BLIVET_PACKAGE + ".util"]
+    util._run_program = trace.wrap(util._run_program)
+    try:
+        blockdev.utils_init_logging(trace.log_func(getattr(sys.modules[BLIVET_PACKAGE], 'log_bd_message', None)))
+    except Exception as e:  # pylint: disable=broad-except
+        log.warning("cannot trace the programs libblockdev runs: %s", str(e))
+
+
+def _file_digest(path):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def get_vg_seqnos(module, names):
+    """ Return the metadata sequence numbers of the named volume groups. """
+    vgs = module.get_bin_path("vgs")
+    if vgs is None:
+        return list()
+
+    rc, out, _err = module.run_command([vgs, "--noheadings", "--nosuffix", "-o", "vg_name,vg_uuid,vg_seqno"])
+    if rc != 0:
+        return None
+
+    return sorted(fields for fields in (line.split() for line in out.splitlines()) if fields and fields[0] in names)
+
+
+def get_host_fingerprint(module, spec, pools, volumes):
+    """ Return a digest of the state of the host's storage as left behind by a run.
+
+        It only covers what the run looked at or set up: the devices of its pools
+        and volumes and everything stacked on or under them, including their
+        signatures and the health of md arrays, the metadata of its volume groups,
+        and fstab and crypttab, so changes to unrelated devices do not count.
+    """
+    vg_seqnos = get_vg_seqnos(module, [pool['name'] for pool in pools])
+    if vg_seqnos is None:
+        return None
+
+    files = dict((path, _file_digest(path)) for path in HOST_STATE_FILES)
+    return digest(dict(spec=spec, vg_seqnos=vg_seqnos, files=files, devices=get_device_state(pools, volumes, sysfs)))
+
+
+def _copy_secrets(source, target):
+    """ Copy the secrets from a list of specifications to the matching list of results.
+
+        Without a source list, the secrets are removed from the results.
+    """
+    for (index, tgt) in enumerate(target or list()):
+        src = source[index] if source and index < len(source) else dict()
+        for key in SECRET_SPEC_KEYS:
+            if key in src:
+                tgt[key] = src[key]
+            else:
+                tgt.pop(key, None)
+
+        if tgt.get('volumes'):
+            _copy_secrets(src.get('volumes'), tgt['volumes'])
+
+
+class ResultFile(object):
+    """ The result of the last successful run, kept for check_unchanged between module invocations.
+
+        The result carries the host fingerprint it was saved with, and only the most
+        recent result is kept.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._results = dict()
+        self.load()
+
+    def load(self):
+        if not self._path:
+            return
+
+        try:
+            with open(self._path) as f:
+                self._results = json.load(f).get('results', dict())
+        except (IOError, OSError, ValueError):
+            return
+
+    def save(self):
+        if not self._path:
+            return
+
+        tmp_path = "%s.tmp" % self._path
+        try:
+            directory = os.path.dirname(self._path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+
+            with open(tmp_path, "w") as f:
+                json.dump(dict(results=self._results), f)
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError) as e:
+            log.warning("failed to save result file '%s': %s", self._path, str(e))
+
+    def get_result(self, spec):
+        """ Return the host fingerprint and the result saved for a specification. """
+        saved = self._results.get(spec, dict())
+        return (saved.get('fingerprint'), saved.get('result'))
+
+    def set_result(self, spec, fingerprint, result):
+        """ Save the result of a successful run, dropping the results of any earlier ones. """
+        self._results = dict()
+        if fingerprint is None or result is None:
+            return
+
+        result = json.loads(json.dumps(dict((key, result.get(key, list())) for key in SAVED_RESULT_KEYS)))
+        _copy_secrets(None, result['pools'])
+        _copy_secrets(None, result['volumes'])
+        self._results[spec] = dict(fingerprint=fingerprint, result=result)
+
+
 def run_module():
     # available arguments/parameters that a user can pass
     module_args = dict(
@@ -1338,7 +2760,17 @@ def run_module():
         pool_defaults=dict(type='dict', required=False),
         volume_defaults=dict(type='dict', required=False),
         use_partitions=dict(type='bool', required=False, default=True),
-        diskvolume_mkfs_option_map=dict(type='dict', required=False, default={}))
+        diskvolume_mkfs_option_map=dict(type='dict', required=False, default={}),
+        scoped_populate=dict(type='bool', required=False, default=False),
+        populate_include=dict(type='list', required=False, default=[]),
+        populate_exclude=dict(type='list', required=False, default=[]),
+        result_file=dict(type='str', required=False, default=None),
+        emit_plan=dict(type='bool', required=False, default=False),
+        apply_plan=dict(type='dict', required=False, default=None),
+        check_unchanged=dict(type='bool', required=False, default=False),
+        record_result=dict(type='dict', required=False, default=None, no_log=True),
+        trace_commands=dict(type='bool', required=False, default=False))
+    module_args.update(PROFILE_ARGUMENT_SPEC)
 
     # seed the result dict in the object
     result = dict(
@@ -1350,10 +2782,38 @@ def run_module():
         pools=list(),
         volumes=list(),
         packages=list(),
+        unchanged=False,
     )
 
     module = AnsibleModule(argument_spec=module_args,
                            supports_check_mode=True)
+    start_profiler(module, "blivet")
+
+    # everything that affects which actions get scheduled
+    spec = digest([module.params[param] for param in ('pools', 'volumes', 'pool_defaults', 'volume_defaults',
+                                                      'use_partitions', 'disklabel_type', 'safe_mode',
+                                                      'diskvolume_mkfs_option_map')])
+
+    if module.params['check_unchanged']:
+        # a quick look at the host's storage that does not need blivet at all
+        (fingerprint, saved) = ResultFile(module.params['result_file']).get_result(spec)
+        if saved is not None and \
+           get_host_fingerprint(module, spec, saved['pools'], saved['volumes']) == fingerprint:
+            result.update(saved, changed=False, actions=list(), unchanged=True)
+            # only what makes sure the saved state is in place, never a removal
+            result['mounts'] = [mount for mount in result['mounts'] if mount['state'] != 'absent']
+            result['crypts'] = [crypt for crypt in result['crypts'] if crypt['state'] != 'absent']
+            _copy_secrets(module.params['pools'], result['pools'])
+            _copy_secrets(module.params['volumes'], result['volumes'])
+        module.exit_json(**result)
+
+    if module.params['record_result'] is not None:
+        saved = module.params['record_result']
+        result_file = ResultFile(module.params['result_file'])
+        result_file.set_result(spec, get_host_fingerprint(module, spec, saved['pools'], saved['volumes']), saved)
+        result_file.save()
+        module.exit_json(**result)
+
     if not BLIVET_PACKAGE:
         module.fail_json(msg="Failed to import the blivet or blivet3 Python modules",
                          exception=inspect.cleandoc("""
@@ -1385,90 +2845,169 @@ def run_module():
     if 'volume_defaults' in module.params:
         volume_defaults = module.params['volume_defaults']
 
-    b = Blivet()
-    b.reset()
-    fstab = FSTab(b)
-    actions = list()
+    timings = Timings()
+
+    # check the whole specification before spending any time on device discovery
+    with timings.phase("validate"):
+        errors = validate_spec(module.params['pools'], module.params['volumes'],
+                               pool_defaults=pool_defaults, volume_defaults=volume_defaults,
+                               pool_types=_BLIVET_POOL_TYPES, volume_types=_BLIVET_VOLUME_TYPES)
+    if errors:
+        module.fail_json(msg="; ".join(errors), **result)
 
     if module.params['packages_only']:
         try:
-            result['packages'] = get_required_packages(b, module.params['pools'], module.params['volumes'])
+            result['packages'] = get_required_packages(module.params['pools'], module.params['volumes'])
         except BlivetAnsibleError as e:
             module.fail_json(msg=str(e), **result)
         module.exit_json(**result)
 
+    result['timings'] = timings.report
+
+    trace = None
+    if module.params['trace_commands']:
+        trace = CommandTrace(secrets=get_secrets(module.params['pools'], module.params['volumes']))
+        trace_commands(trace)
+        result['command_trace'] = dict(commands=trace.commands)
+
+    b = Blivet()
+    if module.params['scoped_populate']:
+        scope = get_populate_scope(module.params['pools'], module.params['volumes'],
+                                   include=module.params['populate_include'],
+                                   exclude=module.params['populate_exclude'], sysfs=sysfs)
+        log.info("limiting device discovery to: %s", scope)
+        b.exclusive_disks = scope
+
+    with timings.phase("reset"):
+        b.reset()
+        try:
+            unlock_devices(b, module.params['pools'], module.params['volumes'])
+        except BlivetAnsibleError as e:
+            module.fail_json(msg=str(e), **result)
+
+    timings.report['devices'] = len(b.devicetree.devices)
+    fingerprint = get_state_fingerprint(b)
+    plan = module.params['apply_plan']
+    if plan is not None:
+        errors = check_plan(plan, fingerprint, spec)
+        if errors:
+            module.fail_json(msg="cannot apply plan: %s" % "; ".join(errors), **result)
+
+    with timings.phase("fstab"):
+        fstab = FSTab(b)
+        # scheduling removes devices from the tree, so resolve the entries before that
+        fstab.resolve()
+    actions = list()
+
     def record_action(action):
         if action.is_format and action.format.type is None:
             return
 
         actions.append(action)
 
+    udev_sync = UdevSync(run_program, settle, log=log)
+
     def ensure_udev_update(action):
         if action.is_create:
-            sys_path = action.device.path
-            if os.path.islink(sys_path):
-                sys_path = os.readlink(action.device.path)
-            trigger(action='change', subsystem='block', name=os.path.basename(sys_path))
-
-    def action_dict(action):
-        return dict(action=action.type_desc_str,
-                    fs_type=action.format.type if action.is_format else None,
-                    device=action.device.path)
-
-    duplicates = find_duplicate_names(module.params['pools'])
-    if duplicates:
-        module.fail_json(msg="multiple pools with the same name: {0}".format(",".join(duplicates)),
-                         **result)
-    for pool in module.params['pools']:
-        duplicates = find_duplicate_names(pool.get('volumes', list()))
-        if duplicates:
-            module.fail_json(msg="multiple volumes in pool '{0}' with the "
-                                 "same name: {1}".format(pool['name'], ",".join(duplicates)),
-                             **result)
-        try:
-            manage_pool(b, pool)
-        except BlivetAnsibleError as e:
-            module.fail_json(msg=str(e), **result)
+            udev_sync.add(action.device)
 
-    duplicates = find_duplicate_names(module.params['volumes'])
-    if duplicates:
-        module.fail_json(msg="multiple volumes with the same name: {0}".format(",".join(duplicates)),
-                         **result)
-    for volume in module.params['volumes']:
+    with timings.phase("schedule"):
         try:
-            manage_volume(b, volume)
+            (bpools, bvolumes) = schedule_actions(b, module.params['pools'], module.params['volumes'],
+                                                  timings=timings)
         except BlivetAnsibleError as e:
             module.fail_json(msg=str(e), **result)
 
-    scheduled = b.devicetree.actions.find()
+        all_bvolumes = [bv for bpool in bpools for bv in bpool._blivet_volumes] + bvolumes
+        grows = get_online_grows(b)
+        scheduled = b.devicetree.actions.find()
     result['packages'] = b.packages[:]
 
-    for action in scheduled:
-        if (action.is_destroy or action.is_resize) and action.is_format and action.format.exists and \
-           (action.format.mountable or action.format.type == "swap"):
-            action.format.teardown()
-
-    if scheduled:
-        # execute the scheduled actions, committing changes to disk
-        callbacks.action_executed.add(record_action)
-        callbacks.action_executed.add(ensure_udev_update)
-        try:
-            b.devicetree.actions.process(devices=b.devicetree.devices, dry_run=module.check_mode)
-        except Exception as e:
-            module.fail_json(msg="Failed to commit changes to disk: %s" % str(e), **result)
-        finally:
-            result['changed'] = True
-            result['actions'] = [action_dict(a) for a in actions]
-
-    update_fstab_identifiers(b, module.params['pools'], module.params['volumes'])
-    activate_swaps(b, module.params['pools'], module.params['volumes'])
+    planned = [plan_action_dict(a) for a in scheduled]
+    planned.extend(plan_action_dict(a) for (_device, _size, grow_actions) in grows for a in grow_actions)
+    for bvolume in all_bvolumes:
+        planned.extend(bvolume.get_cache_actions())
+
+    if plan is not None:
+        errors = compare_actions(plan.get('actions', list()), planned)
+        if errors:
+            module.fail_json(msg="cannot apply plan: %s" % "; ".join(errors), **result)
+
+    if trace is not None:
+        for action in scheduled:
+            action.execute = trace.attributed(action.execute, "%(action)s %(device)s" % action_dict(action))
+
+    with timings.phase("process"):
+        for action in scheduled:
+            if (action.is_destroy or action.is_resize) and action.is_format and action.format.exists and \
+               (action.format.mountable or action.format.type == "swap"):
+                action.format.teardown()
+
+        if scheduled:
+            # execute the scheduled actions, committing changes to disk
+            callbacks.action_executed.add(record_action)
+            callbacks.action_executed.add(ensure_udev_update)
+            try:
+                b.devicetree.actions.process(devices=b.devicetree.devices, dry_run=module.check_mode)
+                udev_sync.sync()
+            except Exception as e:
+                module.fail_json(msg="Failed to commit changes to disk: %s" % str(e), **result)
+            finally:
+                result['changed'] = True
+                result['actions'] = [action_dict(a) for a in actions]
 
-    result['mounts'] = get_mount_info(module.params['pools'], module.params['volumes'], actions, fstab)
-    result['crypts'] = get_crypt_info(actions)
+    if grows:
+        with timings.phase("grow"):
+            try:
+                if not module.check_mode:
+                    grow_online(grows)
+            except BlivetAnsibleError as e:
+                module.fail_json(msg=str(e), **result)
+            finally:
+                result['changed'] = True
+                actions.extend(a for (_device, _size, grow_actions) in grows for a in grow_actions)
+                result['actions'] = [action_dict(a) for a in actions]
+
+    cached = [bv for bv in all_bvolumes if getattr(bv, '_cache_changes', None)]
+    if cached and not module.check_mode:
+        with timings.phase("cache"):
+            for bvolume in cached:
+                try:
+                    result['actions'].extend(bvolume.apply_cache_changes())
+                except BlivetAnsibleError as e:
+                    module.fail_json(msg=str(e), **result)
+
+    if cached:
+        result['changed'] = True
+
+    for bspec in bpools + bvolumes:
+        if bspec._spec_dict.get('raid_level') and bspec._device is not None and bspec.ultimately_present:
+            bspec._spec_dict['_raid_resync'] = get_raid_resync(bspec._device)
+
+    with timings.phase("fstab_identifiers"):
+        update_fstab_identifiers(b, module.params['pools'], module.params['volumes'])
+    with timings.phase("swaps"):
+        activate_swaps(b, module.params['pools'], module.params['volumes'])
+
+    with timings.phase("mounts"):
+        result['mounts'] = get_mount_info(module.params['pools'], module.params['volumes'], actions, fstab)
+        result['crypts'] = get_crypt_info(actions)
     result['leaves'] = [d.path for d in b.devicetree.leaves]
     result['pools'] = module.params['pools']
     result['volumes'] = module.params['volumes']
 
+    if module.params['emit_plan']:
+        result['plan'] = make_plan(fingerprint, spec, planned, result['mounts'], result['crypts'])
+
+    if trace is not None:
+        result['command_trace'] = trace.summary()
+
+    if not module.check_mode:
+        # the result is only recorded once the role has set up its mounts and crypttab entries
+        result_file = ResultFile(module.params['result_file'])
+        result_file.set_result(spec, None, None)
+        result_file.save()
+
     # success - return result
     module.exit_json(**result)
 
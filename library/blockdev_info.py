@@ -18,7 +18,19 @@ version_added: "2.5"
 description:
     - "WARNING: Do not use this module directly! It is only for role internal use."
     - "This module collects information about block devices"
-options: {}
+options:
+    profile:
+        description:
+            - path of a directory on the managed host; when set, the module runs under cProfile
+              and tracemalloc, writes the profile and the memory report there and returns the
+              hottest functions in profile. Defaults to the STORAGE_LSR_PROFILE environment variable
+        type: path
+    sysroot:
+        description:
+            - directory to read /sys and /dev from in place of /, for running the module against
+              a synthetic device tree. lsblk and blkid are still looked up in PATH. Defaults to the
+              STORAGE_LSR_SYSROOT environment variable
+        type: path
 author:
     - David Lehman (@dwlehman)
 '''
@@ -41,23 +53,27 @@ import os
 import shlex
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.storage_lsr.profile import PROFILE_ARGUMENT_SPEC, start_profiler
+from ansible.module_utils.storage_lsr.sysroot import SYSROOT_ARGUMENT_SPEC, SysRoot
 
 
 LSBLK_DEVICE_TYPES = {"part": "partition"}
 DEV_MD_DIR = '/dev/md'
 
+sysroot = SysRoot()
+
 
 def fixup_md_path(path):
     if not path.startswith("/dev/md"):
         return path
 
-    if not os.path.exists(DEV_MD_DIR):
+    if not os.path.exists(sysroot.path(DEV_MD_DIR)):
         return path
 
     ret = path
-    for md in os.listdir(DEV_MD_DIR):
+    for md in os.listdir(sysroot.path(DEV_MD_DIR)):
         md_path = "%s/%s" % (DEV_MD_DIR, md)
-        if os.path.realpath(md_path) == os.path.realpath(path):
+        if sysroot.realpath(md_path) == sysroot.realpath(path):
             ret = md_path
             break
 
@@ -88,6 +104,8 @@ def get_block_info(module):
 
 def run_module():
     module_args = dict()
+    module_args.update(PROFILE_ARGUMENT_SPEC)
+    module_args.update(SYSROOT_ARGUMENT_SPEC)
 
     result = dict(
         info=None,
@@ -97,6 +115,10 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    start_profiler(module, "blockdev_info")
+
+    global sysroot
+    sysroot = SysRoot(module.params['sysroot'])
 
     try:
         result['info'] = get_block_info(module)
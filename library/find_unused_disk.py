@@ -29,6 +29,20 @@ options:
         description: Specifies the minimum disk size to return an unused disk.
         default: 0
         type: str
+
+    profile:
+        description:
+            - path of a directory on the managed host; when set, the module runs under cProfile
+              and tracemalloc, writes the profile and the memory report there and returns the
+              hottest functions in profile. Defaults to the STORAGE_LSR_PROFILE environment variable
+        type: path
+
+    sysroot:
+        description:
+            - directory to read /sys and /dev from in place of /, for running the module against
+              a synthetic device tree. lsblk and blkid are still looked up in PATH. Defaults to the
+              STORAGE_LSR_SYSROOT environment variable
+        type: path
 '''
 
 EXAMPLES = '''
@@ -69,15 +83,19 @@ import os
 import re
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.storage_lsr.profile import PROFILE_ARGUMENT_SPEC, start_profiler
 from ansible.module_utils.storage_lsr.size import Size
+from ansible.module_utils.storage_lsr.sysroot import SYSROOT_ARGUMENT_SPEC, SysRoot
 
 
 SYS_CLASS_BLOCK = "/sys/class/block/"
 IGNORED_DEVICES = [re.compile(r'^/dev/nullb\d+$')]
 
+sysroot = SysRoot()
+
 
 def is_ignored(disk_path):
-    sys_path = os.path.realpath(disk_path)
+    sys_path = sysroot.realpath(disk_path)
     return any(ignore.match(sys_path) is not None for ignore in IGNORED_DEVICES)
 
 
@@ -89,31 +107,31 @@ def no_signature(run_command, disk_path):
 
 def no_holders(disk_path):
     """Return true if the disk has no holders."""
-    holders = os.listdir(SYS_CLASS_BLOCK + get_sys_name(disk_path) + '/holders/')
+    holders = os.listdir(sysroot.path(SYS_CLASS_BLOCK + get_sys_name(disk_path) + '/holders/'))
     return len(holders) == 0
 
 
 def can_open(disk_path):
     """Return true if the device can be opened with exclusive access."""
     try:
-        os.open(disk_path, os.O_EXCL)
+        os.open(sysroot.path(disk_path), os.O_EXCL)
         return True
     except OSError:
         return False
 
 
 def get_sys_name(disk_path):
-    if not os.path.islink(disk_path):
+    if not os.path.islink(sysroot.path(disk_path)):
         return os.path.basename(disk_path)
 
     node_dir = '/'.join(disk_path.split('/')[-1])
-    return os.path.normpath(node_dir + '/' + os.readlink(disk_path))
+    return os.path.normpath(node_dir + '/' + os.readlink(sysroot.path(disk_path)))
 
 
 def get_partitions(disk_path):
     sys_name = get_sys_name(disk_path)
     partitions = list()
-    for filename in os.listdir(SYS_CLASS_BLOCK + sys_name):
+    for filename in os.listdir(sysroot.path(SYS_CLASS_BLOCK + sys_name)):
         if re.match(sys_name + r'p?\d+$', filename):
             partitions.append(filename)
 
@@ -146,6 +164,8 @@ def run_module():
         max_return=dict(type='int', required=False, default=10),
         min_size=dict(type='str', required=False, default=0)
     )
+    module_args.update(PROFILE_ARGUMENT_SPEC)
+    module_args.update(SYSROOT_ARGUMENT_SPEC)
 
     result = dict(
         changed=False,
@@ -156,6 +176,10 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    start_profiler(module, "find_unused_disk")
+
+    global sysroot
+    sysroot = SysRoot(module.params['sysroot'])
 
     for path, attrs in get_disks(module).items():
         if is_ignored(path):
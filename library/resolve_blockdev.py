@@ -25,6 +25,18 @@ options:
             - String describing a block device
         required: true
         type: str
+    profile:
+        description:
+            - path of a directory on the managed host; when set, the module runs under cProfile
+              and tracemalloc, writes the profile and the memory report there and returns the
+              hottest functions in profile. Defaults to the STORAGE_LSR_PROFILE environment variable
+        type: path
+    sysroot:
+        description:
+            - directory to read /sys and /dev from in place of /, for running the module against
+              a synthetic device tree. lsblk and blkid are still looked up in PATH. Defaults to the
+              STORAGE_LSR_SYSROOT environment variable
+        type: path
 author:
     - David Lehman (@dwlehman)
 '''
@@ -50,46 +62,56 @@ device:
     returned: success
 '''
 
-import glob
 import os
 import re
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.storage_lsr.profile import PROFILE_ARGUMENT_SPEC, start_profiler
+from ansible.module_utils.storage_lsr.sysroot import SYSROOT_ARGUMENT_SPEC, SysRoot
 
 DEV_MD = "/dev/md"
 DEV_MAPPER = "/dev/mapper"
 SYS_CLASS_BLOCK = "/sys/class/block"
-SEARCH_DIRS = ['/dev', DEV_MAPPER, DEV_MD] + glob.glob("/dev/disk/by-*")
+SEARCH_DIRS = ['/dev', DEV_MAPPER, DEV_MD]
+DEV_DISK_BY = "/dev/disk/by-*"
 MD_KERNEL_DEV = re.compile(r'/dev/md\d+(p\d+)?$')
 
+sysroot = SysRoot()
+
 
 def resolve_blockdev(spec, run_cmd):
     if "=" in spec:
         device = run_cmd("blkid -t %s -o device" % spec)[1].strip()
     elif not spec.startswith('/'):
-        for devdir in SEARCH_DIRS:
+        for devdir in SEARCH_DIRS + sysroot.glob(DEV_DISK_BY):
             device = "%s/%s" % (devdir, spec)
-            if os.path.exists(device):
+            if os.path.exists(sysroot.path(device)):
                 break
             else:
                 device = ''
     else:
         device = spec
 
-    if not device or not os.path.exists(device):
+    if not device or not os.path.exists(sysroot.path(device)):
         return ''
 
-    return canonical_device(os.path.realpath(device))
+    return canonical_device(sysroot.realpath(device))
 
 
 def _get_dm_name_from_kernel_dev(kdev):
-    return open("%s/%s/dm/name" % (SYS_CLASS_BLOCK, os.path.basename(kdev))).read().strip()
+    return open(sysroot.path("%s/%s/dm/name" % (SYS_CLASS_BLOCK, os.path.basename(kdev)))).read().strip()
 
 
 def _get_md_name_from_kernel_dev(kdev):
-    minor = os.minor(os.stat(kdev).st_rdev)
-    return next(name for name in os.listdir(DEV_MD)
-                if os.minor(os.stat("%s/%s" % (DEV_MD, name)).st_rdev) == minor)
+    names = os.listdir(sysroot.path(DEV_MD))
+    # udev links the array names to the kernel device nodes
+    name = next((name for name in names if sysroot.realpath("%s/%s" % (DEV_MD, name)) == kdev), None)
+    if name is not None:
+        return name
+
+    minor = os.minor(os.stat(sysroot.path(kdev)).st_rdev)
+    return next(name for name in names
+                if os.minor(os.stat(sysroot.path("%s/%s" % (DEV_MD, name))).st_rdev) == minor)
 
 
 def canonical_device(device):
@@ -104,6 +126,8 @@ def run_module():
     module_args = dict(
         spec=dict(type='str', required=True)
     )
+    module_args.update(PROFILE_ARGUMENT_SPEC)
+    module_args.update(SYSROOT_ARGUMENT_SPEC)
 
     result = dict(
         device=None,
@@ -113,13 +137,17 @@ def run_module():
         argument_spec=module_args,
         supports_check_mode=True
     )
+    start_profiler(module, "resolve_blockdev")
+
+    global sysroot
+    sysroot = SysRoot(module.params['sysroot'])
 
     try:
         result['device'] = resolve_blockdev(module.params['spec'], run_cmd=module.run_command)
     except Exception:
         pass
 
-    if not result['device'] or not os.path.exists(result['device']):
+    if not result['device'] or not os.path.exists(sysroot.path(result['device'])):
         module.fail_json(msg="The {0} device spec could not be resolved".format(module.params['spec']))
 
     module.exit_json(**result)
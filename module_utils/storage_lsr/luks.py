@@ -0,0 +1,58 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+LUKS1_SECTOR_SIZE = 512  # LUKS1 only supports 512 byte sectors
+# luksDump fields of a LUKS2 keyslot, mapped to the encryption settings of the role
+LUKS2_KEYSLOT_FIELDS = {"PBKDF": "encryption_pbkdf",
+                        "Memory": "encryption_pbkdf_memory",
+                        "Time cost": "encryption_pbkdf_iterations",
+                        "Iterations": "encryption_pbkdf_iterations"}
+
+
+def _split_field(line):
+    (key, value) = line.split(":", 1)
+    return (key.strip(), value.strip())
+
+
+def parse_luks_dump(output):
+    """ Return the encryption settings that `cryptsetup luksDump` reports for a LUKS header.
+
+        The pbkdf settings are those of the first key slot in use. Settings that are not
+        stored in the header (like encryption_pbkdf_time) are left out.
+    """
+    lines = output.splitlines()
+    fields = [_split_field(line) for line in lines if ":" in line]
+    version = dict(fields).get("Version")
+    settings = dict()
+    if version == "1":
+        settings['encryption_pbkdf'] = "pbkdf2"
+        settings['encryption_sector_size'] = LUKS1_SECTOR_SIZE
+        for (i, line) in enumerate(lines):
+            if line.startswith("Key Slot") and line.rstrip().endswith("ENABLED"):
+                slot = [_split_field(slot_line) for slot_line in lines[i + 1:i + 2] if ":" in slot_line]
+                if slot and slot[0][0] == "Iterations":
+                    settings['encryption_pbkdf_iterations'] = int(slot[0][1])
+                break
+    elif version == "2":
+        section = None
+        slot = None
+        for line in lines:
+            if line and not line[0].isspace():
+                # a top-level section like "Data segments:" or "Keyslots:"
+                section = line.split(":")[0].strip()
+                continue
+            if ":" not in line:
+                continue
+
+            (key, value) = _split_field(line)
+            if section == "Data segments" and key == "sector" and 'encryption_sector_size' not in settings:
+                settings['encryption_sector_size'] = int(value.split()[0])
+            elif section == "Keyslots" and key.isdigit():
+                # only the first key slot is read
+                slot = key if slot is None else False
+            elif section == "Keyslots" and slot and key in LUKS2_KEYSLOT_FIELDS:
+                param_name = LUKS2_KEYSLOT_FIELDS[key]
+                settings[param_name] = value if param_name == 'encryption_pbkdf' else int(value)
+
+    return settings
@@ -0,0 +1,102 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+XFS_MAX_AG_SIZE = 2 ** 40  # 1 TiB
+XFS_MIN_AG_SIZE = 16 * 2 ** 20  # 16 MiB
+XFS_MIN_AG_COUNT = 4
+EXT_BLOCK_SIZE = 4096
+
+# option keys that set the same thing, mapped to the key the role uses
+OPTION_ALIASES = {"sunit": "su", "swidth": "sw", "stripe-width": "stripe_width"}
+
+
+def _option_key(item):
+    key = item.split("=")[0]
+    return OPTION_ALIASES.get(key, key)
+
+
+def merge_options(options, derived):
+    """ Add derived mkfs options to the user's options without overriding any of them.
+
+        derived is a list of (flag, items) pairs like ("-d", ["su=64k", "sw=4"]). Items
+        are merged into the last occurrence of the flag in the user's options, because
+        mke2fs only honors the last -E. Flags without items are added unless present.
+        Returns the merged options and the (flag, items) pairs that were actually added.
+    """
+    tokens = (options or "").split()
+    added = list()
+    for (flag, items) in derived:
+        positions = [i for (i, token) in enumerate(tokens) if token == flag]
+        if not items:
+            if not positions:
+                tokens.append(flag)
+                added.append((flag, items))
+            continue
+
+        user_keys = set(_option_key(item)
+                        for i in positions if i + 1 < len(tokens)
+                        for item in tokens[i + 1].split(","))
+        missing = [item for item in items if _option_key(item) not in user_keys]
+        if not missing:
+            continue
+
+        if positions and positions[-1] + 1 < len(tokens):
+            tokens[positions[-1] + 1] += "," + ",".join(missing)
+        else:
+            tokens.extend([flag, ",".join(missing)])
+        added.append((flag, missing))
+
+    return (" ".join(tokens), added)
+
+
+def raid_data_disks(level, active_devices):
+    """ Return the number of data disks in a stripe of a RAID array, or None if it is not striped. """
+    level = str(level).lower()
+    if not level.startswith("raid") and level.isdigit():
+        level = "raid" + level
+
+    if level in ("raid0", "striped", "stripe"):
+        data_disks = active_devices
+    elif level in ("raid4", "raid5"):
+        data_disks = active_devices - 1
+    elif level == "raid6":
+        data_disks = active_devices - 2
+    elif level == "raid10":
+        # the default near=2 layout
+        data_disks = active_devices // 2
+    else:
+        return None
+
+    return data_disks if data_disks > 0 else None
+
+
+def xfs_agcount(data_disks, size):
+    """ Return an allocation group count that is a multiple of the data disks, or None. """
+    if not size:
+        return None
+
+    minimum = max(XFS_MIN_AG_COUNT, -(-size // XFS_MAX_AG_SIZE))
+    agcount = -(-minimum // data_disks) * data_disks
+    if size // agcount < XFS_MIN_AG_SIZE:
+        return None
+
+    return agcount
+
+
+def stripe_options(fs_type, stripe_unit, data_disks, size=None):
+    """ Return the mkfs options that align a file system to stripe_unit x data_disks. """
+    if not stripe_unit or not data_disks or data_disks < 2:
+        return list()
+
+    if fs_type == "xfs":
+        items = ["su=%dk" % (stripe_unit // 1024), "sw=%d" % data_disks]
+        agcount = xfs_agcount(data_disks, size)
+        if agcount:
+            items.append("agcount=%d" % agcount)
+        return [("-d", items)]
+    elif fs_type in ("ext2", "ext3", "ext4") and stripe_unit >= EXT_BLOCK_SIZE:
+        stride = stripe_unit // EXT_BLOCK_SIZE
+        return [("-E", ["stride=%d" % stride, "stripe_width=%d" % (stride * data_disks)])]
+
+    return list()
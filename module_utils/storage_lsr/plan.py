@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import hashlib
+import json
+
+PLAN_VERSION = 1
+
+# the parts of a planned action that have to match when the plan is applied
+ACTION_KEYS = ("action", "fs_type", "device", "size")
+
+
+def digest(data):
+    """ Return a stable hex digest of JSON-serializable data. """
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def make_plan(fingerprint, spec, actions, mounts, crypts):
+    """ Return a plan that can be reviewed, stored and handed back to the module to apply. """
+    return dict(version=PLAN_VERSION, fingerprint=fingerprint, spec=spec,
+                actions=actions, mounts=mounts, crypts=crypts)
+
+
+def check_plan(plan, fingerprint, spec):
+    """ Check that a plan was made for this specification and the current state of the system.
+
+        Returns a list of the reasons the plan cannot be applied.
+    """
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+        return ["unsupported plan version '%s'" % (plan.get('version') if isinstance(plan, dict) else None)]
+
+    errors = list()
+    if plan.get('spec') != spec:
+        errors.append("plan was made for a different specification")
+
+    if plan.get('fingerprint') != fingerprint:
+        errors.append("storage configuration has changed since the plan was made")
+
+    return errors
+
+
+def _action_key(action):
+    return tuple(action.get(key) for key in ACTION_KEYS)
+
+
+def _describe_action(action):
+    return "%s %s (size %s, fs_type %s)" % (action.get('action'), action.get('device'),
+                                            action.get('size'), action.get('fs_type'))
+
+
+def compare_actions(planned, scheduled):
+    """ Return a list of differences between the planned and the scheduled actions. """
+    errors = list()
+    for (index, (plan_action, action)) in enumerate(zip(planned, scheduled)):
+        if _action_key(plan_action) != _action_key(action):
+            errors.append("action %d is '%s' instead of the planned '%s'"
+                          % (index + 1, _describe_action(action), _describe_action(plan_action)))
+
+    if len(planned) != len(scheduled):
+        errors.append("%d actions scheduled instead of the planned %d" % (len(scheduled), len(planned)))
+
+    return errors
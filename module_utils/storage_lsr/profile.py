@@ -0,0 +1,98 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import time
+
+from ansible.module_utils.basic import env_fallback
+
+PROFILE_ENV_VAR = "STORAGE_LSR_PROFILE"
+TOP_FUNCTIONS = 20
+TOP_ALLOCATIONS = 20
+
+# argument spec of the parameter shared by the modules that can be profiled
+PROFILE_ARGUMENT_SPEC = dict(profile=dict(type='path', required=False, default=None,
+                                          fallback=(env_fallback, [PROFILE_ENV_VAR])))
+
+
+def start_profiler(module, name):
+    """ Profile the rest of the module run if the profile parameter names a directory.
+
+        The profile and the memory report are written when the module exits and
+        the top functions are added to its result. Returns the profiler or None.
+    """
+    directory = module.params.get('profile')
+    if not directory:
+        return None
+
+    profiler = Profiler(directory, name)
+    profiler.start()
+    for method in ('exit_json', 'fail_json'):
+        setattr(module, method, profiler.wrap_exit(getattr(module, method)))
+
+    return profiler
+
+
+class Profiler(object):
+    """ cProfile and tracemalloc for a single module run. """
+    def __init__(self, directory, name):
+        self._directory = directory
+        self._prefix = "%s-%d-%d" % (name, int(time.time()), os.getpid())
+        self._profile = None
+        self._tracemalloc = None
+
+    def start(self):
+        import cProfile
+        try:
+            import tracemalloc
+        except ImportError:
+            pass
+        else:
+            self._tracemalloc = tracemalloc
+            tracemalloc.start()
+
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self):
+        """ Stop profiling, write the reports and return a summary for the module result. """
+        import pstats
+
+        self._profile.disable()
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory, 0o700)
+
+        report = dict(path=os.path.join(self._directory, self._prefix + ".prof"))
+        self._profile.dump_stats(report['path'])
+
+        stats = pstats.Stats(self._profile).stats
+        hot = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        report['top'] = [dict(function="%s:%d(%s)" % key, calls=nc, total_time=round(tt, 6),
+                              cumulative_time=round(ct, 6))
+                         for (key, (_cc, nc, tt, ct, _callers)) in hot]
+
+        if self._tracemalloc is not None:
+            snapshot = self._tracemalloc.take_snapshot()
+            (current, peak) = self._tracemalloc.get_traced_memory()
+            self._tracemalloc.stop()
+
+            report.update(memory_path=os.path.join(self._directory, self._prefix + "-memory.txt"),
+                          current_memory=current, peak_memory=peak)
+            with open(report['memory_path'], "w") as f:
+                f.write("peak: %d bytes\ncurrent: %d bytes\n\n" % (peak, current))
+                for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                    f.write("%s\n" % stat)
+
+        return report
+
+    def wrap_exit(self, exit_func):
+        """ Wrap exit_json or fail_json to add the profile to the result. """
+        def exit(*args, **kwargs):
+            try:
+                kwargs['profile'] = self.stop()
+            except (IOError, OSError) as e:
+                kwargs['profile'] = dict(error="failed to write the profile: %s" % str(e))
+            exit_func(*args, **kwargs)
+
+        return exit
@@ -0,0 +1,221 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import fnmatch
+import os
+
+from ansible.module_utils.storage_lsr.sysroot import SysRoot
+
+SYS_CLASS_BLOCK = "/sys/class/block"
+DEV_MAPPER = "/dev/mapper"
+DEV_MD = "/dev/md"
+DEV_DISK_BY = {"LABEL": "/dev/disk/by-label",
+               "UUID": "/dev/disk/by-uuid",
+               "PARTLABEL": "/dev/disk/by-partlabel",
+               "PARTUUID": "/dev/disk/by-partuuid"}
+UDEV_DATA = "/run/udev/data"
+# what udev's blkid builtin found on a device: its file system, LUKS, LVM or md signature and partition table
+UDEV_SIGNATURE_PROPERTIES = ("ID_FS_TYPE", "ID_FS_UUID", "ID_FS_UUID_SUB", "ID_PART_TABLE_TYPE", "ID_PART_TABLE_UUID")
+
+
+class Sysfs(object):
+    """ Block devices and the way they are stacked, as /sys/class/block shows them.
+
+        Devices are referred to by their kernel names (eg: sda1, dm-0, md127).
+    """
+    def __init__(self, sysroot=None):
+        self._sysroot = sysroot or SysRoot()
+
+    def _path(self, name, *parts):
+        return self._sysroot.path(os.path.join(SYS_CLASS_BLOCK, name, *parts))
+
+    def list(self, name, subdir=""):
+        """ Return the entries of a block device's sysfs directory (or a subdirectory of it). """
+        try:
+            return os.listdir(self._path(name, subdir))
+        except OSError:
+            return list()
+
+    def read(self, name, *attr):
+        """ Return the contents of a sysfs attribute of a block device, or None if it has none. """
+        try:
+            with open(self._path(name, *attr)) as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def names(self):
+        """ Return the kernel names of all block devices. """
+        try:
+            return os.listdir(self._sysroot.path(SYS_CLASS_BLOCK))
+        except OSError:
+            return list()
+
+    def dm_name(self, name):
+        """ Return the device-mapper name of a dm device, or None for other devices. """
+        dm_name = self.read(name, "dm", "name")
+        return dm_name.strip() if dm_name is not None else None
+
+    def neighbors(self, name):
+        """ Return kernel names of the devices stacked directly on or under a block device. """
+        neighbors = self.list(name, "slaves") + self.list(name, "holders")
+        if os.path.exists(self._path(name, "partition")):
+            # the parent disk of a partition is the directory containing it
+            neighbors.append(os.path.basename(os.path.dirname(os.path.realpath(self._path(name)))))
+        else:
+            neighbors.extend(p for p in self.list(name) if os.path.exists(self._path(name, p, "partition")))
+
+        return neighbors
+
+    def kernel_name(self, spec):
+        """ Resolve a device spec to a kernel device name without consulting blivet. """
+        path = None
+        if "=" in spec:
+            key, _eq, value = spec.partition("=")
+            if key.upper() in DEV_DISK_BY:
+                path = os.path.join(DEV_DISK_BY[key.upper()], value.strip('"'))
+        elif spec.startswith("/"):
+            path = spec
+        else:
+            for devdir in ["/dev", DEV_MAPPER, DEV_MD] + self._sysroot.glob("/dev/disk/by-*"):
+                if os.path.exists(self._sysroot.path(os.path.join(devdir, spec))):
+                    path = os.path.join(devdir, spec)
+                    break
+
+        if path is None or not os.path.exists(self._sysroot.path(path)):
+            return None
+
+        return os.path.basename(self._sysroot.realpath(path))
+
+    def named_kernel_names(self, names):
+        """ Return kernel names of existing md and dm devices belonging to the named pools/volumes. """
+        found = set()
+        for name in names:
+            for md_name in (name, "%s-1" % name):
+                kname = self.kernel_name(os.path.join(DEV_MD, md_name))
+                if kname:
+                    found.add(kname)
+
+        # lvm escapes dashes in vg and lv names by doubling them in the dm name
+        prefixes = ["%s-" % name.replace("-", "--") for name in names]
+        for kname in self.names():
+            dm_name = self.dm_name(kname)
+            if dm_name is None:
+                continue
+
+            for prefix in prefixes:
+                if dm_name.startswith(prefix) and not dm_name[len(prefix):].startswith("-"):
+                    found.add(kname)
+
+        return found
+
+    def rdev(self, path):
+        """ Return the device number of a device node, or None if there is none. """
+        try:
+            return os.stat(self._sysroot.path(path)).st_rdev
+        except OSError:
+            return None
+
+    def udev_properties(self, name):
+        """ Return the properties udev has recorded for a block device in its database. """
+        dev = self.read(name, "dev")
+        if dev is None:
+            return dict()
+
+        try:
+            with open(self._sysroot.path(os.path.join(UDEV_DATA, "b%s" % dev.strip()))) as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            return dict()
+
+        return dict(line[2:].partition("=")[::2] for line in lines if line.startswith("E:"))
+
+    def state(self, name):
+        """ Return what the kernel and udev report about a block device and its contents. """
+        properties = self.udev_properties(name)
+        state = dict(uevent=self.read(name, "uevent"), size=self.read(name, "size"),
+                     neighbors=sorted(self.neighbors(name)),
+                     signature=dict((key, properties.get(key)) for key in UDEV_SIGNATURE_PROPERTIES))
+        if self.list(name, "md"):
+            state['md'] = dict((attr, self.read(name, "md", attr)) for attr in ("array_state", "degraded"))
+
+        return state
+
+    def stack(self, knames):
+        """ Return the kernel names of the devices and everything stacked on or under them. """
+        pending = list(knames)
+        stack = set()
+        while pending:
+            kname = pending.pop()
+            if not kname or kname in stack:
+                continue
+
+            stack.add(kname)
+            pending.extend(self.neighbors(kname))
+
+        return stack
+
+
+def get_populate_scope(pools, volumes, include=None, exclude=None, sysfs=None):
+    """ Return the names of the disks blivet has to probe to manage the specified storage.
+
+        The disks listed in the pools and volumes are combined with the devices backing
+        existing pools and volumes of the same names, and then expanded to every device
+        stacked on or under them so that blivet always sees complete device stacks. The
+        names of all disks matching an include pattern are added and those matching an
+        exclude pattern are removed. An empty list means there is nothing to limit the
+        scan to.
+    """
+    sysfs = sysfs or Sysfs()
+    specs = list()
+    names = list()
+    for pool in pools or []:
+        names.append(pool['name'])
+        for item in [pool] + list(pool.get('volumes') or []):
+            if isinstance(item.get('disks'), list):
+                specs.extend(item['disks'])
+
+    for volume in volumes or []:
+        names.append(volume['name'])
+        if isinstance(volume.get('disks'), list):
+            specs.extend(volume['disks'])
+
+    knames = [sysfs.kernel_name(str(spec)) for spec in specs]
+    knames.extend(sysfs.named_kernel_names(names))
+    stack = sysfs.stack(knames)
+
+    # blivet refers to dm devices (eg: multipath) by their dm name
+    scope = set(stack)
+    scope.update(filter(None, (sysfs.dm_name(kname) for kname in stack)))
+
+    if include:
+        for kname in sysfs.names():
+            for name in (kname, sysfs.dm_name(kname)):
+                if name and any(fnmatch.fnmatch(name, pattern) for pattern in include):
+                    scope.add(name)
+
+    if exclude:
+        scope = set(name for name in scope if not any(fnmatch.fnmatch(name, pattern) for pattern in exclude))
+
+    return sorted(scope)
+
+
+def get_device_state(pools, volumes, sysfs=None):
+    """ Return what sysfs and udev report about the devices of the pools and volumes.
+
+        That covers the disks and volumes in the specifications and every device stacked
+        on or under them. The device numbers of the paths are included too, so that a
+        path that now leads to another device counts as a change.
+    """
+    sysfs = sysfs or Sysfs()
+    all_volumes = volumes + [volume for pool in pools for volume in pool.get('volumes') or list()]
+    paths = set()
+    for spec in pools + all_volumes:
+        paths.update(disk if disk.startswith("/") else "/dev/%s" % disk for disk in spec.get('disks') or list())
+    for volume in all_volumes:
+        paths.update(path for path in (volume.get('_device'), volume.get('_raw_device')) if path)
+
+    ids = dict((path, sysfs.rdev(path)) for path in sorted(paths))
+    stack = sysfs.stack(sysfs.kernel_name(path) for path in paths)
+    return dict(ids=ids, devices=dict((name, sysfs.state(name)) for name in stack))
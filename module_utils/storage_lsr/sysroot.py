@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import glob
+import os
+
+from ansible.module_utils.basic import env_fallback
+
+SYSROOT_ENV_VAR = "STORAGE_LSR_SYSROOT"
+
+# argument spec of the parameter shared by the modules that read /sys and /dev directly
+SYSROOT_ARGUMENT_SPEC = dict(sysroot=dict(type='path', required=False, default=None,
+                                          fallback=(env_fallback, [SYSROOT_ENV_VAR])))
+
+
+class SysRoot(object):
+    """ Directory the probe modules read /sys and /dev from in place of /.
+
+        Paths are passed around as the host would see them and only get the root
+        prepended when the file system is accessed, so a module's results do not
+        depend on where its root is. Symlinks within the root must be relative.
+    """
+    def __init__(self, root=None):
+        self.root = os.path.normpath(root) if root else "/"
+
+    def path(self, path):
+        """ Return the location of an absolute path under the root. """
+        if self.root == "/":
+            return path
+
+        return self.root + path
+
+    def strip(self, path):
+        """ Return the absolute path a location under the root stands for. """
+        if self.root == "/":
+            return path
+
+        if path == self.root or path.startswith(self.root + "/"):
+            return path[len(self.root):] or "/"
+
+        return path
+
+    def realpath(self, path):
+        return self.strip(os.path.realpath(self.path(path)))
+
+    def glob(self, pattern):
+        return [self.strip(match) for match in glob.glob(self.path(pattern))]
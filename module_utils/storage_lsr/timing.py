@@ -0,0 +1,56 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import contextlib
+import os
+import time
+
+
+def cpu_time():
+    """ Return the user and system CPU time the process has used so far. """
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Timings(object):
+    """ Wall-clock and CPU times of the phases of a module run.
+
+        The report is kept up to date as the phases end, so a failed run still
+        shows how far it got and where the time went until then.
+    """
+    def __init__(self, clock=time.time, cpu_clock=cpu_time):
+        self._clock = clock
+        self._cpu_clock = cpu_clock
+        self.report = dict(phases=list(), pools=dict(), volumes=dict(), total=dict(wall=0.0, cpu=0.0))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Time a phase of the run; phases that repeat are added up. """
+        start_wall = self._clock()
+        start_cpu = self._cpu_clock()
+        try:
+            yield
+        finally:
+            self._add_phase(name, self._clock() - start_wall, self._cpu_clock() - start_cpu)
+
+    def _add_phase(self, name, wall, cpu):
+        phases = self.report['phases']
+        entry = next((p for p in phases if p['name'] == name), None)
+        if entry is None:
+            entry = dict(name=name, wall=0.0, cpu=0.0)
+            phases.append(entry)
+
+        for (key, elapsed) in (('wall', wall), ('cpu', cpu)):
+            entry[key] = round(entry[key] + elapsed, 3)
+            self.report['total'][key] = round(self.report['total'][key] + elapsed, 3)
+
+    @contextlib.contextmanager
+    def item(self, kind, name):
+        """ Time the work on a pool or volume within a phase. """
+        start = self._clock()
+        try:
+            yield
+        finally:
+            items = self.report[kind]
+            items[name] = round(items.get(name, 0.0) + self._clock() - start, 3)
@@ -0,0 +1,123 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+import re
+import time
+
+REDACTED = "********"
+# options whose values are secrets, whether given as --opt=value or as --opt value
+SECRET_OPTIONS = ("--passphrase", "--password", "--key")
+# messages libblockdev logs around the programs it runs
+BD_RUNNING_RE = re.compile(r"^Running \[(\d+)\] (.*) \.\.\.$")
+BD_DONE_RE = re.compile(r"^\.\.\.done \[(\d+)\] \(exit code: (-?\d+)\)$")
+
+
+def redact(argv, secrets):
+    """ Return a copy of argv with the secrets and the values of secret options masked. """
+    redacted = list()
+    mask_next = False
+    for arg in argv:
+        arg = str(arg)
+        if mask_next:
+            redacted.append(REDACTED)
+            mask_next = False
+            continue
+
+        for secret in secrets:
+            if secret:
+                arg = arg.replace(secret, REDACTED)
+
+        (option, sep, _value) = arg.partition("=")
+        if option in SECRET_OPTIONS:
+            if sep:
+                arg = option + "=" + REDACTED
+            else:
+                mask_next = True
+
+        redacted.append(arg)
+
+    return redacted
+
+
+class CommandTrace(object):
+    """ Record of the external programs run on behalf of the module.
+
+        Commands are attributed to the action being executed, if any.
+    """
+    def __init__(self, secrets=None, clock=time.time):
+        self._secrets = [s for s in (secrets or list()) if s]
+        self._clock = clock
+        self._start = clock()
+        self._action = None
+        self._pending = dict()
+        self.commands = list()
+
+    def _begin(self, argv):
+        entry = dict(argv=redact(argv, self._secrets),
+                     start=round(self._clock() - self._start, 3),
+                     duration=None, rc=None,
+                     action=self._action)
+        self.commands.append(entry)
+        return entry
+
+    def _end(self, entry, rc):
+        entry['duration'] = round(self._clock() - self._start - entry['start'], 3)
+        entry['rc'] = rc
+
+    def attributed(self, func, action):
+        """ Wrap the function that executes an action so the commands it runs are attributed to it. """
+        def execute(*args, **kwargs):
+            previous = self._action
+            self._action = action
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._action = previous
+
+        return execute
+
+    def wrap(self, run_program):
+        """ Wrap a function that runs argv and returns a tuple that starts with its exit status. """
+        def traced(argv, *args, **kwargs):
+            entry = self._begin(argv)
+            ret = None
+            try:
+                ret = run_program(argv, *args, **kwargs)
+                return ret
+            finally:
+                self._end(entry, ret[0] if ret is not None else None)
+
+        return traced
+
+    def log_func(self, chained=None):
+        """ Return a libblockdev log function that records the programs libblockdev runs. """
+        def log(level, msg):
+            match = BD_RUNNING_RE.match(msg)
+            if match:
+                self._pending[match.group(1)] = self._begin(match.group(2).split())
+            else:
+                match = BD_DONE_RE.match(msg)
+                if match and match.group(1) in self._pending:
+                    self._end(self._pending.pop(match.group(1)), int(match.group(2)))
+
+            if chained is not None:
+                chained(level, msg)
+
+        return log
+
+    def summary(self):
+        """ Return the commands with the number of runs and time spent per tool. """
+        tools = dict()
+        for entry in self.commands:
+            tool = os.path.basename(entry['argv'][0]) if entry['argv'] else ""
+            if tool == "udevadm" and len(entry['argv']) > 1:
+                tool = "udevadm " + entry['argv'][1]
+
+            stats = tools.setdefault(tool, dict(count=0, time=0.0))
+            stats['count'] += 1
+            stats['time'] = round(stats['time'] + (entry['duration'] or 0.0), 3)
+
+        return dict(commands=self.commands, tools=tools,
+                    total_time=round(sum(entry['duration'] or 0.0 for entry in self.commands), 3))
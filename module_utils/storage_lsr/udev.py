@@ -0,0 +1,121 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import logging
+import os
+import select
+import socket
+import struct
+import time
+
+UDEV_SETTLE_TIMEOUT = 30  # seconds
+NETLINK_KOBJECT_UEVENT = 15
+UDEV_MONITOR_GROUP = 2  # events that udev has finished processing
+# hosts with thousands of devices emit events faster than the default buffer drains
+UDEV_MONITOR_RCVBUF = 16 * 1024 ** 2
+
+
+class UdevSync(object):
+    """ Trigger change events for a group of devices and wait for just those events.
+
+        Instead of triggering every new device on its own and settling the whole udev
+        queue, the devices are collected while the actions run and triggered with one
+        udevadm call. A udev monitor socket then waits for udev to finish processing
+        the events of these devices only. If the monitor cannot be opened or loses
+        events, the whole udev queue is settled instead.
+    """
+    def __init__(self, run_program, settle, timeout=UDEV_SETTLE_TIMEOUT, log=None):
+        self._run_program = run_program
+        self._settle = settle
+        self._timeout = timeout
+        self._log = log or logging.getLogger(__name__)
+        self._names = list()
+
+    def add(self, device):
+        """ Add the device to the next batch of change events. """
+        sys_path = device.path
+        if os.path.islink(sys_path):
+            sys_path = os.readlink(sys_path)
+
+        name = os.path.basename(sys_path)
+        if name not in self._names:
+            self._names.append(name)
+
+    def _open_monitor(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_KOBJECT_UEVENT)
+        except (AttributeError, socket.error) as e:
+            self._log.debug("failed to open udev monitor: %s", e)
+            return None
+
+        # SO_RCVBUFFORCE lifts the limit of net.core.rmem_max, but needs CAP_NET_ADMIN
+        for option in ("SO_RCVBUFFORCE", "SO_RCVBUF"):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, getattr(socket, option), UDEV_MONITOR_RCVBUF)
+                break
+            except (AttributeError, socket.error):
+                continue
+
+        try:
+            sock.bind((0, UDEV_MONITOR_GROUP))
+        except socket.error as e:
+            self._log.debug("failed to open udev monitor: %s", e)
+            sock.close()
+            return None
+
+        return sock
+
+    @staticmethod
+    def _parse_event(data):
+        """ Return the properties of a udev monitor message as a dict. """
+        # libudev header: prefix, magic, header size, properties offset and length, filters
+        if not data.startswith(b"libudev\0") or len(data) < 24:
+            return dict()
+
+        (offset, length) = struct.unpack("=II", data[16:24])
+        properties = dict()
+        for item in data[offset:offset + length].split(b"\0"):
+            (key, _sep, value) = item.decode("utf-8", "replace").partition("=")
+            properties[key] = value
+
+        return properties
+
+    def _wait(self, sock, names):
+        deadline = time.time() + self._timeout
+        while names:
+            remaining = deadline - time.time()
+            try:
+                if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                    self._log.warning("timed out waiting for udev to process events for: %s", sorted(names))
+                    return
+
+                data = sock.recv(65536)
+            except (select.error, socket.error) as e:
+                # events were dropped (ENOBUFS) or the socket failed, so they cannot be tracked
+                self._log.warning("lost track of udev events (%s), settling the udev queue instead", e)
+                self._settle()
+                return
+
+            event = self._parse_event(data)
+            if event.get("ACTION") == "change" and event.get("SUBSYSTEM") == "block":
+                names.discard(os.path.basename(event.get("DEVPATH", "")))
+
+    def sync(self):
+        """ Trigger change events for the collected devices and wait for them to be processed. """
+        if not self._names:
+            return
+
+        names = self._names
+        self._names = list()
+        sock = self._open_monitor()
+        try:
+            self._run_program(["udevadm", "trigger", "--action=change", "--subsystem-match=block"] +
+                              ["--sysname-match=%s" % name for name in names])
+            if sock is None:
+                self._settle()
+            else:
+                self._wait(sock, set(names))
+        finally:
+            if sock is not None:
+                sock.close()
@@ -0,0 +1,267 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from ansible.module_utils.storage_lsr.size import Size
+
+POOL_TYPES = ("lvm", "partition")
+VOLUME_TYPES = ("disk", "lvm", "partition", "raid", "thin")
+CACHE_MODES = ("writethrough", "writeback", "writecache")
+THIN_POOL_DISCARDS = ("ignore", "nopassdown", "passdown")
+LUKS_PBKDFS = ("argon2i", "argon2id", "pbkdf2")
+LUKS_SECTOR_SIZES = (512, 1024, 2048, 4096)
+
+
+def find_duplicate_names(dicts):
+    """ Return a sorted list of names that appear more than once in a list of dicts. """
+    names = set()
+    duplicates = set()
+    for item in dicts:
+        if item.get('name') in names:
+            duplicates.add(item['name'])
+        names.add(item.get('name'))
+
+    return sorted(duplicates)
+
+
+def _check_disks(spec, kind):
+    if spec.get('disks') is not None and not isinstance(spec['disks'], list):
+        return ["%s disks must be specified as a list" % kind]
+
+    return []
+
+
+def _check_size(volume):
+    size = volume.get('size')
+    if size is None or size == 0:
+        return []
+
+    try:
+        Size(size)
+    except ValueError:
+        return ["invalid size specification for volume '%s': '%s'" % (volume['name'], size)]
+
+    return []
+
+
+def _check_raid_counts(spec):
+    if spec.get('raid_level') in (None, "null", "") or not isinstance(spec.get('disks'), list) or not spec['disks']:
+        return []
+
+    actives = spec.get('raid_device_count')
+    spares = spec.get('raid_spare_count')
+    members = len(spec['disks'])
+    try:
+        counts = [int(count) for count in (actives, spares) if count is not None]
+    except (TypeError, ValueError):
+        counts = [-1]
+
+    if any(not 0 <= count <= members for count in counts) or (len(counts) == 2 and sum(counts) != members):
+        return ["failed to set up '%s': cannot create RAID with %s members (%s active and %s spare)"
+                % (spec['name'], members, actives, spares)]
+
+    return []
+
+
+def _check_encryption(spec, kind):
+    errors = list()
+    pbkdf = spec.get('encryption_pbkdf')
+    if pbkdf is not None and pbkdf not in LUKS_PBKDFS:
+        errors.append("invalid encryption_pbkdf '%s' for %s '%s'" % (pbkdf, kind, spec['name']))
+
+    for param in ('encryption_pbkdf_memory', 'encryption_pbkdf_iterations', 'encryption_pbkdf_time'):
+        value = spec.get(param)
+        try:
+            valid = value is None or int(value) > 0
+        except (TypeError, ValueError):
+            valid = False
+
+        if not valid:
+            errors.append("invalid %s '%s' for %s '%s'" % (param, value, kind, spec['name']))
+
+    sector_size = spec.get('encryption_sector_size')
+    try:
+        valid = sector_size is None or int(sector_size) in LUKS_SECTOR_SIZES
+    except (TypeError, ValueError):
+        valid = False
+
+    if not valid:
+        errors.append("invalid encryption_sector_size '%s' for %s '%s'" % (sector_size, kind, spec['name']))
+
+    # LUKS1 only knows pbkdf2 and 512 byte sectors
+    if spec.get('encryption_luks_version') == "luks1" and \
+       (pbkdf not in (None, "pbkdf2") or sector_size not in (None, 512)):
+        errors.append("encryption_pbkdf '%s' and encryption_sector_size '%s' require LUKS2 for %s '%s'"
+                      % (pbkdf, sector_size, kind, spec['name']))
+
+    return errors
+
+
+def _check_raid_bitmap(spec):
+    bitmap = spec.get('raid_bitmap')
+    if bitmap is None or bitmap in ("internal", "none"):
+        return []
+
+    try:
+        Size(bitmap)
+    except ValueError:
+        return ["invalid raid_bitmap '%s' for '%s'" % (bitmap, spec['name'])]
+
+    return []
+
+
+def _check_thin_pools(pool):
+    thin_pools = pool.get('thin_pools')
+    if not thin_pools:
+        return []
+    elif pool['type'] != "lvm":
+        return ["thin pools are only supported in lvm pools (pool '%s')" % pool['name']]
+    elif not isinstance(thin_pools, list):
+        return ["thin pools of pool '%s' must be specified as a list" % pool['name']]
+    elif any(not thin_pool.get('name') for thin_pool in thin_pools):
+        return ["all thin pools in pool '%s' must have a name" % pool['name']]
+
+    errors = list()
+    duplicates = find_duplicate_names(thin_pools)
+    if duplicates:
+        errors.append("multiple thin pools in pool '%s' with the same name: %s" % (pool['name'], ",".join(duplicates)))
+
+    for thin_pool in thin_pools:
+        for param in ('size', 'metadata_size', 'chunk_size'):
+            value = thin_pool.get(param)
+            if value is None and param != 'size':
+                continue
+
+            try:
+                Size(value)
+            except (TypeError, ValueError):
+                errors.append("invalid %s '%s' for thin pool '%s'" % (param, value, thin_pool['name']))
+
+        if thin_pool.get('discard') not in (None,) + THIN_POOL_DISCARDS:
+            errors.append("invalid discard '%s' for thin pool '%s'" % (thin_pool['discard'], thin_pool['name']))
+
+    return errors
+
+
+def _check_cache(volume):
+    errors = list()
+    if volume.get('cache_size'):
+        try:
+            Size(volume['cache_size'])
+        except ValueError:
+            errors.append("invalid cache size '%s' specified for volume '%s'" % (volume['cache_size'], volume['name']))
+
+        if volume['type'] != "lvm":
+            errors.append("cache is only supported for lvm volumes (volume '%s')" % volume['name'])
+
+    if volume.get('cache_mode') not in (None,) + CACHE_MODES:
+        errors.append("invalid cache mode '%s' specified for volume '%s'" % (volume['cache_mode'], volume['name']))
+
+    if volume.get('cache_devices') is not None and not isinstance(volume['cache_devices'], list):
+        errors.append("cache devices of volume '%s' must be specified as a list" % volume['name'])
+
+    return errors
+
+
+def _check_stripes(volume):
+    stripes = volume.get('stripes')
+    stripe_size = volume.get('stripe_size')
+    if stripes is None and stripe_size is None:
+        return []
+    elif volume['type'] != "lvm":
+        return ["striping is only supported for lvm volumes (volume '%s')" % volume['name']]
+
+    errors = list()
+    try:
+        valid = stripes is None or int(stripes) > 0
+    except (TypeError, ValueError):
+        valid = False
+
+    if not valid:
+        errors.append("invalid number of stripes '%s' for volume '%s'" % (stripes, volume['name']))
+
+    if stripe_size is not None:
+        try:
+            size = int(Size(stripe_size).bytes)
+        except ValueError:
+            size = 0
+
+        # lvm wants a power of two that is at least a page
+        if size < 4096 or size & (size - 1):
+            errors.append("invalid stripe size '%s' for volume '%s'" % (stripe_size, volume['name']))
+
+    return errors
+
+
+def _check_volume(volume, volume_types):
+    if volume['type'] not in volume_types:
+        return ["Volume '%s' has unknown type '%s'" % (volume['name'], volume['type'])]
+
+    return (_check_disks(volume, "volume") + _check_size(volume) + _check_raid_counts(volume) +
+            _check_raid_bitmap(volume) + _check_encryption(volume, "volume") + _check_cache(volume) +
+            _check_stripes(volume))
+
+
+def validate_spec(pools, volumes, pool_defaults=None, volume_defaults=None,
+                  pool_types=POOL_TYPES, volume_types=VOLUME_TYPES):
+    """ Check the pool and volume specifications without looking at any storage.
+
+        Pool and volume types are filled in from the defaults the same way the blivet
+        module does it. Returns a list of all of the errors that were found.
+    """
+    pool_defaults = pool_defaults or dict()
+    volume_defaults = volume_defaults or dict()
+    pools = pools or list()
+    volumes = volumes or list()
+
+    errors = list()
+    for kind, specs in (("pool", pools), ("volume", volumes)):
+        if any(not spec.get('name') for spec in specs):
+            errors.append("all %ss must have a name" % kind)
+
+    if errors:
+        return errors
+
+    duplicates = find_duplicate_names(pools)
+    if duplicates:
+        errors.append("multiple pools with the same name: {0}".format(",".join(duplicates)))
+
+    for pool in pools:
+        pool.setdefault('type', pool_defaults.get('type'))
+        if pool['type'] not in pool_types:
+            errors.append("Pool '%s' has unknown type '%s'" % (pool['name'], pool['type']))
+            continue
+
+        errors.extend(_check_disks(pool, "pool"))
+        errors.extend(_check_raid_counts(pool))
+        errors.extend(_check_raid_bitmap(pool))
+        errors.extend(_check_encryption(pool, "pool"))
+
+        pool_volumes = pool.get('volumes') or list()
+        if any(not volume.get('name') for volume in pool_volumes):
+            errors.append("all volumes in pool '%s' must have a name" % pool['name'])
+            continue
+
+        duplicates = find_duplicate_names(pool_volumes)
+        if duplicates:
+            errors.append("multiple volumes in pool '{0}' with the "
+                          "same name: {1}".format(pool['name'], ",".join(duplicates)))
+
+        errors.extend(_check_thin_pools(pool))
+        for volume in pool_volumes:
+            volume.setdefault('type', pool['type'])
+            errors.extend(_check_volume(volume, volume_types))
+            if volume['type'] == "thin" and pool['type'] != "lvm":
+                errors.append("thin volume '%s' must belong to an lvm pool" % volume['name'])
+
+    duplicates = find_duplicate_names(volumes)
+    if duplicates:
+        errors.append("multiple volumes with the same name: {0}".format(",".join(duplicates)))
+
+    for volume in volumes:
+        volume.setdefault('type', volume_defaults.get('type'))
+        errors.extend(_check_volume(volume, volume_types))
+        if volume['type'] == "thin":
+            errors.append("thin volume '%s' must belong to an lvm pool" % volume['name'])
+
+    return errors
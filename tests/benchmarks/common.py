@@ -0,0 +1,67 @@
+""" Helpers shared by the benchmark scripts. """
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import importlib.util
+import json
+import os
+import sys
+import time
+
+TOP_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+LIBRARY_DIR = os.path.join(TOP_DIR, "library")
+MODULE_UTILS_DIR = os.path.join(TOP_DIR, "module_utils")
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+CALIBRATION_LOOPS = 200000
+
+if MODULE_UTILS_DIR not in sys.path:
+    sys.path.insert(0, MODULE_UTILS_DIR)
+
+
+def load_library_module(name, module_name=None):
+    """ Import one of the role's modules from library/, under module_name if given. """
+    try:
+        importlib.import_module("ansible.module_utils.storage_lsr")
+    except ImportError:
+        # what the test setup does by linking module_utils into ansible's tree
+        sys.modules["ansible.module_utils.storage_lsr"] = importlib.import_module("storage_lsr")
+
+    module_name = module_name or name
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(LIBRARY_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def calibrate():
+    """ Return the time a fixed amount of pure python work takes on this machine. """
+    best = None
+    for _i in range(5):
+        start = time.perf_counter()
+        table = dict()
+        for i in range(CALIBRATION_LOOPS):
+            table[str(i)] = [i] * 3
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return dict()
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(path, baselines):
+    with open(path, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -0,0 +1,733 @@
+""" In-memory stand-in for the parts of blivet the blivet module uses to schedule actions.
+
+    Devices, formats, actions and the device tree behave like blivet's as far as the
+    scheduling code can tell: actions are applied to the tree as they get registered,
+    removing a device detaches it from its parents and lookups scan the whole tree.
+    Nothing is ever probed or executed.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import itertools
+import sys
+import types
+
+from common import load_library_module
+from storage_lsr.size import Size as SpecSize
+
+UNITS = {"B": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4}
+FILESYSTEMS = ("xfs", "ext2", "ext3", "ext4", "vfat")
+FORMAT_NAMES = {None: "Unknown", "lvmpv": "physical volume (LVM)", "luks": "LUKS",
+                "disklabel": "partition table", "mdmember": "software RAID", "swap": "swap"}
+FORMAT_PACKAGES = {"xfs": ["xfsprogs"], "ext2": ["e2fsprogs"], "ext3": ["e2fsprogs"], "ext4": ["e2fsprogs"],
+                   "vfat": ["dosfstools"], "lvmpv": ["lvm2"], "luks": ["cryptsetup"], "mdmember": ["mdadm"]}
+PE_SIZE = 4 * 1024 ** 2
+
+
+class Size(int):
+    """ A number of bytes that stays a Size through arithmetic. """
+    def __new__(cls, value=0):
+        if isinstance(value, str):
+            value = SpecSize(value).bytes
+        return int.__new__(cls, int(value))
+
+    def convert_to(self, unit="B"):
+        return float(self) / UNITS[unit or "B"]
+
+    def __add__(self, other):
+        return Size(int(self) + int(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Size(int(self) - int(other))
+
+    def __rsub__(self, other):
+        return Size(int(other) - int(self))
+
+    def __mul__(self, other):
+        return Size(int(self) * other)
+
+    __rmul__ = __mul__
+
+    def __mod__(self, other):
+        return Size(int(self) % int(other))
+
+    def __floordiv__(self, other):
+        if isinstance(other, Size):
+            return int(self) // int(other)
+        return Size(int(self) // other)
+
+    def __truediv__(self, other):
+        if isinstance(other, Size):
+            return int(self) / int(other)
+        return Size(int(self) // other)
+
+    __div__ = __truediv__
+
+    def __str__(self):
+        for unit in ("TiB", "GiB", "MiB", "KiB"):
+            if abs(self) >= UNITS[unit]:
+                return "%.2f %s" % (self.convert_to(unit), unit)
+        return "%d B" % int(self)
+
+    __repr__ = __str__
+
+
+class CallbackList(object):
+    def __init__(self):
+        self._funcs = list()
+
+    def add(self, func):
+        self._funcs.append(func)
+
+    def remove(self, func):
+        self._funcs.remove(func)
+
+    def __call__(self, *args, **kwargs):
+        for func in self._funcs:
+            func(*args, **kwargs)
+
+
+class Callbacks(object):
+    def __init__(self):
+        for signal in ('action_added', 'action_removed', 'action_executed', 'device_added', 'device_removed'):
+            setattr(self, signal, CallbackList())
+
+
+callbacks = Callbacks()
+
+
+class Flags(object):
+    debug = False
+
+
+flags = Flags()
+
+
+#
+# formats
+#
+class DeviceFormat(object):
+    def __init__(self, fmt_type=None, **kwargs):
+        self.type = fmt_type
+        self.name = FORMAT_NAMES.get(fmt_type, fmt_type)
+        self.exists = kwargs.get('exists', False)
+        self.uuid = kwargs.get('uuid')
+        self.label = kwargs.get('label')
+        self.mountpoint = kwargs.get('mountpoint')
+        self.create_options = kwargs.get('create_options')
+        self.device = kwargs.get('device')
+        self.label_type = kwargs.get('label_type')
+        self.packages = FORMAT_PACKAGES.get(fmt_type, list())
+        self.mountable = fmt_type in FILESYSTEMS
+        self.supported = True
+        self.formattable = True
+        self.resizable = False
+        self.hidden = False
+        self.status = False
+        self.free = Size(kwargs.get('free', 0))
+        # LUKS
+        self.map_name = kwargs.get('name')
+        self.passphrase = kwargs.get('passphrase')
+        self._key_file = kwargs.get('key_file')
+        self.cipher = kwargs.get('cipher')
+        self.key_size = kwargs.get('key_size')
+        self.luks_version = kwargs.get('luks_version')
+        self.pbkdf_args = kwargs.get('pbkdf_args')
+
+    @property
+    def key_file(self):
+        return self._key_file
+
+    @property
+    def has_key(self):
+        return bool(self.passphrase or self._key_file)
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        pass
+
+
+def get_format(fmt_type, **kwargs):
+    return DeviceFormat(fmt_type, **kwargs)
+
+
+#
+# devices
+#
+_device_ids = itertools.count()
+
+
+class StorageDevice(object):
+    _type = None
+    _packages = list()
+    _is_disk = False
+    _dev_dir = "/dev"
+
+    def __init__(self, name, parents=None, size=None, fmt=None, exists=False, uuid=None, sysfs_path=None):
+        self.id = next(_device_ids)
+        self._name = name
+        self.parents = list(parents or list())
+        self.children = list()
+        for parent in self.parents:
+            parent.children.append(self)
+
+        self._size = Size(size or 0)
+        self._format = None
+        self.format = fmt
+        self.original_format = self._format
+        self.exists = exists
+        self.uuid = uuid
+        self.sysfs_path = sysfs_path or ""
+        self.device_links = list()
+        self.protected = False
+        self.format_immutable = False
+        self.complete = True
+        self.status = False
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.name)
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+
+    @property
+    def path(self):
+        return "%s/%s" % (self._dev_dir, self.name)
+
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def format(self):
+        return self._format
+
+    @format.setter
+    def format(self, fmt):
+        self._format = fmt if fmt is not None else get_format(None)
+
+    @property
+    def raw_device(self):
+        return self
+
+    @property
+    def encrypted(self):
+        return any(isinstance(d, LUKSDevice) for d in self.ancestors)
+
+    @property
+    def is_disk(self):
+        return self._is_disk
+
+    @property
+    def isleaf(self):
+        return not self.children
+
+    @property
+    def ancestors(self):
+        ancestors = set([self])
+        for parent in [d for d in self.parents if d not in ancestors]:
+            ancestors.update(set(parent.ancestors))
+        return list(ancestors)
+
+    @property
+    def disks(self):
+        disks = list()
+        for parent in self.parents:
+            disks.extend(d for d in parent.disks if d not in disks)
+
+        if self.is_disk:
+            disks.append(self)
+
+        return disks
+
+    @property
+    def fstab_spec(self):
+        if self.format.uuid:
+            return "UUID=%s" % self.format.uuid
+        return self.path
+
+    @property
+    def resizable(self):
+        return False
+
+    @property
+    def min_size(self):
+        return self.size
+
+    @property
+    def max_size(self):
+        return self.size
+
+    def depends_on(self, dep):
+        return dep in self.parents or any(parent.depends_on(dep) for parent in self.parents)
+
+
+class DiskDevice(StorageDevice):
+    _type = "disk"
+    _is_disk = True
+
+    @property
+    def partitioned(self):
+        return self.format.type == "disklabel"
+
+    @property
+    def partitionable(self):
+        return True
+
+
+class PartitionDevice(StorageDevice):
+    _type = "partition"
+    _packages = ["parted"]
+
+    def __init__(self, name, grow=False, **kwargs):
+        super(PartitionDevice, self).__init__(name, **kwargs)
+        self.req_base_size = self._size
+        self.req_grow = grow
+
+    @property
+    def disk(self):
+        return self.parents[0] if self.parents else None
+
+
+class LVMVolumeGroupDevice(StorageDevice):
+    _type = "lvmvg"
+    _packages = ["lvm2"]
+
+    def __init__(self, name, parents=None, **kwargs):
+        super(LVMVolumeGroupDevice, self).__init__(name, parents=parents, **kwargs)
+        self.pe_size = Size(PE_SIZE)
+        self.thinpools = list()
+
+    @property
+    def pvs(self):
+        return self.parents
+
+    @property
+    def lvs(self):
+        return self.children
+
+    @property
+    def size(self):
+        return Size(sum(self.align(pv.size) for pv in self.pvs))
+
+    @property
+    def free_space(self):
+        return self.size - sum(lv.size for lv in self.lvs)
+
+    def align(self, size, roundup=False):
+        remainder = int(size) % PE_SIZE
+        if remainder and roundup:
+            return Size(int(size) - remainder + PE_SIZE)
+        return Size(int(size) - remainder)
+
+
+class LVMLogicalVolumeDevice(StorageDevice):
+    _type = "lvmlv"
+    _packages = ["lvm2"]
+    _dev_dir = "/dev/mapper"
+    is_thin_pool = False
+    is_snapshot_lv = False
+
+    @property
+    def vg(self):
+        return self.parents[0]
+
+    @property
+    def lvname(self):
+        return self.name[len(self.vg.name) + 1:]
+
+
+class LUKSDevice(StorageDevice):
+    _type = "luks/dm-crypt"
+    _packages = ["cryptsetup"]
+    _dev_dir = "/dev/mapper"
+
+    @property
+    def raw_device(self):
+        return self.parents[0]
+
+
+class MDRaidArrayDevice(StorageDevice):
+    _type = "mdarray"
+    _packages = ["mdadm"]
+    _dev_dir = "/dev/md"
+
+    def __init__(self, name, level=None, member_devices=None, total_devices=None, chunk_size=None,
+                 metadata_version=None, **kwargs):
+        super(MDRaidArrayDevice, self).__init__(name, **kwargs)
+        self.level = level
+        self.member_devices = member_devices
+        self.chunk_size = chunk_size
+        self.metadata_version = metadata_version
+        self.create_bitmap = True
+
+    @property
+    def members(self):
+        return self.parents
+
+
+#
+# actions
+#
+class DeviceAction(object):
+    type = None
+    obj = None
+    _ids = itertools.count()
+
+    def __init__(self, device):
+        self.id = next(self._ids)
+        self.device = device
+        self.format = device.format
+
+    @property
+    def type_desc_str(self):
+        return "%s %s" % (self.type, self.obj)
+
+    @property
+    def is_create(self):
+        return self.type == "create"
+
+    @property
+    def is_destroy(self):
+        return self.type == "destroy"
+
+    @property
+    def is_resize(self):
+        return self.type == "resize"
+
+    @property
+    def is_grow(self):
+        return False
+
+    @property
+    def is_format(self):
+        return self.obj == "format"
+
+    @property
+    def is_device(self):
+        return self.obj == "device"
+
+    def apply(self):
+        pass
+
+    def cancel(self):
+        pass
+
+    def execute(self, callbacks=None):  # pylint: disable=redefined-outer-name
+        pass
+
+
+class ActionCreateDevice(DeviceAction):
+    type = "create"
+    obj = "device"
+
+
+class ActionDestroyDevice(DeviceAction):
+    type = "destroy"
+    obj = "device"
+
+
+class ActionCreateFormat(DeviceAction):
+    type = "create"
+    obj = "format"
+
+    def __init__(self, device, fmt=None):
+        super(ActionCreateFormat, self).__init__(device)
+        self.orig_format = device.format
+        self.format = fmt if fmt is not None else device.format
+
+    def apply(self):
+        self.device.format = self.format
+
+    def cancel(self):
+        self.device.format = self.orig_format
+
+
+class ActionDestroyFormat(DeviceAction):
+    type = "destroy"
+    obj = "format"
+
+    def __init__(self, device, optional=False):
+        super(ActionDestroyFormat, self).__init__(device)
+        self.optional = optional
+
+    def apply(self):
+        self.device.format = None
+
+    def cancel(self):
+        self.device.format = self.format
+
+
+class ActionList(object):
+    def __init__(self, addfunc=None, removefunc=None):
+        self._add_func = addfunc
+        self._remove_func = removefunc
+        self._actions = list()
+
+    def __iter__(self):
+        return iter(self._actions)
+
+    def __len__(self):
+        return len(self._actions)
+
+    def add(self, action):
+        if self._add_func is not None:
+            self._add_func(action)
+
+        action.apply()
+        self._actions.append(action)
+        callbacks.action_added(action=action)
+
+    def remove(self, action):
+        if self._remove_func is not None:
+            self._remove_func(action)
+
+        action.cancel()
+        self._actions.remove(action)
+        callbacks.action_removed(action=action)
+
+    def find(self, device=None, action_type=None, object_type=None):
+        return [a for a in self._actions
+                if (device is None or a.device == device) and
+                (action_type is None or a.type == action_type) and
+                (object_type is None or a.obj == object_type)]
+
+
+class DeviceTree(object):
+    def __init__(self):
+        self._devices = list()
+        self.actions = ActionList(addfunc=self._register_action, removefunc=self._cancel_action)
+
+    @property
+    def devices(self):
+        return self._devices[:]
+
+    @property
+    def leaves(self):
+        return [d for d in self._devices if d.isleaf]
+
+    def _register_action(self, action):
+        if action.is_create and action.is_device:
+            self._add_device(action.device)
+        elif action.is_destroy and action.is_device:
+            self._remove_device(action.device)
+
+    def _cancel_action(self, action):
+        if action.is_create and action.is_device:
+            self._remove_device(action.device)
+        elif action.is_destroy and action.is_device:
+            self._add_device(action.device)
+
+    def _add_device(self, device):
+        if device.uuid and device.uuid in [d.uuid for d in self._devices]:
+            raise ValueError("duplicate UUID '%s'" % device.uuid)
+
+        for parent in device.parents:
+            if parent not in self._devices:
+                raise ValueError("parent device not in tree")
+            if device not in parent.children:
+                parent.children.append(device)
+
+        self._devices.append(device)
+        callbacks.device_added(device=device)
+
+    def _remove_device(self, device):
+        if device not in self._devices:
+            raise ValueError("device '%s' not in tree" % device.name)
+        if not device.isleaf:
+            raise ValueError("cannot remove non-leaf device '%s'" % device.name)
+
+        for parent in device.parents:
+            parent.children.remove(device)
+
+        self._devices.remove(device)
+        callbacks.device_removed(device=device)
+
+    def add_existing(self, device):
+        """ Add a device found on the (simulated) system. """
+        self._add_device(device)
+
+    def get_dependent_devices(self, dep):
+        if dep.isleaf:
+            return list()
+
+        return [d for d in self._devices if d.depends_on(dep)]
+
+    def recursive_remove(self, device, remove_device=True, **kwargs):  # pylint: disable=unused-argument
+        dependents = self.get_dependent_devices(device)
+        dependents.reverse()
+        while dependents:
+            leaves = [d for d in dependents if d.isleaf]
+            for leaf in leaves:
+                if leaf.format.exists and not leaf.protected and not leaf.format_immutable and leaf.format.type:
+                    self.actions.add(ActionDestroyFormat(leaf, optional=True))
+
+                self.actions.add(ActionDestroyDevice(leaf))
+                dependents.remove(leaf)
+
+        if not device.format_immutable:
+            self.actions.add(ActionDestroyFormat(device, optional=True))
+
+        if remove_device and not device.is_disk:
+            self.actions.add(ActionDestroyDevice(device))
+
+    def resolve_device(self, spec):
+        """ Look the device up by name, path or UUID, scanning the whole tree like blivet does. """
+        if spec.startswith("UUID="):
+            uuid = spec[len("UUID="):].strip('"\'')
+            return next((d for d in self._devices if d.format.uuid == uuid or d.uuid == uuid), None)
+
+        return next((d for d in self._devices if spec in (d.name, d.path)), None)
+
+
+class Blivet(object):
+    def __init__(self):
+        self.devicetree = DeviceTree()
+        self.exclusive_disks = list()
+
+    def reset(self):
+        self.devicetree = DeviceTree()
+
+    @property
+    def devices(self):
+        return self.devicetree.devices
+
+    @property
+    def packages(self):
+        packages = list()
+        for action in self.devicetree.actions:
+            packages.extend(p for p in action.device._packages + action.format.packages if p not in packages)
+        return packages
+
+    def create_device(self, device):
+        self.devicetree.actions.add(ActionCreateDevice(device))
+        if device.format.type:
+            self.devicetree.actions.add(ActionCreateFormat(device))
+
+    def destroy_device(self, device):
+        if device.format.exists and device.format.type:
+            self.devicetree.actions.add(ActionDestroyFormat(device, optional=True))
+
+        self.devicetree.actions.add(ActionDestroyDevice(device))
+
+    def format_device(self, device, fmt):
+        self.devicetree.actions.add(ActionDestroyFormat(device))
+        self.devicetree.actions.add(ActionCreateFormat(device, fmt))
+
+    def resize_device(self, device, new_size):
+        raise ValueError("resizing is not simulated")
+
+    def new_partition(self, *args, **kwargs):
+        return PartitionDevice("req%d" % next(_device_ids), *args, **kwargs)
+
+    def new_vg(self, *args, **kwargs):
+        for pv in kwargs.get('parents', list()):
+            if pv not in self.devicetree.devices:
+                raise ValueError("pv is not in the device tree")
+
+        return LVMVolumeGroupDevice(*args, **kwargs)
+
+    def new_lv(self, *args, **kwargs):
+        vg = kwargs['parents'][0]
+        size = Size(kwargs.get('size') or 0)
+        if size > vg.free_space:
+            raise ValueError("not enough free space in volume group")
+
+        kwargs.pop('pvs', None)
+        kwargs['name'] = "%s-%s" % (vg.name, kwargs['name'])
+        return LVMLogicalVolumeDevice(*args, **kwargs)
+
+    def new_mdarray(self, *args, **kwargs):
+        return MDRaidArrayDevice(*args, **kwargs)
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def do_partitioning(blivet_obj):
+    """ Place every new partition on its disk, like blivet does on each call.
+
+        The requests are named after their disks in the order they were made, and
+        the ones that may grow share the space the others leave free.
+    """
+    requests = dict()
+    for partition in blivet_obj.devicetree.devices:
+        if partition.type == "partition" and not partition.exists:
+            requests.setdefault(partition.disk, list()).append(partition)
+
+    for (disk, partitions) in requests.items():
+        existing = [p for p in disk.children if p.type == "partition" and p.exists]
+        free = disk.size - sum(p.size for p in existing) - sum(p.req_base_size for p in partitions)
+        if free < 0:
+            raise PartitioningError("not enough free space on disk %s" % disk.name)
+
+        growing = [p for p in partitions if p.req_grow]
+        for (i, partition) in enumerate(partitions):
+            partition.name = "%sp%d" % (disk.name, len(existing) + i + 1)
+            partition._size = partition.req_base_size
+            if partition in growing:
+                partition._size += free // len(growing)
+
+
+def run_program(argv, **kwargs):  # pylint: disable=unused-argument
+    return 1
+
+
+def run_program_and_capture_output(argv, **kwargs):  # pylint: disable=unused-argument
+    return (1, "")
+
+
+def _noop(*args, **kwargs):  # pylint: disable=unused-argument
+    pass
+
+
+def _new_module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """ Register the fake blivet (and gi) modules so that the blivet module imports them. """
+    sys.modules["blivet3"] = None
+    devices = _new_module("blivet.devices", StorageDevice=StorageDevice, DiskDevice=DiskDevice,
+                          PartitionDevice=PartitionDevice, LVMVolumeGroupDevice=LVMVolumeGroupDevice,
+                          LVMLogicalVolumeDevice=LVMLogicalVolumeDevice, LUKSDevice=LUKSDevice,
+                          MDRaidArrayDevice=MDRaidArrayDevice)
+    luks = _new_module("blivet.formats.luks")
+    formats = _new_module("blivet.formats", get_format=get_format, DeviceFormat=DeviceFormat, luks=luks)
+    blivet = _new_module("blivet", Blivet=Blivet, devices=devices, formats=formats)
+    _new_module("blivet.callbacks", callbacks=callbacks)
+    _new_module("blivet.flags", flags=flags)
+    _new_module("blivet.partitioning", do_partitioning=do_partitioning)
+    _new_module("blivet.size", Size=Size)
+    _new_module("blivet.udev", settle=_noop)
+    _new_module("blivet.util", run_program=run_program, run_program_and_capture_output=run_program_and_capture_output,
+                set_up_logging=_noop)
+    blockdev = _new_module("gi.repository.BlockDev")
+    _new_module("gi.repository", BlockDev=blockdev)
+    _new_module("gi")
+    return blivet
+
+
+def load_module(name="blivet_module"):
+    """ Import library/blivet.py on top of the fake blivet. """
+    install()
+    return load_library_module("blivet", module_name=name)
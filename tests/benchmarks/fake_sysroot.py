@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+""" Generate a synthetic /sys and /dev tree for running the probe modules against.
+
+    The tree holds disks, partitions, LVM and multipath dm devices and MD arrays, with
+    the sysfs holders links and the /dev/mapper, /dev/md and /dev/disk/by-* symlinks
+    udev would create. Device nodes are empty files. The devices are also listed in a
+    table at the top of the tree, which the stub lsblk and blkid in stubs/ report from.
+
+    Point the modules at the tree with the sysroot parameter or the STORAGE_LSR_SYSROOT
+    environment variable, and put stubs/ first in PATH.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import argparse
+import json
+import os
+import shlex
+import sys
+
+TABLE = "fake-sysroot.json"
+STUBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+SYSROOT_ENV_VAR = "STORAGE_LSR_SYSROOT"
+SECTOR_SIZE = 512
+DISK_SIZE = 100 * 1024 ** 3
+SAS_HOST = "/sys/devices/pci0000:00/0000:00:03.0/host0"
+VIRTUAL_BLOCK = "/sys/devices/virtual/block"
+# units of disks the generator cycles through; the last UNUSED_SHARE of the disks are left blank
+LAYOUTS = ("partitioned", "lvm", "multipath", "md")
+UNUSED_SHARE = 0.2
+LSBLK_COLUMNS = ("NAME", "KNAME", "TYPE", "SIZE", "FSTYPE", "LABEL", "UUID")
+
+
+def disk_name(index):
+    """ Return the kernel name of the index'th SCSI disk: sda, ..., sdz, sdaa, ... """
+    letters = ""
+    index += 1
+    while index:
+        (index, remainder) = divmod(index - 1, 26)
+        letters = chr(ord("a") + remainder) + letters
+
+    return "sd" + letters
+
+
+class Fixture(object):
+    """ A synthetic device tree under root. """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.devices = list()
+        self._sys_paths = dict()
+        self._dm = 0
+        self._md = 0
+
+    def _path(self, path):
+        return self.root + path
+
+    def _write(self, path, content=""):
+        path = self._path(path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def _link(self, target, path):
+        """ Create a symlink at path to target, relative like the ones udev and sysfs create. """
+        path = self._path(path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        os.symlink(os.path.relpath(self._path(target), os.path.dirname(path)), path)
+
+    def _block(self, kname, sys_dir, dev_type, size, name=None, fstype="", label="", uuid="", parents=()):
+        """ Add a block device with its sysfs directory, device node and by-uuid/by-label links. """
+        sys_path = "%s/%s" % (sys_dir, kname)
+        self._sys_paths[kname] = sys_path
+        self._write(sys_path + "/size", "%d\n" % (size // SECTOR_SIZE))
+        os.makedirs(self._path(sys_path + "/holders"))
+        os.makedirs(self._path(sys_path + "/slaves"))
+        self._link(sys_path, "/sys/class/block/%s" % kname)
+        self._write("/dev/%s" % kname)
+
+        for parent in parents:
+            self._link(sys_path, "%s/holders/%s" % (self._sys_paths[parent], kname))
+            self._link(self._sys_paths[parent], "%s/slaves/%s" % (sys_path, parent))
+
+        if uuid:
+            self._link("/dev/%s" % kname, "/dev/disk/by-uuid/%s" % uuid)
+        if label:
+            self._link("/dev/%s" % kname, "/dev/disk/by-label/%s" % label)
+
+        device = dict(name=name or "/dev/%s" % kname, kname="/dev/%s" % kname, type=dev_type, size=size,
+                      fstype=fstype, label=label, uuid=uuid, parents=["/dev/%s" % p for p in parents])
+        self.devices.append(device)
+        return device
+
+    def disk(self, index, fstype="", uuid=""):
+        kname = disk_name(index)
+        device = self._block(kname, "%s/target0:0:%d/0:0:%d:0/block" % (SAS_HOST, index, index), "disk",
+                             DISK_SIZE, fstype=fstype, uuid=uuid)
+        device['wwn'] = "wwn-0x5000c500%08x" % index
+        self._link("/dev/%s" % kname, "/dev/disk/by-id/%s" % device['wwn'])
+        self._link("/dev/%s" % kname, "/dev/disk/by-path/pci-0000:00:03.0-scsi-0:0:%d:0" % index)
+        return device
+
+    def partition(self, disk, number, size, fstype, label, uuid):
+        kname = "%s%d" % (os.path.basename(disk['kname']), number)
+        return self._block(kname, self._sys_paths[os.path.basename(disk['kname'])], "part", size,
+                           fstype=fstype, label=label, uuid=uuid)
+
+    def dm(self, name, dev_type, parents, size, fstype="", label="", uuid=""):
+        kname = "dm-%d" % self._dm
+        self._dm += 1
+        device = self._block(kname, VIRTUAL_BLOCK, dev_type, size, name="/dev/mapper/%s" % name,
+                             fstype=fstype, label=label, uuid=uuid,
+                             parents=[os.path.basename(p['kname']) for p in parents])
+        self._write("%s/dm/name" % self._sys_paths[kname], name + "\n")
+        self._link("/dev/%s" % kname, "/dev/mapper/%s" % name)
+        return device
+
+    def md(self, name, parents, size, fstype="", label="", uuid=""):
+        kname = "md%d" % self._md
+        self._md += 1
+        device = self._block(kname, VIRTUAL_BLOCK, "raid1", size, fstype=fstype, label=label, uuid=uuid,
+                             parents=[os.path.basename(p['kname']) for p in parents])
+        self._write("%s/md/level" % self._sys_paths[kname], "raid1\n")
+        self._link("/dev/%s" % kname, "/dev/md/%s" % name)
+        return device
+
+    def generate(self, disks):
+        """ Lay out the given number of disks, cycling through LAYOUTS. """
+        for directory in ("/sys/class/block", "/dev/mapper", "/dev/md", "/dev/disk/by-id", "/dev/disk/by-path",
+                          "/dev/disk/by-uuid", "/dev/disk/by-label"):
+            os.makedirs(self._path(directory))
+
+        used = disks - int(disks * UNUSED_SHARE)
+        index = 0
+        unit = 0
+        while index < used:
+            layout = LAYOUTS[unit % len(LAYOUTS)]
+            if layout in ("multipath", "md") and used - index < 2:
+                layout = "lvm"
+
+            if layout == "partitioned":
+                disk = self.disk(index)
+                self.partition(disk, 1, 1024 ** 3, "xfs", "boot%d" % unit, "boot-%08d" % unit)
+                self.partition(disk, 2, DISK_SIZE - 1024 ** 3, "LVM2_member", "", "pv-%08d" % unit)
+                index += 1
+            elif layout == "lvm":
+                disk = self.disk(index, fstype="LVM2_member", uuid="pv-%08d" % unit)
+                self.dm("vg%d-lv0" % unit, "lvm", [disk], DISK_SIZE // 2, fstype="xfs",
+                        label="data%d" % unit, uuid="lv-%08d" % unit)
+                index += 1
+            elif layout == "multipath":
+                paths = [self.disk(index, fstype="mpath_member"), self.disk(index + 1, fstype="mpath_member")]
+                self.dm("mpath%d" % unit, "mpath", paths, DISK_SIZE, fstype="xfs",
+                        label="san%d" % unit, uuid="mpath-%08d" % unit)
+                index += 2
+            else:
+                members = [self.disk(index + i, fstype="linux_raid_member", uuid="member-%08d-%d" % (unit, i))
+                           for i in range(2)]
+                self.md("data%d" % unit, members, DISK_SIZE, fstype="ext4", label="md%d" % unit,
+                        uuid="md-%08d" % unit)
+                index += 2
+
+            unit += 1
+
+        while index < disks:
+            self.disk(index)
+            index += 1
+
+        with open(self._path("/" + TABLE), "w") as f:
+            json.dump(self.lsblk_order(), f)
+
+    def lsblk_order(self):
+        """ Return the devices in the order lsblk lists them: each disk followed by its descendants. """
+        children = dict()
+        for device in self.devices:
+            for parent in device['parents']:
+                children.setdefault(parent, list()).append(device)
+        for device in self.devices:
+            if device['type'] == "part":
+                children.setdefault(device['kname'].rstrip("0123456789"), list()).append(device)
+
+        ordered = list()
+
+        def add(device):
+            ordered.append(device)
+            for child in children.get(device['kname'], list()):
+                add(child)
+
+        for device in self.devices:
+            if device['type'] == "disk":
+                add(device)
+
+        return ordered
+
+
+#
+# stub tools
+#
+def load_table():
+    root = os.environ.get(SYSROOT_ENV_VAR)
+    if not root:
+        sys.stderr.write("%s is not set\n" % SYSROOT_ENV_VAR)
+        sys.exit(1)
+
+    with open(os.path.join(root, TABLE)) as f:
+        return json.load(f)
+
+
+def _human_size(size):
+    for (suffix, factor) in (("T", 1024 ** 4), ("G", 1024 ** 3), ("M", 1024 ** 2), ("K", 1024)):
+        if size >= factor:
+            return ("%.1f" % (size / factor)).rstrip("0").rstrip(".") + suffix
+    return "%dB" % size
+
+
+def lsblk(argv):
+    """ lsblk -o COLUMNS [-p] [-P|--pairs] [-b|--bytes] [-a] [-n] [DEVICE...] """
+    parser = argparse.ArgumentParser(prog="lsblk")
+    parser.add_argument("-o", "--output", default="NAME,TYPE,SIZE")
+    parser.add_argument("-p", "--paths", action="store_true")
+    parser.add_argument("-P", "--pairs", action="store_true")
+    parser.add_argument("-b", "--bytes", action="store_true")
+    parser.add_argument("-a", "--all", action="store_true")
+    parser.add_argument("-n", "--noheadings", action="store_true")
+    parser.add_argument("devices", nargs="*")
+    args = parser.parse_args(argv)
+
+    columns = args.output.split(",")
+    for column in columns:
+        if column not in LSBLK_COLUMNS:
+            sys.stderr.write("lsblk: unknown column: %s\n" % column)
+            return 1
+
+    devices = load_table()
+    if args.devices:
+        devices = [d for d in devices if d['name'] in args.devices or d['kname'] in args.devices]
+
+    lines = list()
+    for device in devices:
+        values = dict((key.upper(), value if value is not None else "") for (key, value) in device.items()
+                      if key.upper() in LSBLK_COLUMNS)
+        values['SIZE'] = str(device['size']) if args.bytes else _human_size(device['size'])
+        if not args.paths:
+            values['NAME'] = os.path.basename(values['NAME'])
+            values['KNAME'] = os.path.basename(values['KNAME'])
+
+        if args.pairs:
+            lines.append(" ".join('%s="%s"' % (column, values[column]) for column in columns))
+        else:
+            lines.append(" ".join(values[column] for column in columns))
+
+    if lines and not args.pairs and not args.noheadings:
+        lines.insert(0, " ".join(columns))
+
+    sys.stdout.write("".join(line + "\n" for line in lines))
+    return 0
+
+
+def blkid(argv):
+    """ blkid -p DEVICE | blkid -t NAME=value -o device """
+    parser = argparse.ArgumentParser(prog="blkid")
+    parser.add_argument("-p", "--probe", action="store_true")
+    parser.add_argument("-t", "--match-token")
+    parser.add_argument("-o", "--output", default="full")
+    parser.add_argument("devices", nargs="*")
+    args = parser.parse_args(argv)
+
+    # the table lists a device with several parents once under each of them, blkid only once
+    seen = set()
+    devices = [d for d in load_table() if d['kname'] not in seen and not seen.add(d['kname'])]
+    if args.match_token:
+        (key, _eq, value) = args.match_token.partition("=")
+        value = shlex.split(value)[0] if value else value
+        devices = [d for d in devices if d.get(key.lower()) == value and d['fstype']]
+    elif args.devices:
+        devices = [d for d in devices if d['fstype'] and (d['name'] in args.devices or d['kname'] in args.devices)]
+
+    if not devices:
+        return 2
+
+    for device in devices:
+        if args.output == "device":
+            sys.stdout.write("%s\n" % device['name'])
+            continue
+
+        tags = [("LABEL", device['label']), ("UUID", device['uuid']), ("TYPE", device['fstype'])]
+        sys.stdout.write("%s: %s\n" % (device['name'], " ".join('%s="%s"' % (k, v) for (k, v) in tags if v)))
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--disks", type=int, default=1000, help="number of disks")
+    parser.add_argument("root", help="directory to create the tree in")
+    args = parser.parse_args()
+
+    Fixture(args.root).generate(args.disks)
+    print("export %s=%s PATH=%s:$PATH" % (SYSROOT_ENV_VAR, os.path.abspath(args.root), STUBS_DIR))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
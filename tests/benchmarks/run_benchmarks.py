@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+""" Benchmark the blivet module's action scheduling against synthetic device trees.
+
+    Every scenario generates a specification with n pools or volumes, builds a device
+    tree that holds the devices it needs next to unrelated background devices, and then
+    runs the module's scheduling, fstab and mount code on the fake blivet backend. The
+    wall time of each phase (normalized by a calibration loop, so that results from
+    different machines compare) and the peak memory are checked against the baselines.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+
+import fake_blivet
+from common import BASELINES_DIR, TOP_DIR, calibrate, load_baselines, save_baselines
+from fake_blivet import DiskDevice, LVMLogicalVolumeDevice, LVMVolumeGroupDevice, Size, get_format
+
+BASELINES = os.path.join(BASELINES_DIR, "scheduling.json")
+DEFAULTS = os.path.join(TOP_DIR, "defaults", "main.yml")
+SIZES = (1, 10, 100, 1000)
+BACKGROUND_DISKS = 50  # disks with a VG of their own that no spec refers to
+BACKGROUND_LVS = 4
+DISK_SIZE = Size("2 TiB")
+LV_SIZE = Size("1 GiB")
+# times and memory below these are noise, whatever the baseline says
+MIN_TIME = 0.02
+MIN_MEMORY = 1024 ** 2
+
+
+class Tree(object):
+    """ A device tree under construction, along with the fstab entries for its file systems. """
+    def __init__(self, blivet_obj):
+        self._blivet = blivet_obj
+        self._disks = 0
+        self.fstab = list()
+
+    def disk(self):
+        self._disks += 1
+        disk = DiskDevice("nvme%dn1" % self._disks, size=DISK_SIZE, exists=True,
+                          sysfs_path="/devices/virtual/block/nvme%dn1" % self._disks)
+        self._blivet.devicetree.add_existing(disk)
+        return disk
+
+    def vg(self, name, lvs, mount_prefix):
+        pv = self.disk()
+        pv.format = get_format("lvmpv", exists=True, uuid="pv-%s" % name)
+        vg = LVMVolumeGroupDevice(name, parents=[pv], exists=True, uuid="vg-%s" % name)
+        self._blivet.devicetree.add_existing(vg)
+        for i in range(lvs):
+            uuid = "fs-%s-%d" % (name, i)
+            lv = LVMLogicalVolumeDevice("%s-lv%d" % (name, i), parents=[vg], size=LV_SIZE, exists=True,
+                                        uuid="lv-%s-%d" % (name, i),
+                                        fmt=get_format("xfs", exists=True, uuid=uuid))
+            lv.original_format = lv.format
+            self._blivet.devicetree.add_existing(lv)
+            self.fstab.append("UUID=%s %s/%s/lv%d xfs defaults 0 0" % (uuid, mount_prefix, name, i))
+
+        return vg
+
+    def background(self):
+        for i in range(BACKGROUND_DISKS):
+            self.vg("system%d" % i, BACKGROUND_LVS, "/srv")
+
+        self.fstab.extend(["proc /proc proc defaults 0 0", "tmpfs /tmp tmpfs defaults 0 0"])
+
+
+def lvm_volume(name, state="present"):
+    return dict(name=name, size=str(LV_SIZE), mount_point="/mnt/%s" % name, state=state)
+
+
+def create_disk_volumes(tree, n):
+    volumes = [dict(name="data%d" % i, type="disk", disks=[tree.disk().name], mount_point="/mnt/data%d" % i)
+               for i in range(n)]
+    return (list(), volumes)
+
+
+def create_lvm_volumes(tree, n):
+    pool = dict(name="data", disks=[tree.disk().name], volumes=[lvm_volume("lv%d" % i) for i in range(n)])
+    return ([pool], list())
+
+
+def create_lvm_pools(tree, n):
+    pools = [dict(name="data%d" % i, disks=[tree.disk().name], volumes=[lvm_volume("lv0")]) for i in range(n)]
+    return (pools, list())
+
+
+def create_partitioned_lvm_pools(tree, n):
+    pools = [dict(name="data%d" % i, disks=[tree.disk().name], volumes=[lvm_volume("lv0")]) for i in range(n)]
+    return (pools, list())
+
+
+def unchanged_lvm_pools(tree, n):
+    pools = [dict(name="data%d" % i, disks=[tree.vg("data%d" % i, 1, "/mnt").pvs[0].name],
+                  volumes=[lvm_volume("lv0")]) for i in range(n)]
+    return (pools, list())
+
+
+def remove_lvm_pools(tree, n):
+    pools = [dict(name="data%d" % i, disks=[tree.vg("data%d" % i, 1, "/mnt").pvs[0].name], state="absent",
+                  volumes=[lvm_volume("lv0", state="absent")]) for i in range(n)]
+    return (pools, list())
+
+
+SCENARIOS = {"create_disk_volumes": create_disk_volumes,
+             "create_lvm_volumes": create_lvm_volumes,
+             "create_lvm_pools": create_lvm_pools,
+             "create_partitioned_lvm_pools": create_partitioned_lvm_pools,
+             "unchanged_lvm_pools": unchanged_lvm_pools,
+             "remove_lvm_pools": remove_lvm_pools}
+# scenarios that put the pools' physical volumes on partitions
+PARTITIONED_SCENARIOS = ("create_partitioned_lvm_pools",)
+
+
+def set_up(module, tmpdir):
+    with open(DEFAULTS) as f:
+        defaults = yaml.safe_load(f)
+
+    module.safe_mode = False
+    module.use_partitions = False
+    module.disklabel_type = None
+    module.diskvolume_mkfs_option_map = dict()
+    module.pool_defaults = defaults['storage_pool_defaults']
+    module.volume_defaults = defaults['storage_volume_defaults']
+    module.ETC_FSTAB = os.path.join(tmpdir, "fstab")
+
+
+def run_scenario(module, scenario, n, trace_memory=False):
+    """ Schedule the scenario's specification and return the phase timings and counts. """
+    if module.device_resolver is not None:
+        module.device_resolver.close()
+    module.device_resolver = None
+    module.pending_partitions = list()
+    module.use_partitions = scenario in PARTITIONED_SCENARIOS
+
+    b = fake_blivet.Blivet()
+    tree = Tree(b)
+    tree.background()
+    (pools, volumes) = SCENARIOS[scenario](tree, n)
+    pools = copy.deepcopy(pools)
+    volumes = copy.deepcopy(volumes)
+    with open(module.ETC_FSTAB, "w") as f:
+        f.write("\n".join(tree.fstab) + "\n")
+
+    if trace_memory:
+        tracemalloc.start()
+
+    timings = module.Timings(clock=time.perf_counter)
+    with timings.phase("fstab"):
+        fstab = module.FSTab(b)
+        fstab.resolve()
+
+    with timings.phase("schedule"):
+        module.schedule_actions(b, pools, volumes, timings=timings)
+        module.get_online_grows(b)
+
+    actions = [a for a in b.devicetree.actions.find() if not (a.is_format and a.format.type is None)]
+    with timings.phase("fstab_identifiers"):
+        module.update_fstab_identifiers(b, pools, volumes)
+
+    with timings.phase("mounts"):
+        mounts = module.get_mount_info(pools, volumes, actions, fstab)
+
+    result = dict(devices=len(b.devicetree.devices), actions=len(b.devicetree.actions), mounts=len(mounts),
+                  phases=dict((p['name'], p['wall']) for p in timings.report['phases']))
+    if trace_memory:
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+def run(module, scenarios, sizes, repeat, calibration):
+    results = dict()
+    for scenario in scenarios:
+        for n in sizes:
+            runs = [run_scenario(module, scenario, n) for _i in range(repeat)]
+            result = run_scenario(module, scenario, n, trace_memory=True)
+            # the fastest run is the one least disturbed by the rest of the system
+            result['phases'] = dict((name, min(r['phases'][name] for r in runs)) for name in result['phases'])
+            result['time'] = round(sum(result['phases'].values()), 6)
+            result['normalized'] = round(result['time'] / calibration, 3)
+            results["%s/%d" % (scenario, n)] = result
+            print("%-36s %6d devices %6d actions %10.4fs %8.2fx %8.1f MiB"
+                  % ("%s/%d" % (scenario, n), result['devices'], result['actions'], result['time'],
+                     result['normalized'], result['peak_memory'] / 1024.0 ** 2))
+            sys.stdout.flush()
+
+    return results
+
+
+def compare(results, baselines, tolerance, calibration):
+    """ Return a list of the ways in which the results regress from the baselines. """
+    regressions = list()
+    for (key, result) in sorted(results.items()):
+        baseline = baselines.get(key)
+        if baseline is None:
+            continue
+
+        if result['actions'] != baseline['actions']:
+            regressions.append("%s: %d actions scheduled, baseline has %d"
+                               % (key, result['actions'], baseline['actions']))
+
+        limit = baseline['normalized'] * (1 + tolerance)
+        if result['normalized'] > limit and result['time'] > MIN_TIME:
+            regressions.append("%s: took %.4fs (%.2fx calibration), limit is %.4fs (%.2fx)"
+                               % (key, result['time'], result['normalized'], limit * calibration, limit))
+
+        limit = baseline['peak_memory'] * (1 + tolerance)
+        if result['peak_memory'] > limit and result['peak_memory'] > MIN_MEMORY:
+            regressions.append("%s: peak memory %d bytes, limit is %d bytes" % (key, result['peak_memory'], limit))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (default: all of them)")
+    parser.add_argument("--size", action="append", type=int,
+                        help="number of pools or volumes (default: %s)" % ", ".join(str(s) for s in SIZES))
+    parser.add_argument("--repeat", type=int, default=2, help="timed runs per scenario and size")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown and memory growth, as a fraction of the baseline")
+    parser.add_argument("--baselines", default=BASELINES, help="baseline file")
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--output", help="write the results to this file as JSON")
+    args = parser.parse_args()
+
+    module = fake_blivet.load_module()
+    tmpdir = tempfile.mkdtemp(prefix="storage-bench-")
+    try:
+        set_up(module, tmpdir)
+        calibration = calibrate()
+        print("calibration: %.4fs" % calibration)
+        results = run(module, args.scenario or sorted(SCENARIOS), args.size or SIZES, args.repeat, calibration)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(calibration=calibration, results=results), f, indent=2, sort_keys=True)
+
+    baselines = load_baselines(args.baselines)
+    if args.update_baselines:
+        baselines.update((key, dict(actions=r['actions'], normalized=r['normalized'], peak_memory=r['peak_memory']))
+                         for (key, r) in results.items())
+        save_baselines(args.baselines, baselines)
+        return 0
+
+    regressions = compare(results, baselines, args.tolerance, calibration)
+    for regression in regressions:
+        print("REGRESSION: %s" % regression)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
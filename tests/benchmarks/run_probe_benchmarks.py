@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+""" Benchmark the latency of the probe modules as the number of disks grows.
+
+    find_unused_disk, blockdev_info and resolve_blockdev run in-process against trees
+    fake_sysroot.py generates, with the stub lsblk and blkid. Each result is checked
+    for correctness, and its time (normalized by a calibration loop) and peak memory
+    are checked against the baselines, so that per-device costs that grow with the
+    number of devices show up before they hit hosts with thousands of SAN paths.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ansible.module_utils import basic
+
+import fake_sysroot
+from common import BASELINES_DIR, calibrate, load_baselines, load_library_module, save_baselines
+
+BASELINES = os.path.join(BASELINES_DIR, "probes.json")
+SIZES = (10, 100, 1000, 5000)
+# times and memory below these are noise, whatever the baseline says
+MIN_TIME = 0.02
+MIN_MEMORY = 1024 ** 2
+
+
+def get_cases(fixture):
+    """ Return (name, module, args, check) for each case; check tells whether the module's result is right. """
+    devices = fixture.devices
+    disks = [d for d in devices if d['type'] == "disk"]
+    partitioned = set(d['kname'].rstrip("0123456789") for d in devices if d['type'] == "part")
+    unused = set(os.path.basename(d['kname']) for d in disks if not d['fstype'] and d['kname'] not in partitioned)
+    last_fs = [d for d in devices if d['label']][-1]
+    last_dm = [d for d in devices if d['kname'].startswith("/dev/dm-")][-1]
+    last_md = [d for d in devices if d['type'] == "raid1"][-1]
+    md_name = [n for n in os.listdir(fixture.root + "/dev/md")
+               if os.path.realpath(fixture.root + "/dev/md/" + n) == fixture.root + last_md['kname']][0]
+
+    return [("find_unused_disk", "find_unused_disk", dict(),
+             lambda r: len(r['disks']) == min(len(unused), 10) and set(r['disks']) <= unused),
+            ("blockdev_info", "blockdev_info", dict(),
+             lambda r: len(r['info']) == len(set(d['name'] for d in devices))),
+            ("resolve_blockdev[name]", "resolve_blockdev", dict(spec=os.path.basename(disks[-1]['kname'])),
+             lambda r: r['device'] == disks[-1]['kname']),
+            ("resolve_blockdev[by-id]", "resolve_blockdev", dict(spec=disks[-1]['wwn']),
+             lambda r: r['device'] == disks[-1]['kname']),
+            ("resolve_blockdev[label]", "resolve_blockdev", dict(spec="LABEL=%s" % last_fs['label']),
+             lambda r: r['device'] == last_fs['name']),
+            ("resolve_blockdev[dm]", "resolve_blockdev", dict(spec=last_dm['kname']),
+             lambda r: r['device'] == last_dm['name']),
+            ("resolve_blockdev[md]", "resolve_blockdev", dict(spec=last_md['kname']),
+             lambda r: r['device'] == "/dev/md/%s" % md_name)]
+
+
+def run_module(name, args):
+    """ Run a module's main() in-process and return its result. """
+    module = load_library_module(name)
+    basic._ANSIBLE_ARGS = json.dumps(dict(ANSIBLE_MODULE_ARGS=args)).encode("utf-8")
+    # ansible-core >= 2.19 will not decode the arguments without a serialization profile
+    basic._ANSIBLE_PROFILE = "legacy"
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            module.main()
+        except SystemExit:
+            pass
+
+    return json.loads(output.getvalue())
+
+
+def run_case(name, args, trace_memory=False):
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    result = run_module(name, args)
+    elapsed = time.perf_counter() - start
+
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return (result, elapsed, peak_memory)
+
+
+def run(sizes, repeat, calibration, tmpdir):
+    results = dict()
+    for n in sizes:
+        fixture = fake_sysroot.Fixture(os.path.join(tmpdir, str(n)))
+        fixture.generate(n)
+        os.environ[fake_sysroot.SYSROOT_ENV_VAR] = fixture.root
+
+        for (case, name, args, check) in get_cases(fixture):
+            (result, _elapsed, peak_memory) = run_case(name, args, trace_memory=True)
+            elapsed = min(run_case(name, args)[1] for _i in range(repeat))
+            key = "%s/%d" % (case, n)
+            results[key] = dict(devices=len(fixture.devices), time=round(elapsed, 6),
+                                normalized=round(elapsed / calibration, 3), peak_memory=peak_memory,
+                                correct=not result.get('failed') and check(result))
+            print("%-32s %6d devices %10.4fs %8.2fx %8.1f MiB%s"
+                  % (key, len(fixture.devices), elapsed, elapsed / calibration, peak_memory / 1024.0 ** 2,
+                     "" if results[key]['correct'] else "  WRONG RESULT: %s" % result))
+            sys.stdout.flush()
+
+        shutil.rmtree(fixture.root)
+
+    return results
+
+
+def compare(results, baselines, tolerance, calibration):
+    """ Return a list of the ways in which the results regress from the baselines. """
+    regressions = ["%s: wrong result" % key for (key, result) in sorted(results.items()) if not result['correct']]
+    for (key, result) in sorted(results.items()):
+        baseline = baselines.get(key)
+        if baseline is None:
+            continue
+
+        limit = baseline['normalized'] * (1 + tolerance)
+        if result['normalized'] > limit and result['time'] > MIN_TIME:
+            regressions.append("%s: took %.4fs (%.2fx calibration), limit is %.4fs (%.2fx)"
+                               % (key, result['time'], result['normalized'], limit * calibration, limit))
+
+        limit = baseline['peak_memory'] * (1 + tolerance)
+        if result['peak_memory'] > limit and result['peak_memory'] > MIN_MEMORY:
+            regressions.append("%s: peak memory %d bytes, limit is %d bytes" % (key, result['peak_memory'], limit))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", action="append", type=int,
+                        help="number of disks (default: %s)" % ", ".join(str(s) for s in SIZES))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per module and size")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown and memory growth, as a fraction of the baseline")
+    parser.add_argument("--baselines", default=BASELINES, help="baseline file")
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--output", help="write the results to this file as JSON")
+    args = parser.parse_args()
+
+    os.environ['PATH'] = fake_sysroot.STUBS_DIR + os.pathsep + os.environ.get('PATH', "")
+    tmpdir = tempfile.mkdtemp(prefix="storage-probe-bench-")
+    try:
+        calibration = calibrate()
+        print("calibration: %.4fs" % calibration)
+        results = run(args.size or SIZES, args.repeat, calibration, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(calibration=calibration, results=results), f, indent=2, sort_keys=True)
+
+    baselines = load_baselines(args.baselines)
+    if args.update_baselines:
+        baselines.update((key, dict(normalized=r['normalized'], peak_memory=r['peak_memory']))
+                         for (key, r) in results.items() if r['correct'])
+        save_baselines(args.baselines, baselines)
+        return 0
+
+    regressions = compare(results, baselines, args.tolerance, calibration)
+    for regression in regressions:
+        print("REGRESSION: %s" % regression)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
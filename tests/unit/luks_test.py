@@ -0,0 +1,111 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from storage_lsr.luks import parse_luks_dump
+
+LUKS2_DUMP = """LUKS header information
+Version:       \t2
+Epoch:         \t3
+Metadata area: \t16384 [bytes]
+Keyslots area: \t16744448 [bytes]
+UUID:          \t4d1fa6f4-0f4e-4b3c-9c9f-2f0a3c1e6c2b
+Label:         \t(no label)
+Subsystem:     \t(no subsystem)
+Flags:       \t(no flags)
+
+Data segments:
+  0: crypt
+\toffset: 16777216 [bytes]
+\tlength: (whole device)
+\tcipher: aes-xts-plain64
+\tsector: 4096 [bytes]
+
+Keyslots:
+  0: luks2
+\tKey:        512 bits
+\tPriority:   normal
+\tCipher:     aes-xts-plain64
+\tCipher key: 512 bits
+\tPBKDF:      argon2id
+\tTime cost:  4
+\tMemory:     65536
+\tThreads:    4
+\tSalt:       4b 1d 63 0c 9a 37 ba 83 62 1c 9e 2c 4a 8e 47 d8
+\t            1f 2c 1d 36 a3 7f 47 9e 52 42 c8 3c 2e 0c 23 29
+\tAF stripes: 4000
+\tAF hash:    sha256
+\tArea offset:32768 [bytes]
+\tArea length:258048 [bytes]
+\tDigest ID:  0
+  1: luks2
+\tKey:        512 bits
+\tPriority:   normal
+\tCipher:     aes-xts-plain64
+\tCipher key: 512 bits
+\tPBKDF:      pbkdf2
+\tHash:       sha256
+\tIterations: 1000
+\tSalt:       5e 0a 1f 2c 1d 36 a3 7f 47 9e 52 42 c8 3c 2e 0c
+\tAF stripes: 4000
+\tAF hash:    sha256
+\tArea offset:290816 [bytes]
+\tArea length:258048 [bytes]
+\tDigest ID:  0
+Tokens:
+Digests:
+  0: pbkdf2
+\tHash:       sha256
+\tIterations: 129774
+\tSalt:       80 61 1b 06 d1 a1 ba 64 09 9b 36 1e 4a 2f 85 7b
+\tDigest:     e1 8a 6a 1e 5c 0b 6f 36 37 e7 2b 19 9a 8f 0d 61
+"""
+
+LUKS1_DUMP = """LUKS header information for /dev/sdb1
+
+Version:       \t1
+Cipher name:   \taes
+Cipher mode:   \txts-plain64
+Hash spec:     \tsha256
+Payload offset:\t4096
+MK bits:       \t512
+MK digest:     \t0b 8e 4d 58 d2 4c 38 72 2e 0b 62 1d 4f 1f 8f 3b 2c 61 3a 2c
+MK salt:       \t26 3b 34 c8 0e 63 6a 9b 11 7d 27 a3 1b 32 3e 6c
+MK iterations: \t121362
+UUID:          \t3b2bc4a4-9e5d-4d8a-8e0e-0d7d9d0c4d56
+
+Key Slot 0: ENABLED
+\tIterations:         \t1000
+\tSalt:               \t5b 1c 33 d4 0e 6b 8b 0d 8e 1d 24 e2 2a 73 35 cd
+\tKey material offset:\t8
+\tAF stripes:            \t4000
+Key Slot 1: DISABLED
+Key Slot 2: DISABLED
+"""
+
+
+def test_parse_luks2_dump():
+    assert parse_luks_dump(LUKS2_DUMP) == dict(encryption_pbkdf="argon2id",
+                                               encryption_pbkdf_memory=65536,
+                                               encryption_pbkdf_iterations=4,
+                                               encryption_sector_size=4096)
+
+
+def test_parse_luks2_dump_pbkdf2():
+    # only the first key slot counts, and the iterations of the digest do not
+    dump = LUKS2_DUMP.replace("argon2id", "pbkdf2")
+    dump = dump.replace("\tTime cost:  4\n\tMemory:     65536\n", "\tHash:       sha256\n\tIterations: 2000\n")
+    assert parse_luks_dump(dump) == dict(encryption_pbkdf="pbkdf2",
+                                         encryption_pbkdf_iterations=2000,
+                                         encryption_sector_size=4096)
+
+
+def test_parse_luks1_dump():
+    assert parse_luks_dump(LUKS1_DUMP) == dict(encryption_pbkdf="pbkdf2",
+                                               encryption_pbkdf_iterations=1000,
+                                               encryption_sector_size=512)
+
+
+def test_parse_luks_dump_unknown():
+    assert parse_luks_dump("") == dict()
+    assert parse_luks_dump("Version:       \t3\n") == dict()
@@ -0,0 +1,54 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import pytest
+
+from storage_lsr.mkfs import merge_options, raid_data_disks, stripe_options, xfs_agcount
+
+KiB = 1024
+GiB = 1024 ** 3
+TiB = 1024 ** 4
+
+
+@pytest.mark.parametrize('options, derived, merged', [
+    ("", [("-d", ["su=64k", "sw=4"])], "-d su=64k,sw=4"),
+    ("-m crc=1", [("-d", ["su=64k", "sw=4"]), ("-K", [])], "-m crc=1 -d su=64k,sw=4 -K"),
+    ("-d su=128k,sw=2", [("-d", ["su=64k", "sw=4", "agcount=8"])], "-d su=128k,sw=2,agcount=8"),
+    ("-d sunit=256,swidth=1024", [("-d", ["su=64k", "sw=4"])], "-d sunit=256,swidth=1024"),
+    ("-E stride=32 -E nodiscard", [("-E", ["stride=16", "stripe_width=64", "nodiscard"])],
+     "-E stride=32 -E nodiscard,stripe_width=64"),
+    ("-K", [("-K", [])], "-K"),
+])
+def test_merge_options(options, derived, merged):
+    assert merge_options(options, derived)[0] == merged
+
+
+def test_merge_options_reports_additions():
+    assert merge_options("-E lazy_itable_init=0", [("-E", ["nodiscard", "lazy_itable_init=1"])]) == \
+        ("-E lazy_itable_init=0,nodiscard", [("-E", ["nodiscard"])])
+    assert merge_options(None, [("-K", [])]) == ("-K", [("-K", [])])
+
+
+@pytest.mark.parametrize('level, devices, data_disks', [("raid0", 4, 4), ("raid5", 4, 3), ("6", 6, 4),
+                                                        ("raid10", 4, 2), ("raid1", 2, None),
+                                                        ("linear", 3, None), ("raid6", 2, None)])
+def test_raid_data_disks(level, devices, data_disks):
+    assert raid_data_disks(level, devices) == data_disks
+
+
+def test_xfs_agcount():
+    assert xfs_agcount(3, None) is None
+    assert xfs_agcount(3, 100 * GiB) == 6
+    assert xfs_agcount(4, 100 * GiB) == 4
+    assert xfs_agcount(4, 10 * TiB) == 12
+    # allocation groups would be too small
+    assert xfs_agcount(12, 64 * 1024 * KiB) is None
+
+
+def test_stripe_options():
+    assert stripe_options("xfs", 512 * KiB, 3, 100 * GiB) == [("-d", ["su=512k", "sw=3", "agcount=6"])]
+    assert stripe_options("xfs", 64 * KiB, 4) == [("-d", ["su=64k", "sw=4"])]
+    assert stripe_options("ext4", 512 * KiB, 3) == [("-E", ["stride=128", "stripe_width=384"])]
+    assert stripe_options("ext4", 512 * KiB, 1) == []
+    assert stripe_options("swap", 512 * KiB, 3) == []
@@ -0,0 +1,42 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from storage_lsr.plan import PLAN_VERSION, check_plan, compare_actions, digest, make_plan
+
+
+def _action(action, device, fs_type=None, size=None):
+    return dict(action=action, fs_type=fs_type, device=device, size=size)
+
+
+def test_digest():
+    assert digest(dict(a=1, b=[2, 3])) == digest(dict(b=[2, 3], a=1))
+    assert digest(dict(a=1)) != digest(dict(a=2))
+
+
+def test_check_plan():
+    plan = make_plan("abc", "def", [], [], [])
+    assert plan['version'] == PLAN_VERSION
+    assert check_plan(plan, "abc", "def") == []
+    assert check_plan(plan, "xyz", "def") == ["storage configuration has changed since the plan was made"]
+    assert check_plan(plan, "abc", "xyz") == ["plan was made for a different specification"]
+
+    plan['version'] = PLAN_VERSION + 1
+    assert check_plan(plan, "abc", "def") == ["unsupported plan version '%d'" % (PLAN_VERSION + 1)]
+    assert check_plan("plan", "abc", "def") == ["unsupported plan version 'None'"]
+
+
+def test_compare_actions():
+    planned = [_action("create device", "/dev/sda1", size=1024),
+               _action("create format", "/dev/sda1", fs_type="xfs")]
+    assert compare_actions(planned, [dict(a, uuid="123") for a in planned]) == []
+    assert compare_actions(planned, planned[:1]) == ["1 actions scheduled instead of the planned 2"]
+    assert compare_actions(planned, [_action("create device", "/dev/sda1", size=2048), planned[1]]) == \
+        ["action 1 is 'create device /dev/sda1 (size 2048, fs_type None)' "
+         "instead of the planned 'create device /dev/sda1 (size 1024, fs_type None)'"]
+    assert compare_actions(planned, [planned[0], _action("create format", "/dev/sda1", fs_type="ext4")]) == \
+        ["action 2 is 'create format /dev/sda1 (size None, fs_type ext4)' "
+         "instead of the planned 'create format /dev/sda1 (size None, fs_type xfs)'"]
+    assert compare_actions(planned, [planned[0], _action("create format", "/dev/sdb1", fs_type="xfs")]) == \
+        ["action 2 is 'create format /dev/sdb1 (size None, fs_type xfs)' "
+         "instead of the planned 'create format /dev/sda1 (size None, fs_type xfs)'"]
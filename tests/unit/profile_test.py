@@ -0,0 +1,60 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+
+from storage_lsr.profile import start_profiler
+
+
+class FakeModule(object):
+    def __init__(self, profile):
+        self.params = dict(profile=profile)
+        self.result = None
+
+    def exit_json(self, **kwargs):
+        self.result = kwargs
+
+    def fail_json(self, msg, **kwargs):
+        self.result = dict(kwargs, msg=msg, failed=True)
+
+
+def busy():
+    return sum(i * i for i in range(10000))
+
+
+def test_profiler_disabled():
+    module = FakeModule(None)
+    exit_json = module.exit_json
+    assert start_profiler(module, "test") is None
+    assert module.exit_json == exit_json
+
+
+def test_profiler(tmpdir):
+    directory = str(tmpdir.join("profiles"))
+    module = FakeModule(directory)
+    assert start_profiler(module, "test") is not None
+
+    busy()
+    module.exit_json(changed=False)
+
+    profile = module.result['profile']
+    assert module.result['changed'] is False
+    assert os.path.dirname(profile['path']) == directory
+    assert os.path.basename(profile['path']).startswith("test-")
+    assert os.path.getsize(profile['path']) > 0
+    assert any("(busy)" in entry['function'] for entry in profile['top'])
+    if 'memory_path' in profile:
+        assert profile['peak_memory'] > 0
+        with open(profile['memory_path']) as f:
+            assert f.readline().startswith("peak: ")
+
+
+def test_profiler_failure(tmpdir):
+    module = FakeModule(str(tmpdir))
+    start_profiler(module, "test")
+    module.fail_json("something went wrong", changed=False)
+
+    assert module.result['failed']
+    assert module.result['msg'] == "something went wrong"
+    assert os.path.exists(module.result['profile']['path'])
@@ -0,0 +1,208 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+
+import pytest
+
+from storage_lsr.plan import digest
+from storage_lsr.sysfs import Sysfs, get_device_state, get_populate_scope
+from storage_lsr.sysroot import SysRoot
+
+
+class FakeHost(object):
+    """ /sys/class/block and /dev under a temporary root, with relative links like the real ones. """
+    def __init__(self, root):
+        self.sysroot = SysRoot(root)
+        self._minor = 0
+        for path in ("/sys/class/block", "/sys/devices/virtual/block", "/dev/mapper", "/dev/md", "/run/udev/data"):
+            os.makedirs(self.sysroot.path(path))
+
+    def _write(self, path, data=""):
+        if not os.path.isdir(os.path.dirname(self.sysroot.path(path))):
+            os.makedirs(os.path.dirname(self.sysroot.path(path)))
+        with open(self.sysroot.path(path), "w") as f:
+            f.write(data)
+
+    def _add(self, name, devpath):
+        os.makedirs(self.sysroot.path(devpath))
+        os.symlink("../../%s" % devpath[len("/sys/"):], self.sysroot.path("/sys/class/block/%s" % name))
+        self._write("/dev/%s" % name)
+        self._minor += 1
+        self._write("/sys/class/block/%s/dev" % name, "8:%d\n" % self._minor)
+        self._write("/sys/class/block/%s/size" % name, "2097152\n")
+
+    def udev_data(self, name, **properties):
+        """ Record what udev found on a device. """
+        with open(self.sysroot.path("/sys/class/block/%s/dev" % name)) as f:
+            dev = f.read().strip()
+        self._write("/run/udev/data/b%s" % dev, "S:disk/by-id/x\nI:1234\n" +
+                    "".join("E:%s=%s\n" % item for item in sorted(properties.items())) + "G:systemd\n")
+
+    def md_state(self, name, array_state, degraded):
+        self._write("/sys/class/block/%s/md/array_state" % name, array_state + "\n")
+        self._write("/sys/class/block/%s/md/degraded" % name, "%d\n" % degraded)
+
+    def disk(self, name, partitions=0):
+        self._add(name, "/sys/devices/pci0000:00/block/%s" % name)
+        for i in range(1, partitions + 1):
+            self._add("%s%d" % (name, i), "/sys/devices/pci0000:00/block/%s/%s%d" % (name, name, i))
+            self._write("/sys/class/block/%s%d/partition" % (name, i), "%d\n" % i)
+
+    def stack(self, name, slaves, dm_name=None, md_name=None):
+        """ Add a dm or md device on top of the slaves. """
+        self._add(name, "/sys/devices/virtual/block/%s" % name)
+        for slave in slaves:
+            self._write("/sys/class/block/%s/slaves/%s" % (name, slave))
+            self._write("/sys/class/block/%s/holders/%s" % (slave, name))
+        if dm_name:
+            self._write("/sys/class/block/%s/dm/name" % name, dm_name + "\n")
+            os.symlink("../%s" % name, self.sysroot.path("/dev/mapper/%s" % dm_name))
+        if md_name:
+            os.symlink("../%s" % name, self.sysroot.path("/dev/md/%s" % md_name))
+
+
+@pytest.fixture
+def host(tmpdir):
+    host = FakeHost(str(tmpdir))
+    host.disk("sda", partitions=2)  # not used by any of the specs
+    host.stack("dm-9", ["sda2"], dm_name="system-root")
+    return host
+
+
+def _scope(host, pools=None, volumes=None, **kwargs):
+    return get_populate_scope(pools or [], volumes or [], sysfs=Sysfs(host.sysroot), **kwargs)
+
+
+def test_neighbors(host):
+    sysfs = Sysfs(host.sysroot)
+    assert sorted(sysfs.neighbors("sda")) == ["sda1", "sda2"]
+    assert sorted(sysfs.neighbors("sda2")) == ["dm-9", "sda"]
+    assert sysfs.neighbors("dm-9") == ["sda2"]
+    assert sysfs.dm_name("dm-9") == "system-root"
+    assert sysfs.dm_name("sda") is None
+    assert sysfs.kernel_name("/dev/mapper/system-root") == "dm-9"
+    assert sysfs.kernel_name("system-root") == "dm-9"
+    assert sysfs.kernel_name("sdz") is None
+
+
+def test_plain_disks(host):
+    host.disk("sdb")
+    host.disk("sdc")
+    assert _scope(host, volumes=[dict(name="data", disks=["sdb"])]) == ["sdb"]
+    assert _scope(host, volumes=[dict(name="data", disks=["/dev/sdb", "sdc"])]) == ["sdb", "sdc"]
+    assert _scope(host, volumes=[dict(name="data", disks=["sdz"])]) == []
+
+
+def test_lvm(host):
+    host.disk("sdb")
+    host.disk("sdc", partitions=1)
+    host.stack("dm-0", ["sdb", "sdc1"], dm_name="vg1-lv1")
+    host.stack("dm-1", ["sdb"], dm_name="vg1-lv2")
+
+    # the other disk of the volume group comes along with the one in the spec
+    expected = ["dm-0", "dm-1", "sdb", "sdc", "sdc1", "vg1-lv1", "vg1-lv2"]
+    assert _scope(host, pools=[dict(name="vg1", disks=["sdb"], volumes=[])]) == expected
+
+    # an existing volume group is found by its name alone
+    assert _scope(host, pools=[dict(name="vg1", volumes=[dict(name="lv1")])]) == expected
+
+    # but not by the name of another one that merely shares its prefix
+    host.disk("sdd")
+    host.stack("dm-2", ["sdd"], dm_name="vg1--x-lv1")
+    assert _scope(host, pools=[dict(name="vg1", volumes=[])]) == expected
+    assert _scope(host, pools=[dict(name="vg1-x", volumes=[])]) == ["dm-2", "sdd", "vg1--x-lv1"]
+
+
+def test_md(host):
+    host.disk("sdb")
+    host.disk("sdc")
+    host.stack("md127", ["sdb", "sdc"], md_name="data")
+
+    assert _scope(host, volumes=[dict(name="data", type="raid", disks=["sdb"])]) == ["md127", "sdb", "sdc"]
+    assert _scope(host, volumes=[dict(name="data", type="raid")]) == ["md127", "sdb", "sdc"]
+
+    # the array of a raid pool is named after the pool
+    host.disk("sdd")
+    host.disk("sde")
+    host.stack("md126", ["sdd", "sde"], md_name="vg2-1")
+    host.stack("dm-3", ["md126"], dm_name="vg2-lv1")
+    assert _scope(host, pools=[dict(name="vg2", volumes=[])]) == ["dm-3", "md126", "sdd", "sde", "vg2-lv1"]
+
+
+def test_luks(host):
+    host.disk("sdb", partitions=1)
+    host.stack("dm-4", ["sdb1"], dm_name="luks-1234")
+    host.stack("dm-5", ["dm-4"], dm_name="vg3-lv1")
+
+    expected = ["dm-4", "dm-5", "luks-1234", "sdb", "sdb1", "vg3-lv1"]
+    assert _scope(host, pools=[dict(name="vg3", disks=["sdb"], volumes=[])]) == expected
+    assert _scope(host, volumes=[dict(name="data", disks=["sdb"])]) == expected
+
+
+def test_include_exclude(host):
+    host.disk("sdb")
+    host.disk("nvme0n1")
+    host.disk("nvme1n1")
+
+    volumes = [dict(name="data", disks=["sdb"])]
+    assert _scope(host, volumes=volumes, include=["nvme*"]) == ["nvme0n1", "nvme1n1", "sdb"]
+    assert _scope(host, volumes=volumes, include=["nvme*"], exclude=["nvme1*"]) == ["nvme0n1", "sdb"]
+    assert _scope(host, volumes=volumes, include=["system-*"]) == ["sdb", "system-root"]
+
+
+def test_device_state(host):
+    host.disk("sdb", partitions=1)
+    host.disk("sdc")
+    host.stack("dm-0", ["sdb1"], dm_name="vg1-lv1")
+    host.udev_data("sdb", ID_PART_TABLE_TYPE="gpt", ID_PART_TABLE_UUID="1111")
+    host.udev_data("sdb1", ID_FS_TYPE="LVM2_member", ID_FS_UUID="2222")
+    host.udev_data("dm-0", ID_FS_TYPE="xfs", ID_FS_UUID="3333")
+    host.udev_data("sdc", ID_FS_TYPE="ext4", ID_FS_UUID="4444")
+    sysfs = Sysfs(host.sysroot)
+    pools = [dict(name="vg1", disks=["sdb"], volumes=[dict(name="lv1", _device="/dev/mapper/vg1-lv1")])]
+
+    state = get_device_state(pools, [], sysfs=sysfs)
+    assert sorted(state['devices']) == ["dm-0", "sdb", "sdb1"]
+    assert state['devices']['dm-0']['signature']['ID_FS_TYPE'] == "xfs"
+    assert sorted(state['ids']) == ["/dev/mapper/vg1-lv1", "/dev/sdb"]
+    fingerprint = digest(state)
+
+    # another disk's signature does not matter
+    host.udev_data("sdc")
+    assert digest(get_device_state(pools, [], sysfs=sysfs)) == fingerprint
+
+    # but the file system of the volume being wiped or recreated does
+    host.udev_data("dm-0")
+    assert digest(get_device_state(pools, [], sysfs=sysfs)) != fingerprint
+    host.udev_data("dm-0", ID_FS_TYPE="xfs", ID_FS_UUID="5555")
+    assert digest(get_device_state(pools, [], sysfs=sysfs)) != fingerprint
+    host.udev_data("dm-0", ID_FS_TYPE="xfs", ID_FS_UUID="3333")
+    assert digest(get_device_state(pools, [], sysfs=sysfs)) == fingerprint
+
+    # and so does the signature of a member partition that is not in the specification
+    host.udev_data("sdb1", ID_FS_TYPE="crypto_LUKS", ID_FS_UUID="6666")
+    assert digest(get_device_state(pools, [], sysfs=sysfs)) != fingerprint
+
+
+def test_device_state_md(host):
+    host.disk("sdb")
+    host.disk("sdc")
+    host.stack("md127", ["sdb", "sdc"], md_name="data")
+    host.md_state("md127", "clean", 0)
+    sysfs = Sysfs(host.sysroot)
+    volumes = [dict(name="data", type="raid", disks=["sdb", "sdc"], _device="/dev/md/data")]
+
+    state = get_device_state([], volumes, sysfs=sysfs)
+    assert state['devices']['md127']['md'] == dict(array_state="clean\n", degraded="0\n")
+    assert 'md' not in state['devices']['sdb']
+    fingerprint = digest(state)
+
+    # a member dropping out of the array
+    host.md_state("md127", "clean", 1)
+    assert digest(get_device_state([], volumes, sysfs=sysfs)) != fingerprint
+    host.md_state("md127", "clean", 0)
+    assert digest(get_device_state([], volumes, sysfs=sysfs)) == fingerprint
+    host.md_state("md127", "inactive", 0)
+    assert digest(get_device_state([], volumes, sysfs=sysfs)) != fingerprint
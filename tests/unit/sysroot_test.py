@@ -0,0 +1,37 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import os
+
+from storage_lsr.sysroot import SysRoot
+
+
+def test_default_root():
+    sysroot = SysRoot()
+    assert sysroot.path("/dev/sda") == "/dev/sda"
+    assert sysroot.strip("/dev/sda") == "/dev/sda"
+
+    sysroot = SysRoot("/")
+    assert sysroot.path("/sys/class/block/sda") == "/sys/class/block/sda"
+
+
+def test_root(tmpdir):
+    root = str(tmpdir)
+    sysroot = SysRoot(root + "/")
+    assert sysroot.path("/dev/sda") == root + "/dev/sda"
+    assert sysroot.strip(root + "/dev/sda") == "/dev/sda"
+    assert sysroot.strip(root) == "/"
+    assert sysroot.strip(root + "x/dev/sda") == root + "x/dev/sda"
+
+
+def test_links(tmpdir):
+    root = str(tmpdir)
+    sysroot = SysRoot(root)
+    os.makedirs(sysroot.path("/dev/disk/by-label"))
+    os.makedirs(sysroot.path("/dev/disk/by-uuid"))
+    open(sysroot.path("/dev/sda1"), "w").close()
+    os.symlink("../../sda1", sysroot.path("/dev/disk/by-label/data"))
+
+    assert sysroot.realpath("/dev/disk/by-label/data") == "/dev/sda1"
+    assert sorted(sysroot.glob("/dev/disk/by-*")) == ["/dev/disk/by-label", "/dev/disk/by-uuid"]
@@ -0,0 +1,50 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import pytest
+
+from storage_lsr.timing import Timings
+
+
+class FakeClock(object):
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def test_phases():
+    timings = Timings(clock=FakeClock(1.0), cpu_clock=FakeClock(0.5))
+    with timings.phase("reset"):
+        pass
+    with timings.phase("schedule"):
+        with timings.item("pools", "foo"):
+            pass
+        with timings.item("pools", "foo"):
+            pass
+        with timings.item("volumes", "bar"):
+            pass
+    with timings.phase("reset"):
+        pass
+
+    report = timings.report
+    assert [p['name'] for p in report['phases']] == ["reset", "schedule"]
+    assert report['phases'][0] == dict(name="reset", wall=2.0, cpu=1.0)
+    # one tick for each clock read within the phase
+    assert report['phases'][1]['wall'] == 7.0
+    assert report['pools'] == dict(foo=2.0)
+    assert report['volumes'] == dict(bar=1.0)
+    assert report['total'] == dict(wall=9.0, cpu=1.5)
+
+
+def test_failed_phase():
+    timings = Timings(clock=FakeClock(1.0), cpu_clock=FakeClock(1.0))
+    with pytest.raises(ValueError):
+        with timings.phase("process"):
+            raise ValueError()
+
+    assert timings.report['phases'] == [dict(name="process", wall=1.0, cpu=1.0)]
@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+from storage_lsr.trace import REDACTED, CommandTrace, redact
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+def test_redact():
+    assert redact(["mkfs.xfs", "-f", "/dev/sda1"], ["secret"]) == ["mkfs.xfs", "-f", "/dev/sda1"]
+    assert redact(["tool", "--passphrase", "abc", "x"], []) == ["tool", "--passphrase", REDACTED, "x"]
+    assert redact(["tool", "--password=abc"], []) == ["tool", "--password=" + REDACTED]
+    assert redact(["tool", "pw:secret"], ["secret"]) == ["tool", "pw:" + REDACTED]
+
+
+def test_wrap():
+    trace = CommandTrace(secrets=["secret"], clock=FakeClock())
+
+    def run_program(argv, root='/'):
+        return (0 if argv[0] != "false" else 1, "")
+
+    traced = trace.wrap(run_program)
+    assert traced(["udevadm", "settle"]) == (0, "")
+    execute = trace.attributed(lambda: traced(["false", "secret"]), "create device sda1")
+    assert execute() == (1, "")
+
+    assert trace.commands == [dict(argv=["udevadm", "settle"], start=1.0, duration=1.0, rc=0, action=None),
+                              dict(argv=["false", REDACTED], start=3.0, duration=1.0, rc=1,
+                                   action="create device sda1")]
+
+
+def test_log_func():
+    trace = CommandTrace(clock=FakeClock())
+    messages = list()
+    log = trace.log_func(chained=lambda level, msg: messages.append(msg))
+    log(6, "Running [3] lvcreate -n lv1 -L 1024K vg1 ...")
+    log(6, "[3] stdout: Logical volume created")
+    log(6, "...done [3] (exit code: 0)")
+    log(6, "...done [7] (exit code: 5)")
+
+    assert len(messages) == 4
+    assert trace.commands == [dict(argv=["lvcreate", "-n", "lv1", "-L", "1024K", "vg1"], start=1.0,
+                                   duration=1.0, rc=0, action=None)]
+
+
+def test_summary():
+    trace = CommandTrace(clock=FakeClock())
+    traced = trace.wrap(lambda argv: (0, ""))
+    for argv in (["udevadm", "settle"], ["/usr/sbin/mkfs.xfs", "/dev/sda1"], ["udevadm", "settle"]):
+        traced(argv)
+
+    summary = trace.summary()
+    assert summary['tools'] == {"udevadm settle": dict(count=2, time=2.0), "mkfs.xfs": dict(count=1, time=1.0)}
+    assert summary['total_time'] == 3.0
+    assert len(summary['commands']) == 3
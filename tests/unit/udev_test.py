@@ -0,0 +1,97 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import errno
+import socket
+import struct
+
+from storage_lsr.udev import UdevSync
+
+
+def _message(properties):
+    """ Return a libudev monitor message with the given properties. """
+    data = b"".join(("%s=%s" % item).encode("utf-8") + b"\0" for item in sorted(properties.items()))
+    header = struct.pack("=8sIIIIIIII", b"libudev\0", 0xfeedcafe, 40, 40, len(data), 0, 0, 0, 0)
+    return header + data
+
+
+class FailingSocket(object):
+    """ A socket that is readable but loses events. """
+    def __init__(self, sock):
+        self._sock = sock
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def recv(self, size):
+        raise socket.error(errno.ENOBUFS, "No buffer space available")
+
+
+class Recorder(object):
+    def __init__(self):
+        self.calls = list()
+
+    def __call__(self, *args):
+        self.calls.append(args)
+        return 0
+
+
+def test_parse_event():
+    event = UdevSync._parse_event(_message(dict(ACTION="change", SUBSYSTEM="block", DEVPATH="/devices/x/sda1")))
+    assert event['ACTION'] == "change"
+    assert event['SUBSYSTEM'] == "block"
+    assert event['DEVPATH'] == "/devices/x/sda1"
+
+    assert UdevSync._parse_event(b"change@/devices/x/sda1\0ACTION=change\0") == dict()
+    assert UdevSync._parse_event(b"libudev\0") == dict()
+
+
+def test_wait():
+    settle = Recorder()
+    udev_sync = UdevSync(Recorder(), settle, timeout=5)
+    (sock, peer) = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        peer.send(_message(dict(ACTION="add", SUBSYSTEM="block", DEVPATH="/devices/x/sdb")))
+        peer.send(_message(dict(ACTION="change", SUBSYSTEM="block", DEVPATH="/devices/x/sdb")))
+        peer.send(_message(dict(ACTION="change", SUBSYSTEM="block", DEVPATH="/devices/x/sda1")))
+        names = set(["sda1", "sdb"])
+        udev_sync._wait(sock, names)
+        assert names == set()
+        assert settle.calls == []
+    finally:
+        sock.close()
+        peer.close()
+
+
+def test_wait_settles_after_lost_events():
+    settle = Recorder()
+    udev_sync = UdevSync(Recorder(), settle, timeout=5)
+    (sock, peer) = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        peer.send(b"x")
+        udev_sync._wait(FailingSocket(sock), set(["sda1"]))
+        assert settle.calls == [()]
+    finally:
+        sock.close()
+        peer.close()
+
+
+def test_sync_without_monitor(monkeypatch):
+    run_program = Recorder()
+    settle = Recorder()
+    udev_sync = UdevSync(run_program, settle)
+    monkeypatch.setattr(udev_sync, "_open_monitor", lambda: None)
+
+    udev_sync.sync()
+    assert run_program.calls == []
+
+    class Device(object):
+        path = "/dev/sda1"
+
+    udev_sync.add(Device())
+    udev_sync.add(Device())
+    udev_sync.sync()
+    assert run_program.calls == [(["udevadm", "trigger", "--action=change", "--subsystem-match=block",
+                                   "--sysname-match=sda1"],)]
+    assert settle.calls == [()]
@@ -0,0 +1,154 @@
+from __future__ import absolute_import, division, print_function
+
+__metaclass__ = type
+
+import pytest
+
+from storage_lsr.validate import find_duplicate_names, validate_spec
+
+
+pool_defaults = dict(type="lvm")
+volume_defaults = dict(type="lvm")
+
+
+def test_find_duplicate_names():
+    assert find_duplicate_names([]) == []
+    assert find_duplicate_names([{'name': 'a'}, {'name': 'b'}]) == []
+    assert find_duplicate_names([{'name': 'b'}, {'name': 'a'}, {'name': 'b'},
+                                 {'name': 'a'}, {'name': 'b'}]) == ['a', 'b']
+
+
+def test_valid_spec():
+    pools = [{'name': 'foo', 'disks': ['sda', 'sdb'],
+              'volumes': [{'name': 'test1', 'size': '5g'}, {'name': 'test2', 'size': 512}]}]
+    volumes = [{'name': 'bar', 'type': 'disk', 'disks': ['sdc']},
+               {'name': 'baz', 'type': 'raid', 'disks': ['sdd', 'sde', 'sdf'], 'raid_level': 'raid1',
+                'raid_device_count': 2, 'raid_spare_count': 1}]
+
+    assert validate_spec(pools, volumes, pool_defaults, volume_defaults) == []
+
+    # types get filled in from the pool and the defaults
+    assert pools[0]['type'] == 'lvm'
+    assert pools[0]['volumes'][0]['type'] == 'lvm'
+    assert volumes[0]['type'] == 'disk'
+
+
+def test_all_errors_reported():
+    pools = [{'name': 'foo', 'type': 'zfs'},
+             {'name': 'bar', 'disks': 'sda',
+              'volumes': [{'name': 'test1', 'size': 'xyz GiB'}, {'name': 'test1', 'size': 'none'}]},
+             {'name': 'bar'}]
+    volumes = [{'name': 'baz', 'type': 'raid', 'disks': ['sdd', 'sde'], 'raid_level': 'raid1',
+                'raid_device_count': 2, 'raid_spare_count': 1},
+               {'name': 'baz', 'type': 'btrfs'}]
+
+    errors = validate_spec(pools, volumes, pool_defaults, volume_defaults)
+    assert errors == ["multiple pools with the same name: bar",
+                      "Pool 'foo' has unknown type 'zfs'",
+                      "pool disks must be specified as a list",
+                      "multiple volumes in pool 'bar' with the same name: test1",
+                      "invalid size specification for volume 'test1': 'xyz GiB'",
+                      "invalid size specification for volume 'test1': 'none'",
+                      "multiple volumes with the same name: baz",
+                      "failed to set up 'baz': cannot create RAID with 2 members (2 active and 1 spare)",
+                      "Volume 'baz' has unknown type 'btrfs'"]
+
+
+@pytest.mark.parametrize('actives, spares, valid', [(None, None, True),
+                                                    (3, None, True),
+                                                    (None, 0, True),
+                                                    (2, 1, True),
+                                                    (4, None, False),
+                                                    (-1, None, False),
+                                                    (None, 'x', False),
+                                                    (1, 1, False)])
+def test_raid_counts(actives, spares, valid):
+    pools = [{'name': 'foo', 'disks': ['sda', 'sdb', 'sdc'], 'raid_level': 'raid5',
+              'raid_device_count': actives, 'raid_spare_count': spares}]
+    assert (validate_spec(pools, [], pool_defaults, volume_defaults) == []) == valid
+
+
+def test_missing_names():
+    assert validate_spec([{'disks': []}], [], pool_defaults, volume_defaults) == ["all pools must have a name"]
+    assert validate_spec([{'name': 'foo', 'volumes': [{'size': '1g'}]}], [], pool_defaults, volume_defaults) == \
+        ["all volumes in pool 'foo' must have a name"]
+
+
+@pytest.mark.parametrize('settings, valid', [(dict(), True),
+                                             (dict(encryption_pbkdf='argon2id', encryption_pbkdf_memory=65536,
+                                                   encryption_pbkdf_iterations=4, encryption_sector_size=4096), True),
+                                             (dict(encryption_pbkdf='pbkdf2', encryption_pbkdf_time=100,
+                                                   encryption_luks_version='luks1'), True),
+                                             (dict(encryption_pbkdf='scrypt'), False),
+                                             (dict(encryption_pbkdf_memory=0), False),
+                                             (dict(encryption_pbkdf_time='fast'), False),
+                                             (dict(encryption_sector_size=3000), False),
+                                             (dict(encryption_sector_size=4096, encryption_luks_version='luks1'), False),
+                                             (dict(encryption_pbkdf='argon2i', encryption_luks_version='luks1'), False)])
+def test_encryption_settings(settings, valid):
+    volume = dict(name='test1', size='1g', encryption=True)
+    volume.update(settings)
+    pools = [{'name': 'foo', 'disks': ['sda'], 'encryption': True, 'volumes': [volume]}]
+    pools[0].update(settings)
+    errors = validate_spec(pools, [], pool_defaults, volume_defaults)
+    assert (errors == []) == valid
+    # the pool and its volume are checked on their own
+    assert len(errors) == (0 if valid else 2)
+
+
+@pytest.mark.parametrize('bitmap, valid', [(None, True), ('internal', True), ('none', True),
+                                           ('64 MiB', True), ('64m', True), ('external', False)])
+def test_raid_bitmap(bitmap, valid):
+    volumes = [{'name': 'baz', 'type': 'raid', 'disks': ['sdd', 'sde'], 'raid_level': 'raid1',
+                'raid_bitmap': bitmap}]
+    assert (validate_spec([], volumes, pool_defaults, volume_defaults) == []) == valid
+
+
+def test_thin_provisioning():
+    thin_pools = [{'name': 'tp', 'size': '10g', 'chunk_size': '64k', 'discard': 'nopassdown'}]
+    pools = [{'name': 'foo', 'disks': ['sda'], 'thin_pools': thin_pools,
+              'volumes': [{'name': 'thin1', 'type': 'thin', 'size': '1t'},
+                          {'name': 'snap1', 'type': 'thin', 'thin_origin': 'thin1'}]}]
+    assert validate_spec(pools, [], pool_defaults, volume_defaults) == []
+
+    thin_pools.extend([{'name': 'tp', 'size': 'big', 'discard': 'always'}])
+    volumes = [{'name': 'thin2', 'type': 'thin', 'size': '1g'}]
+    assert validate_spec(pools, volumes, pool_defaults, volume_defaults) == \
+        ["multiple thin pools in pool 'foo' with the same name: tp",
+         "invalid size 'big' for thin pool 'tp'",
+         "invalid discard 'always' for thin pool 'tp'",
+         "thin volume 'thin2' must belong to an lvm pool"]
+
+    pools = [{'name': 'bar', 'type': 'partition', 'disks': ['sdb'], 'thin_pools': [{'name': 'tp', 'size': '1g'}],
+              'volumes': [{'name': 'thin3', 'type': 'thin', 'size': '1g'}]}]
+    assert validate_spec(pools, [], pool_defaults, volume_defaults) == \
+        ["thin pools are only supported in lvm pools (pool 'bar')",
+         "thin volume 'thin3' must belong to an lvm pool"]
+
+
+@pytest.mark.parametrize('settings, valid', [(dict(cache_size='10g', cache_mode='writeback', cache_devices=['nvme0n1']), True),
+                                             (dict(cache_size=0, cache_mode='writecache'), True),
+                                             (dict(cache_size='lots'), False),
+                                             (dict(cache_mode='writearound'), False),
+                                             (dict(cache_devices='nvme0n1'), False),
+                                             (dict(type='thin', cache_size='10g'), False)])
+def test_cache_settings(settings, valid):
+    volume = dict(name='test1', size='1t')
+    volume.update(settings)
+    pools = [{'name': 'foo', 'disks': ['sda', 'nvme0n1'], 'volumes': [volume]}]
+    assert (validate_spec(pools, [], pool_defaults, volume_defaults) == []) == valid
+
+
+@pytest.mark.parametrize('settings, valid', [(dict(stripes=4), True),
+                                             (dict(stripes=2, stripe_size='64 KiB'), True),
+                                             (dict(stripe_size='1m'), True),
+                                             (dict(stripes=0), False),
+                                             (dict(stripes='all'), False),
+                                             (dict(stripes=2, stripe_size='48k'), False),
+                                             (dict(stripes=2, stripe_size='512'), False),
+                                             (dict(type='thin', stripes=2), False)])
+def test_stripe_settings(settings, valid):
+    volume = dict(name='test1', size='1t')
+    volume.update(settings)
+    pools = [{'name': 'foo', 'disks': ['sda', 'sdb', 'sdc', 'sdd'], 'volumes': [volume]}]
+    assert (validate_spec(pools, [], pool_defaults, volume_defaults) == []) == valid